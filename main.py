@@ -1,24 +1,39 @@
-from fastapi import FastAPI, HTTPException, Request, Query, Depends, Security, File, UploadFile, Form
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Request, Response, Query, Depends, Security, File, UploadFile, Form
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import httpx
 from datetime import datetime, timedelta, timezone
 import pytz
 import logging
+import asyncio
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, NamedTuple
+from functools import lru_cache
 import re
+import os
 import json
+import base64
+from collections import OrderedDict, deque
 import hashlib
 from pathlib import Path
 import sqlite3
 import threading
+import queue
 import time
-import shutil
+import tempfile
 import yaml
 import secrets
 import bcrypt
+import shutil
+import gzip
+import zlib
+import mmap
+
+try:
+    import detools
+except ImportError:  # Delta updates are disabled without detools
+    detools = None
 
 # Pydantic models for OTA requests
 class OTAStatusReport(BaseModel):
@@ -26,6 +41,14 @@ class OTAStatusReport(BaseModel):
     error_message: Optional[str] = None
     install_duration: Optional[int] = None  # seconds
     current_version: Optional[str] = None
+    timestamp: Optional[datetime] = None  # when it happened, for events buffered on the device
+
+class OTAStatusBatch(BaseModel):
+    events: List[OTAStatusReport]
+
+class FirmwareRolloutUpdate(BaseModel):
+    percentage: Optional[int] = None
+    state: Optional[str] = None  # 'active', 'paused', 'complete'
 
 class FirmwareUpload(BaseModel):
     version: str
@@ -176,11 +199,282 @@ def get_admin_user(request: Request):
     return user_info
 
 # Database setup
-DB_PATH = Path("/tmp/energy_pebble.db")
+DB_PATH = Path(os.getenv("ENERGY_PEBBLE_DB_PATH", "/tmp/energy_pebble.db"))
 db_lock = threading.Lock()
 
+# Whether the devices_search FTS5 trigram index is available (set by init_database)
+device_search_fts_enabled = False
+
+# Rebuilds the devices_search row for one device; {device} is the devices.id expression
+DEVICE_SEARCH_REFRESH_SQL = '''
+    DELETE FROM devices_search WHERE rowid = {device};
+    INSERT INTO devices_search (rowid, device_id, mac_address, client_ip, nickname, owner)
+    SELECT d.id, d.device_id, d.mac_address, d.client_ip, ud.nickname, ud.user_id
+    FROM devices d
+    LEFT JOIN user_devices ud ON d.id = ud.device_id
+    WHERE d.id = {device}
+    LIMIT 1;
+'''
+
+def init_device_search_index(cursor) -> bool:
+    """Create the trigram search index over devices and the triggers keeping it in sync.
+
+    Returns False if this SQLite build has no FTS5 trigram tokenizer; search then
+    falls back to LIKE scans.
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'devices_search'")
+    exists = cursor.fetchone() is not None
+    
+    try:
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS devices_search USING fts5(
+                device_id, mac_address, client_ip, nickname, owner,
+                tokenize = 'trigram'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        logger.warning(f"Device search index unavailable, falling back to LIKE search: {e}")
+        return False
+    
+    cursor.executescript(f'''
+        CREATE TRIGGER IF NOT EXISTS devices_search_insert AFTER INSERT ON devices BEGIN
+            {DEVICE_SEARCH_REFRESH_SQL.format(device='new.id')}
+        END;
+        CREATE TRIGGER IF NOT EXISTS devices_search_update AFTER UPDATE OF device_id, mac_address, client_ip ON devices
+        WHEN old.device_id IS NOT new.device_id OR old.mac_address IS NOT new.mac_address OR old.client_ip IS NOT new.client_ip
+        BEGIN
+            {DEVICE_SEARCH_REFRESH_SQL.format(device='new.id')}
+        END;
+        CREATE TRIGGER IF NOT EXISTS devices_search_delete AFTER DELETE ON devices BEGIN
+            DELETE FROM devices_search WHERE rowid = old.id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS user_devices_search_insert AFTER INSERT ON user_devices BEGIN
+            {DEVICE_SEARCH_REFRESH_SQL.format(device='new.device_id')}
+        END;
+        CREATE TRIGGER IF NOT EXISTS user_devices_search_update AFTER UPDATE ON user_devices BEGIN
+            {DEVICE_SEARCH_REFRESH_SQL.format(device='old.device_id')}
+            {DEVICE_SEARCH_REFRESH_SQL.format(device='new.device_id')}
+        END;
+        CREATE TRIGGER IF NOT EXISTS user_devices_search_delete AFTER DELETE ON user_devices BEGIN
+            {DEVICE_SEARCH_REFRESH_SQL.format(device='old.device_id')}
+        END;
+    ''')
+    
+    if not exists:
+        logger.info("Building device search index")
+        cursor.execute('''
+            INSERT INTO devices_search (rowid, device_id, mac_address, client_ip, nickname, owner)
+            SELECT d.id, d.device_id, d.mac_address, d.client_ip, ud.nickname, ud.user_id
+            FROM devices d
+            LEFT JOIN user_devices ud ON d.id = ud.device_id
+            GROUP BY d.id
+        ''')
+    
+    return True
+
+def init_ota_stats_counters(cursor):
+    """Create the OTA statistics counter tables and the triggers maintaining them.
+
+    Status totals and daily activity are bumped by every ota_logs insert, and the
+    version distribution follows devices.current_firmware_version, so the stats
+    endpoints read a handful of precomputed rows. Compaction deletes raw logs
+    without touching the counters.
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'ota_stats_counters'")
+    exists = cursor.fetchone() is not None
+    
+    cursor.executescript('''
+        CREATE TABLE IF NOT EXISTS ota_stats_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS ota_daily_activity (
+            day TEXT PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS firmware_version_counts (
+            version TEXT PRIMARY KEY,
+            device_count INTEGER NOT NULL DEFAULT 0
+        );
+        
+        CREATE TRIGGER IF NOT EXISTS ota_logs_stats_insert AFTER INSERT ON ota_logs BEGIN
+            INSERT INTO ota_stats_counters (name, value) VALUES ('status:' || COALESCE(new.status, 'check'), 1)
+            ON CONFLICT (name) DO UPDATE SET value = value + 1;
+            INSERT INTO ota_daily_activity (day, count) VALUES (DATE(COALESCE(new.check_timestamp, CURRENT_TIMESTAMP)), 1)
+            ON CONFLICT (day) DO UPDATE SET count = count + 1;
+        END;
+        
+        CREATE TRIGGER IF NOT EXISTS devices_version_count_insert AFTER INSERT ON devices
+        WHEN new.current_firmware_version IS NOT NULL
+        BEGIN
+            INSERT INTO firmware_version_counts (version, device_count) VALUES (new.current_firmware_version, 1)
+            ON CONFLICT (version) DO UPDATE SET device_count = device_count + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS devices_version_count_update AFTER UPDATE OF current_firmware_version ON devices
+        WHEN old.current_firmware_version IS NOT new.current_firmware_version
+        BEGIN
+            UPDATE firmware_version_counts SET device_count = device_count - 1 WHERE version = old.current_firmware_version;
+            DELETE FROM firmware_version_counts WHERE version = old.current_firmware_version AND device_count <= 0;
+            INSERT INTO firmware_version_counts (version, device_count)
+            SELECT new.current_firmware_version, 1 WHERE new.current_firmware_version IS NOT NULL
+            ON CONFLICT (version) DO UPDATE SET device_count = device_count + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS devices_version_count_delete AFTER DELETE ON devices
+        WHEN old.current_firmware_version IS NOT NULL
+        BEGIN
+            UPDATE firmware_version_counts SET device_count = device_count - 1 WHERE version = old.current_firmware_version;
+            DELETE FROM firmware_version_counts WHERE version = old.current_firmware_version AND device_count <= 0;
+        END;
+    ''')
+    
+    if not exists:
+        logger.info("Building OTA statistics counters")
+        cursor.execute('''
+            INSERT INTO ota_stats_counters (name, value)
+            SELECT 'status:' || status, SUM(count)
+            FROM (
+                SELECT COALESCE(status, 'check') as status, COUNT(*) as count FROM ota_logs GROUP BY 1
+                UNION ALL
+                SELECT status, SUM(count) FROM ota_log_daily GROUP BY status
+            )
+            GROUP BY status
+        ''')
+        cursor.execute('''
+            INSERT INTO ota_daily_activity (day, count)
+            SELECT day, SUM(count)
+            FROM (
+                SELECT DATE(check_timestamp) as day, COUNT(*) as count FROM ota_logs GROUP BY 1
+                UNION ALL
+                SELECT day, SUM(count) FROM ota_log_daily GROUP BY day
+            )
+            WHERE day IS NOT NULL
+            GROUP BY day
+        ''')
+        cursor.execute('''
+            INSERT INTO firmware_version_counts (version, device_count)
+            SELECT current_firmware_version, COUNT(*)
+            FROM devices
+            WHERE current_firmware_version IS NOT NULL
+            GROUP BY current_firmware_version
+        ''')
+
+def init_firmware_blob_store(cursor):
+    """Create the firmware blob table and the triggers counting references to blobs
+    from firmware images and their compressed variants."""
+    cursor.executescript('''
+        CREATE TABLE IF NOT EXISTS firmware_blobs (
+            sha256 TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        
+        CREATE TRIGGER IF NOT EXISTS firmware_blob_ref_insert AFTER INSERT ON firmware_versions
+        WHEN new.blob_sha256 IS NOT NULL
+        BEGIN
+            UPDATE firmware_blobs SET refcount = refcount + 1 WHERE sha256 = new.blob_sha256;
+        END;
+        CREATE TRIGGER IF NOT EXISTS firmware_blob_ref_update AFTER UPDATE OF blob_sha256 ON firmware_versions
+        WHEN old.blob_sha256 IS NOT new.blob_sha256
+        BEGIN
+            UPDATE firmware_blobs SET refcount = refcount - 1 WHERE sha256 = old.blob_sha256;
+            UPDATE firmware_blobs SET refcount = refcount + 1 WHERE sha256 = new.blob_sha256;
+        END;
+        CREATE TRIGGER IF NOT EXISTS firmware_blob_ref_delete AFTER DELETE ON firmware_versions
+        WHEN old.blob_sha256 IS NOT NULL
+        BEGIN
+            UPDATE firmware_blobs SET refcount = refcount - 1 WHERE sha256 = old.blob_sha256;
+        END;
+        
+        CREATE TRIGGER IF NOT EXISTS firmware_variant_blob_ref_insert AFTER INSERT ON firmware_variants
+        WHEN new.blob_sha256 IS NOT NULL
+        BEGIN
+            UPDATE firmware_blobs SET refcount = refcount + 1 WHERE sha256 = new.blob_sha256;
+        END;
+        CREATE TRIGGER IF NOT EXISTS firmware_variant_blob_ref_update AFTER UPDATE OF blob_sha256 ON firmware_variants
+        WHEN old.blob_sha256 IS NOT new.blob_sha256
+        BEGIN
+            UPDATE firmware_blobs SET refcount = refcount - 1 WHERE sha256 = old.blob_sha256;
+            UPDATE firmware_blobs SET refcount = refcount + 1 WHERE sha256 = new.blob_sha256;
+        END;
+        CREATE TRIGGER IF NOT EXISTS firmware_variant_blob_ref_delete AFTER DELETE ON firmware_variants
+        WHEN old.blob_sha256 IS NOT NULL
+        BEGIN
+            UPDATE firmware_blobs SET refcount = refcount - 1 WHERE sha256 = old.blob_sha256;
+        END;
+    ''')
+
+def init_install_telemetry(cursor):
+    """Create the per-version install telemetry tables (see record_install_telemetry).
+
+    Histograms of install durations are backfilled from the raw OTA logs when the
+    tables are created; time-to-complete needs first-offer times and starts empty.
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'ota_install_histograms'")
+    exists = cursor.fetchone() is not None
+    
+    cursor.executescript('''
+        CREATE TABLE IF NOT EXISTS ota_install_histograms (
+            version TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (version, metric, bucket)
+        );
+        CREATE TABLE IF NOT EXISTS ota_install_failures (
+            version TEXT NOT NULL,
+            reason TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (version, reason)
+        );
+        CREATE TABLE IF NOT EXISTS ota_offers (
+            device_id TEXT NOT NULL,
+            version TEXT NOT NULL,
+            first_offered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (device_id, version)
+        );
+    ''')
+    
+    if not exists:
+        logger.info("Building install telemetry histograms")
+        cursor.execute('''
+            SELECT current_version, install_duration FROM ota_logs
+            WHERE status = 'completed' AND install_duration IS NOT NULL
+              AND current_version IN (SELECT version FROM firmware_versions)
+        ''')
+        for version, install_duration in cursor.fetchall():
+            bump_install_histogram(cursor, version, 'install_duration', install_duration)
+        
+        # Failures are attributed to the version offered before them, as for new reports
+        cursor.execute('''
+            SELECT COALESCE((
+                       SELECT offer.offered_version FROM ota_logs offer
+                       WHERE offer.device_id = failure.device_id AND offer.offered_version IS NOT NULL AND offer.id < failure.id
+                       ORDER BY offer.id DESC LIMIT 1
+                   ), failure.current_version),
+                   failure.error_message
+            FROM ota_logs failure
+            WHERE failure.status = 'failed'
+        ''')
+        for version, error_message in cursor.fetchall():
+            if is_known_firmware_version(cursor, version):
+                bump_install_failure(cursor, version, error_message)
+
+def bump_ota_check_counters(cursor):
+    """Count an OTA check that is not written to ota_logs (see touch_ota_check)."""
+    cursor.execute('''
+        INSERT INTO ota_stats_counters (name, value) VALUES ('status:check', 1)
+        ON CONFLICT (name) DO UPDATE SET value = value + 1
+    ''')
+    cursor.execute('''
+        INSERT INTO ota_daily_activity (day, count) VALUES (DATE('now'), 1)
+        ON CONFLICT (day) DO UPDATE SET count = count + 1
+    ''')
+
 def init_database():
     """Initialize the SQLite database with required tables."""
+    global device_search_fts_enabled
+    
     with sqlite3.connect(DB_PATH) as conn:
         cursor = conn.cursor()
         
@@ -298,6 +592,60 @@ def init_database():
             )
         ''')
         
+        # Daily per-(version, status) rollups of compacted ota_logs rows
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ota_log_daily (
+                day DATE NOT NULL,
+                version TEXT NOT NULL DEFAULT '',
+                status TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, version, status)
+            )
+        ''')
+        
+        # Staged rollouts of stable releases (releases without a row are fully rolled out)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS firmware_rollouts (
+                version TEXT PRIMARY KEY,
+                percentage INTEGER NOT NULL DEFAULT 1,
+                state TEXT NOT NULL DEFAULT 'active',
+                stage_started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                stage_successes INTEGER NOT NULL DEFAULT 0,
+                stage_failures INTEGER NOT NULL DEFAULT 0,
+                updated_by TEXT
+            )
+        ''')
+        
+        # Binary deltas between stable releases
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS firmware_deltas (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                from_version TEXT NOT NULL,
+                from_version_key INTEGER NOT NULL,
+                to_version TEXT NOT NULL,
+                filename TEXT UNIQUE NOT NULL,
+                checksum TEXT NOT NULL,
+                md5_checksum TEXT NOT NULL,
+                file_size INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(from_version, to_version)
+            )
+        ''')
+        
+        # Precompressed variants of firmware images, per content coding
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS firmware_variants (
+                filename TEXT NOT NULL,
+                encoding TEXT NOT NULL,
+                variant_filename TEXT UNIQUE NOT NULL,
+                checksum TEXT NOT NULL,
+                md5_checksum TEXT NOT NULL,
+                file_size INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (filename, encoding)
+            )
+        ''')
+        
         # Create API tokens table for bearer token authentication
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS api_tokens (
@@ -384,43 +732,86 @@ def init_database():
         except sqlite3.OperationalError:
             pass  # Column already exists
         
+        try:
+            cursor.execute('ALTER TABLE firmware_versions ADD COLUMN version_key INTEGER')
+            logger.info("Added version_key column to firmware_versions table")
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+        
+        try:
+            cursor.execute(f'ALTER TABLE devices ADD COLUMN current_firmware_version_key INTEGER DEFAULT {version_sort_key("v1.0.0")}')
+            logger.info("Added current_firmware_version_key column to devices table")
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+        
+        try:
+            cursor.execute('ALTER TABLE firmware_versions ADD COLUMN blob_sha256 TEXT')
+            logger.info("Added blob_sha256 column to firmware_versions table")
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+        
+        try:
+            cursor.execute('ALTER TABLE firmware_variants ADD COLUMN blob_sha256 TEXT')
+            logger.info("Added blob_sha256 column to firmware_variants table")
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+        
+        for column in ('product', 'variant', 'channel'):
+            try:
+                cursor.execute(f'ALTER TABLE firmware_versions ADD COLUMN {column} TEXT')
+                logger.info(f"Added {column} column to firmware_versions table")
+            except sqlite3.OperationalError:
+                pass  # Column already exists
+        
+        # Latest release per product, variant and channel, rebuilt with the firmware catalog
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS firmware_latest (
+                product TEXT NOT NULL,
+                variant TEXT NOT NULL,
+                channel TEXT NOT NULL,
+                version TEXT NOT NULL,
+                PRIMARY KEY (product, variant, channel)
+            )
+        ''')
+        
         # Migration: Remove CHECK constraint from ota_logs.status column
         try:
-            # Check if constraint exists by trying to insert an invalid status
-            cursor.execute("INSERT INTO ota_logs (device_id, status) VALUES ('test', 'invalid_status')")
-            cursor.execute("DELETE FROM ota_logs WHERE device_id = 'test'")
-            logger.info("ota_logs table already migrated (no CHECK constraint)")
-        except sqlite3.IntegrityError:
-            # Constraint exists, need to migrate
-            logger.info("Migrating ota_logs table to remove status CHECK constraint")
-            
-            # Create new table without CHECK constraint
-            cursor.execute('''
-                CREATE TABLE ota_logs_new (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    device_id TEXT NOT NULL,
-                    check_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    current_version TEXT,
-                    offered_version TEXT,
-                    status TEXT DEFAULT 'check',
-                    error_message TEXT,
-                    install_duration INTEGER,
-                    ip_address TEXT,
-                    user_agent TEXT
-                )
-            ''')
+            # Check the table definition for the constraint (a probe insert would
+            # fire the ota_logs triggers and count towards the OTA statistics)
+            cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'ota_logs'")
+            if not re.search(r'\bCHECK\s*\(', cursor.fetchone()[0], re.IGNORECASE):
+                logger.info("ota_logs table already migrated (no CHECK constraint)")
+            else:
+                # Constraint exists, need to migrate
+                logger.info("Migrating ota_logs table to remove status CHECK constraint")
             
-            # Copy data from old table
-            cursor.execute('''
-                INSERT INTO ota_logs_new 
-                SELECT * FROM ota_logs
-            ''')
+                # Create new table without CHECK constraint
+                cursor.execute('''
+                    CREATE TABLE ota_logs_new (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        device_id TEXT NOT NULL,
+                        check_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        current_version TEXT,
+                        offered_version TEXT,
+                        status TEXT DEFAULT 'check',
+                        error_message TEXT,
+                        install_duration INTEGER,
+                        ip_address TEXT,
+                        user_agent TEXT
+                    )
+                ''')
+            
+                # Copy data from old table
+                cursor.execute('''
+                    INSERT INTO ota_logs_new 
+                    SELECT * FROM ota_logs
+                ''')
             
-            # Drop old table and rename new one
-            cursor.execute('DROP TABLE ota_logs')
-            cursor.execute('ALTER TABLE ota_logs_new RENAME TO ota_logs')
+                # Drop old table and rename new one
+                cursor.execute('DROP TABLE ota_logs')
+                cursor.execute('ALTER TABLE ota_logs_new RENAME TO ota_logs')
             
-            logger.info("Successfully migrated ota_logs table")
+                logger.info("Successfully migrated ota_logs table")
         except Exception as e:
             logger.error(f"Error during ota_logs migration: {e}")
             pass
@@ -428,10 +819,28 @@ def init_database():
         # Create index for performance
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_devices_ip ON devices (client_ip)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_devices_fingerprint ON devices (device_fingerprint)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_devices_last_seen ON devices (last_seen)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_devices_user ON user_devices (user_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_devices_device ON user_devices (device_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_ota_logs_device ON ota_logs (device_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_ota_logs_timestamp ON ota_logs (check_timestamp)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_ota_logs_status_timestamp ON ota_logs (status, check_timestamp)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_firmware_version ON firmware_versions (version)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_firmware_stable_version_key ON firmware_versions (is_stable, version_key)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_firmware_product_channel ON firmware_versions (product, variant, channel, version_key)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_devices_firmware_version_key ON devices (current_firmware_version_key)')
+        
+        # Substring search index for the admin device search
+        device_search_fts_enabled = init_device_search_index(cursor)
+        
+        # Incrementally maintained OTA statistics
+        init_ota_stats_counters(cursor)
+        
+        # Content-addressed firmware blobs with reference counts
+        init_firmware_blob_store(cursor)
+        
+        # Per-version install duration, time-to-complete and failure reason histograms
+        init_install_telemetry(cursor)
         
         # Insert initial predefined devices if the table is empty
         cursor.execute('SELECT COUNT(*) FROM predefined_devices')
@@ -483,6 +892,34 @@ def init_database():
         else:
             logger.info(f"Firmware versions table already contains {firmware_count} versions")
         
+        # Backfill version sort keys for rows written without them (e.g. by older code or scripts)
+        cursor.execute('SELECT id, version FROM firmware_versions WHERE version_key IS NULL')
+        firmware_keys = [(version_sort_key(version), firmware_id) for firmware_id, version in cursor.fetchall()]
+        cursor.executemany('UPDATE firmware_versions SET version_key = ? WHERE id = ?', firmware_keys)
+        
+        # Backfill product, variant and channel the same way; uploads named files
+        # product_version[_variant].bin and only knew stable and beta (is_stable)
+        cursor.execute('''
+            SELECT id, version, filename, is_stable FROM firmware_versions
+            WHERE product IS NULL OR variant IS NULL OR channel IS NULL
+        ''')
+        firmware_targets = [
+            (*parse_firmware_filename(filename, version), 'stable' if is_stable else 'beta', firmware_id)
+            for firmware_id, version, filename, is_stable in cursor.fetchall()
+        ]
+        cursor.executemany('''
+            UPDATE firmware_versions
+            SET product = COALESCE(product, ?), variant = COALESCE(variant, ?), channel = COALESCE(channel, ?)
+            WHERE id = ?
+        ''', firmware_targets)
+        
+        cursor.execute('SELECT DISTINCT current_firmware_version FROM devices WHERE current_firmware_version IS NOT NULL')
+        device_versions = [(version_sort_key(version), version) for (version,) in cursor.fetchall()]
+        cursor.executemany('''
+            UPDATE devices SET current_firmware_version_key = ?
+            WHERE current_firmware_version = ? AND current_firmware_version_key IS NOT ?
+        ''', [(key, version, key) for key, version in device_versions])
+        
         conn.commit()
         logger.info("Database initialized successfully")
 
@@ -495,24 +932,28 @@ def get_real_client_ip(request: Request) -> str:
         (request.client.host if request.client else "unknown")
     )
 
+# Device status thresholds (minutes since last seen)
+DEVICE_ONLINE_MINUTES = 20
+DEVICE_RECENTLY_ACTIVE_MINUTES = 60
+
 def calculate_device_status(last_seen_str: str) -> tuple[str, int]:
     """Calculate device status based on last seen timestamp.
-    
+
     Energy Pebbles poll every 15 minutes, so:
     - online: <= 20 minutes ago
-    - recently_active: <= 60 minutes ago  
+    - recently_active: <= 60 minutes ago
     - offline: > 60 minutes ago
-    
+
     Returns: (status, minutes_since_last_seen)
     """
     try:
         last_seen_dt = datetime.fromisoformat(last_seen_str) if last_seen_str else datetime.min.replace(tzinfo=pytz.UTC)
         now = datetime.now(pytz.UTC)
         minutes_since_last_seen = (now - last_seen_dt).total_seconds() / 60
-        
-        if minutes_since_last_seen <= 20:
+
+        if minutes_since_last_seen <= DEVICE_ONLINE_MINUTES:
             status = "online"
-        elif minutes_since_last_seen <= 60:
+        elif minutes_since_last_seen <= DEVICE_RECENTLY_ACTIVE_MINUTES:
             status = "recently_active"
         else:
             status = "offline"
@@ -521,6 +962,38 @@ def calculate_device_status(last_seen_str: str) -> tuple[str, int]:
     except Exception:
         return "offline", 999999
 
+DEVICE_STATUSES = ("online", "recently_active", "offline")
+
+def get_device_status_cutoffs(now: Optional[datetime] = None) -> tuple[str, str]:
+    """Get the (online, recently_active) last_seen cutoffs as stored-format strings.
+
+    last_seen is stored by the sqlite3 datetime adapter as 'YYYY-MM-DD HH:MM:SS.ffffff+00:00',
+    so these cutoffs compare correctly as text and can use the last_seen index.
+    """
+    now = now or datetime.now(pytz.UTC)
+    online_cutoff = (now - timedelta(minutes=DEVICE_ONLINE_MINUTES)).isoformat(" ")
+    active_cutoff = (now - timedelta(minutes=DEVICE_RECENTLY_ACTIVE_MINUTES)).isoformat(" ")
+    return online_cutoff, active_cutoff
+
+def device_status_sql(cutoffs: tuple[str, str]) -> tuple[str, list]:
+    """SQL expression (and params) computing a device's status from d.last_seen."""
+    online_cutoff, active_cutoff = cutoffs
+    return (
+        "CASE WHEN d.last_seen >= ? THEN 'online' "
+        "WHEN d.last_seen >= ? THEN 'recently_active' "
+        "ELSE 'offline' END",
+        [online_cutoff, active_cutoff]
+    )
+
+def device_status_condition(status: str, cutoffs: tuple[str, str]) -> tuple[str, list]:
+    """SQL WHERE condition (and params) matching devices with the given status."""
+    online_cutoff, active_cutoff = cutoffs
+    if status == "online":
+        return "d.last_seen >= ?", [online_cutoff]
+    if status == "recently_active":
+        return "(d.last_seen >= ? AND d.last_seen < ?)", [active_cutoff, online_cutoff]
+    return "(d.last_seen < ? OR d.last_seen IS NULL)", [active_cutoff]
+
 def create_device_fingerprint(client_ip: str, user_agent: str, timestamp: datetime) -> str:
     """Create a unique fingerprint for device identification."""
     # Use client IP, user agent, and hour of first request to create fingerprint
@@ -552,26 +1025,322 @@ def generate_mac_from_device_id(device_id: str) -> str:
         # Fallback to default if conversion fails
         return "00:00:00:00:00:00"
 
-def get_device_mac_address(cursor, conn, device_db_id: int, device_id: str, stored_mac: str) -> str:
-    """Get MAC address for a device: stored, predefined, or generated."""
+# In-memory device registry: device_id -> {id, mac_address, user_id, nickname}.
+# Loaded once at startup and kept current by every write path, so device polls
+# and device listings resolve ids, MACs and owners without SQL round trips.
+device_registry: Dict[str, Dict[str, Any]] = {}
+device_registry_ids: Dict[int, str] = {}
+predefined_device_macs: Dict[str, str] = {}
+device_registry_lock = threading.Lock()
+REGISTRY_UNCHANGED = object()  # default for registry fields a write path leaves as they are
+
+def load_device_registry():
+    """Load known devices and predefined MAC addresses into the in-memory registry."""
+    global predefined_device_macs
+
+    with db_lock:
+        with sqlite3.connect(DB_PATH) as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('SELECT device_id, mac_address FROM predefined_devices')
+            predefined = {row[0]: row[1] for row in cursor.fetchall() if row[1]}
+
+            # Store predefined MACs for devices that never got one, once at startup
+            # (previously this happened lazily inside GET requests)
+            cursor.execute('SELECT id, device_id FROM devices WHERE mac_address IS NULL AND device_id IS NOT NULL')
+            backfill = [(predefined[device_id], db_id) for db_id, device_id in cursor.fetchall() if device_id in predefined]
+            if backfill:
+                cursor.executemany('UPDATE devices SET mac_address = ? WHERE id = ?', backfill)
+                conn.commit()
+                logger.info(f"Stored predefined MAC addresses for {len(backfill)} devices")
+
+            cursor.execute('''
+                SELECT d.id, d.device_id, d.mac_address, ud.user_id, ud.nickname
+                FROM devices d
+                LEFT JOIN user_devices ud ON d.id = ud.device_id
+                WHERE d.device_id IS NOT NULL
+            ''')
+            rows = cursor.fetchall()
+
+    with device_registry_lock:
+        predefined_device_macs = predefined
+        device_registry.clear()
+        device_registry_ids.clear()
+        for db_id, device_id, mac_address, owner, nickname in rows:
+            device_registry[device_id] = {
+                'id': db_id,
+                'mac_address': mac_address or predefined.get(device_id) or generate_mac_from_device_id(device_id),
+                'user_id': owner,
+                'nickname': nickname
+            }
+            device_registry_ids[db_id] = device_id
+
+    logger.info(f"Loaded {len(rows)} devices into device registry")
+
+def get_registered_device(device_id: str) -> Optional[Dict[str, Any]]:
+    """Get the registry entry for a device_id, or None if the device is unknown."""
+    with device_registry_lock:
+        entry = device_registry.get(device_id)
+        return dict(entry) if entry else None
+
+def register_device(db_id: int, device_id: str, mac_address: Optional[str]):
+    """Add or refresh a device in the registry after it was written to the database."""
+    with device_registry_lock:
+        entry = device_registry.get(device_id)
+        if entry and entry['id'] != db_id:
+            device_registry_ids.pop(entry['id'], None)
+        if not entry:
+            entry = device_registry[device_id] = {'user_id': None, 'nickname': None}
+        entry['id'] = db_id
+        entry['mac_address'] = mac_address or predefined_device_macs.get(device_id) or generate_mac_from_device_id(device_id)
+        device_registry_ids[db_id] = device_id
+
+def update_registered_device_claim(db_id: int, user_id: Any = REGISTRY_UNCHANGED, nickname: Any = REGISTRY_UNCHANGED):
+    """Record a device's owner and/or nickname after user_devices was written.
+
+    Fields that are not passed are left as they are; None clears them.
+    """
+    with device_registry_lock:
+        device_id = device_registry_ids.get(db_id)
+        if device_id is None:
+            return
+        entry = device_registry[device_id]
+        if user_id is not REGISTRY_UNCHANGED:
+            entry['user_id'] = user_id
+        if nickname is not REGISTRY_UNCHANGED:
+            entry['nickname'] = nickname
+
+def rename_registered_device_owner(old_user_id: str, new_user_id: str):
+    """Move all registry claims from one user to another after a username change."""
+    with device_registry_lock:
+        for entry in device_registry.values():
+            if entry['user_id'] == old_user_id:
+                entry['user_id'] = new_user_id
+
+def unregister_device(db_id: int):
+    """Remove a deleted device from the registry."""
+    with device_registry_lock:
+        device_id = device_registry_ids.pop(db_id, None)
+        if device_id is not None:
+            device_registry.pop(device_id, None)
+
+def get_device_mac_address(device_id: str, stored_mac: Optional[str]) -> str:
+    """Get MAC address for a device: stored, registry/predefined, or generated."""
     if stored_mac:
         return stored_mac
-    
-    # Check predefined_devices table for MAC address
-    cursor.execute('SELECT mac_address FROM predefined_devices WHERE device_id = ?', (device_id,))
-    predefined_result = cursor.fetchone()
-    if predefined_result and predefined_result[0]:
-        mac_address = predefined_result[0]
-        # Update devices table with predefined MAC for future use
-        cursor.execute('UPDATE devices SET mac_address = ? WHERE id = ?', (mac_address, device_db_id))
-        conn.commit()
-        return mac_address
-    
+
+    with device_registry_lock:
+        entry = device_registry.get(device_id)
+        if entry:
+            return entry['mac_address']
+        if device_id in predefined_device_macs:
+            return predefined_device_macs[device_id]
+
     # Generate MAC from device_id as fallback
     return generate_mac_from_device_id(device_id)
 
+# Fleet presence tracker: devices are kept in online / recently_active / offline
+# sets that are updated on every heartbeat. Pending state changes sit in a
+# one-minute timer wheel, so counts are read without scanning the devices table.
+PRESENCE_WHEEL_SLOTS = 64  # minutes; must exceed DEVICE_RECENTLY_ACTIVE_MINUTES
+PRESENCE_OFFLINE_HISTORY_SECONDS = 3600
+presence_lock = threading.Lock()
+presence_last_seen: Dict[str, float] = {}
+presence_state: Dict[str, str] = {}
+presence_sets: Dict[str, set] = {"online": set(), "recently_active": set(), "offline": set()}
+presence_went_offline: "OrderedDict[str, float]" = OrderedDict()
+presence_wheel: List[set] = [set() for _ in range(PRESENCE_WHEEL_SLOTS)]
+presence_wheel_minute: Optional[int] = None
+
+def parse_last_seen_timestamp(last_seen) -> Optional[float]:
+    """Convert a stored last_seen value to epoch seconds (naive values are UTC)."""
+    if not last_seen:
+        return None
+    try:
+        last_seen_dt = last_seen if isinstance(last_seen, datetime) else datetime.fromisoformat(str(last_seen).replace('Z', '+00:00'))
+        if last_seen_dt.tzinfo is None:
+            last_seen_dt = last_seen_dt.replace(tzinfo=timezone.utc)
+        return last_seen_dt.timestamp()
+    except ValueError:
+        return None
+
+def _presence_status(last_seen_ts: float, now_ts: float) -> tuple[str, Optional[float]]:
+    """Return (status, timestamp of the next status change) for a last-seen time."""
+    online_until = last_seen_ts + DEVICE_ONLINE_MINUTES * 60
+    active_until = last_seen_ts + DEVICE_RECENTLY_ACTIVE_MINUTES * 60
+    if now_ts <= online_until:
+        return "online", online_until
+    if now_ts <= active_until:
+        return "recently_active", active_until
+    return "offline", None
+
+def _presence_set_state(device_id: str, status: str, changed_at: float):
+    """Move a device between presence sets (caller holds presence_lock)."""
+    previous = presence_state.get(device_id)
+    if previous == status:
+        return
+    if previous:
+        presence_sets[previous].discard(device_id)
+    presence_sets[status].add(device_id)
+    presence_state[device_id] = status
+
+    presence_went_offline.pop(device_id, None)
+    if status == "offline" and previous is not None:
+        presence_went_offline[device_id] = changed_at
+
+def _presence_schedule(device_id: str, due_ts: Optional[float]):
+    """Put a device in the wheel slot of its next status change (caller holds presence_lock)."""
+    if due_ts is None:
+        return
+    due_minute = -int(-due_ts // 60)  # ceil to the minute
+    if presence_wheel_minute is not None and due_minute <= presence_wheel_minute:
+        due_minute = presence_wheel_minute + 1
+    presence_wheel[due_minute % PRESENCE_WHEEL_SLOTS].add(device_id)
+
+def _presence_advance(now_ts: float):
+    """Fire all wheel slots up to now and prune old offline transitions (caller holds presence_lock)."""
+    global presence_wheel_minute
+
+    current_minute = int(now_ts // 60)
+    if presence_wheel_minute is None:
+        presence_wheel_minute = current_minute
+    elapsed = min(current_minute - presence_wheel_minute, PRESENCE_WHEEL_SLOTS)
+
+    for step in range(1, elapsed + 1):
+        slot = presence_wheel[(presence_wheel_minute + step) % PRESENCE_WHEEL_SLOTS]
+        due_devices = list(slot)
+        slot.clear()
+        for device_id in due_devices:
+            last_seen_ts = presence_last_seen.get(device_id)
+            if last_seen_ts is None:
+                continue
+            status, next_change = _presence_status(last_seen_ts, now_ts)
+            changed_at = last_seen_ts + DEVICE_RECENTLY_ACTIVE_MINUTES * 60 if status == "offline" else now_ts
+            _presence_set_state(device_id, status, changed_at)
+            _presence_schedule(device_id, next_change)
+    presence_wheel_minute = max(presence_wheel_minute, current_minute)
+
+    cutoff = now_ts - PRESENCE_OFFLINE_HISTORY_SECONDS
+    while presence_went_offline:
+        device_id, offline_at = next(iter(presence_went_offline.items()))
+        if offline_at >= cutoff:
+            break
+        presence_went_offline.popitem(last=False)
+
+def load_device_presence():
+    """Seed the presence tracker from the devices table at startup."""
+    with sqlite3.connect(DB_PATH) as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT device_id, last_seen FROM devices WHERE device_id IS NOT NULL')
+        rows = cursor.fetchall()
+
+    now_ts = time.time()
+    recent_offline = []
+    with presence_lock:
+        presence_last_seen.clear()
+        presence_state.clear()
+        presence_went_offline.clear()
+        for status_set in presence_sets.values():
+            status_set.clear()
+        for slot in presence_wheel:
+            slot.clear()
+
+        for device_id, last_seen in rows:
+            last_seen_ts = parse_last_seen_timestamp(last_seen) or 0.0
+            status, next_change = _presence_status(last_seen_ts, now_ts)
+            presence_last_seen[device_id] = last_seen_ts
+            _presence_set_state(device_id, status, now_ts)
+            _presence_schedule(device_id, next_change)
+
+            offline_at = last_seen_ts + DEVICE_RECENTLY_ACTIVE_MINUTES * 60
+            if status == "offline" and offline_at >= now_ts - PRESENCE_OFFLINE_HISTORY_SECONDS:
+                recent_offline.append((offline_at, device_id))
+
+        for offline_at, device_id in sorted(recent_offline):
+            presence_went_offline[device_id] = offline_at
+        _presence_advance(now_ts)
+
+    logger.info(f"Loaded presence for {len(rows)} devices")
+
+def record_device_presence(device_id: str, seen_at: Optional[float] = None):
+    """Record a device heartbeat and mark it online."""
+    now_ts = time.time()
+    seen_ts = seen_at if seen_at is not None else now_ts
+    with presence_lock:
+        _presence_advance(now_ts)
+        presence_last_seen[device_id] = seen_ts
+        status, next_change = _presence_status(seen_ts, now_ts)
+        _presence_set_state(device_id, status, now_ts)
+        _presence_schedule(device_id, next_change)
+
+def forget_device_presence(device_id: str):
+    """Drop a deleted device from the presence tracker."""
+    with presence_lock:
+        status = presence_state.pop(device_id, None)
+        if status:
+            presence_sets[status].discard(device_id)
+        presence_last_seen.pop(device_id, None)
+        presence_went_offline.pop(device_id, None)
+
+def get_presence_counts() -> Dict[str, int]:
+    """Get the number of online, recently active and offline devices."""
+    with presence_lock:
+        _presence_advance(time.time())
+        return {status: len(devices) for status, devices in presence_sets.items()}
+
+def get_recently_offline_devices() -> List[Dict[str, Any]]:
+    """Get devices that went offline within the last hour, most recent first."""
+    with presence_lock:
+        _presence_advance(time.time())
+        return [
+            {
+                "device_id": device_id,
+                "offline_since": datetime.fromtimestamp(offline_at, timezone.utc).isoformat()
+            }
+            for device_id, offline_at in reversed(presence_went_offline.items())
+        ]
+
+class SemanticVersion(NamedTuple):
+    """Parsed MAJOR.MINOR.PATCH firmware version."""
+    major: int
+    minor: int
+    patch: int
+    
+    # Each component gets 6 decimal digits in the integer sort key
+    COMPONENT_LIMIT = 1_000_000
+    
+    @property
+    def sort_key(self) -> int:
+        """Integer that orders like the version; stored in indexed *_version_key columns."""
+        return (self.major * self.COMPONENT_LIMIT + self.minor) * self.COMPONENT_LIMIT + self.patch
+    
+    def __str__(self) -> str:
+        return f"v{self.major}.{self.minor}.{self.patch}"
+
+@lru_cache(maxsize=4096)
+def parse_version(version: Optional[str]) -> Optional[SemanticVersion]:
+    """Parse 'v1.2.3' / '1.2.3' (missing minor/patch default to 0); None if not a plain semantic version."""
+    if not version:
+        return None
+    parts = version.strip().lstrip('vV').split('.')
+    if not 1 <= len(parts) <= 3 or not all(part.isdigit() for part in parts):
+        return None
+    numbers = [int(part) for part in parts] + [0] * (3 - len(parts))
+    if any(number >= SemanticVersion.COMPONENT_LIMIT for number in numbers):
+        return None
+    return SemanticVersion(*numbers)
+
+def version_sort_key(version: Optional[str]) -> Optional[int]:
+    """Integer sort key for a version string, or None if it can't be parsed."""
+    parsed = parse_version(version)
+    return parsed.sort_key if parsed else None
+
 def compare_versions(version1: str, version2: str) -> int:
     """Compare two version strings. Returns: -1 if v1 < v2, 0 if equal, 1 if v1 > v2"""
+    key1, key2 = version_sort_key(version1), version_sort_key(version2)
+    if key1 is not None and key2 is not None:
+        return (key1 > key2) - (key1 < key2)
+    
     try:
         # Remove 'v' prefix if present and split by dots
         v1_parts = [int(x) for x in version1.lstrip('v').split('.')]
@@ -596,36 +1365,258 @@ def version_is_newer(new_version: str, current_version: str) -> bool:
     """Check if new_version is newer than current_version"""
     return compare_versions(new_version, current_version) > 0
 
-def get_latest_firmware_for_device(device_id: str, current_version: str) -> dict:
-    """Get the latest available firmware for a device"""
+# Firmware is built per product (hardware) and variant, and released on a channel.
+# Channels are inclusive: a device on beta is offered beta and stable releases,
+# one on nightly gets everything. Devices that don't say get the defaults.
+FIRMWARE_CHANNELS = ('stable', 'beta', 'nightly')
+DEFAULT_FIRMWARE_PRODUCT = 'energy_pebble'
+DEFAULT_FIRMWARE_VARIANT = 'release'
+DEFAULT_FIRMWARE_CHANNEL = 'stable'
+
+def normalize_firmware_target(value: Optional[str], default: str) -> str:
+    """Sanitize a product or variant name the way uploads do; default if empty."""
+    return re.sub(r'[^a-zA-Z0-9_-]', '', (value or '').lower()) or default
+
+def parse_firmware_filename(filename: str, version: str) -> tuple[str, str]:
+    """Product and variant of an uploaded firmware file named product_version[_variant].bin"""
+    match = re.match(rf'^([a-z0-9_-]+?)_{re.escape(version)}(?:_([a-z0-9_-]+))?\.bin$', filename)
+    if not match:
+        return DEFAULT_FIRMWARE_PRODUCT, DEFAULT_FIRMWARE_VARIANT
+    return match.group(1), match.group(2) or DEFAULT_FIRMWARE_VARIANT
+
+# In-memory firmware catalog, keyed by (product, variant, channel), with the releases
+# offered on each key highest version first. The firmware table changes a few times
+# a month, so OTA checks are answered from memory and the catalog is reloaded
+# whenever a firmware version is uploaded or deleted.
+firmware_catalog: Dict[tuple, List[Dict[str, Any]]] = {}
+firmware_catalog_generation = 0
+firmware_catalog_lock = threading.Lock()
+
+# Download index of all firmware images by filename (any stability), with their
+# compressed variants; lets downloads skip the database entirely
+firmware_files: Dict[str, Dict[str, Any]] = {}
+
+# Per-(device_id, current_version) OTA answers for the current catalog generation
+firmware_answer_cache: Dict[tuple, Optional[Dict[str, Any]]] = {}
+FIRMWARE_ANSWER_CACHE_MAX = 10000
+
+def parse_target_devices(target_devices: Optional[str]) -> Optional[frozenset]:
+    """Parse a target_devices value into a set of device IDs (None = all devices)."""
+    if not target_devices or not target_devices.strip():
+        return None
+    try:
+        parsed = json.loads(target_devices)
+        if isinstance(parsed, str):
+            parsed = [parsed]
+    except ValueError:
+        # Tolerate plain comma/space separated lists
+        parsed = re.split(r'[,\s]+', target_devices)
+    if not isinstance(parsed, list):
+        return None
+    targets = frozenset(str(device).strip().strip('"').lower() for device in parsed if str(device).strip())
+    return targets or None
+
+def refresh_firmware_latest(cursor):
+    """Rebuild the firmware_latest pointers: the newest release on each (product, variant, channel),
+    counting releases on more conservative channels too."""
+    channels = ', '.join(f"('{channel}', {rank})" for rank, channel in enumerate(FIRMWARE_CHANNELS))
+    cursor.execute('DELETE FROM firmware_latest')
+    cursor.execute(f'''
+        WITH channels (name, rank) AS (VALUES {channels})
+        INSERT INTO firmware_latest (product, variant, channel, version)
+        SELECT product, variant, channel, version FROM (
+            SELECT fv.product, fv.variant, offered.name AS channel, fv.version,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY fv.product, fv.variant, offered.name
+                       ORDER BY fv.version_key DESC, fv.release_date DESC
+                   ) AS position
+            FROM firmware_versions fv
+            JOIN channels released ON released.name = fv.channel
+            JOIN channels offered ON offered.rank >= released.rank
+        )
+        WHERE position = 1
+    ''')
+
+# Static OTA manifests: the newest release of every (product, variant, channel) is
+# published as firmware/manifests/<product>/<variant>/<channel>.json, and the default
+# product's stable release as firmware/manifests/latest.json (served as
+# /firmware/latest.json), whenever the catalog is reloaded. The web server serves them
+# with ETags, so most polls never reach the API. When the newest release is targeted,
+# still rolling out or has a min_version, a manifest only carries requires_check and
+# devices ask /api/ota/check, which applies targeting, rollout stages, min_version
+# and download admission. Download admission does not apply to devices that download
+# straight from a manifest: only fully rolled out releases are published that way, and
+# devices spread those downloads over their own manifest poll schedule.
+FIRMWARE_MANIFEST_SCHEMA = 1
+firmware_manifest_lock = threading.Lock()
+
+def get_manifest_storage_path() -> Path:
+    """Get the static OTA manifest directory path"""
+    return get_firmware_storage_path() / "manifests"
+
+def build_firmware_manifest(key: tuple, releases: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Static manifest for a (product, variant, channel) from its catalog releases."""
+    product, variant, channel = key
+    manifest = {
+        "schema": FIRMWARE_MANIFEST_SCHEMA,
+        "product": product,
+        "variant": variant,
+        "channel": channel,
+        "version": None,
+        "requires_check": False,
+        "check_url": "https://energypebble.tdlx.nl/api/ota/check"
+    }
+    if not releases:
+        return manifest
+    
+    release = releases[0]
+    manifest["version"] = release['version']
+    if release['targets'] is not None or release['rollout_percentage'] < 100 or release['min_version']:
+        manifest["requires_check"] = True
+        return manifest
+    
+    manifest.update({
+        "download_url": f"https://energypebble.tdlx.nl/firmware/{release['filename']}",
+        "checksum": release['checksum'],
+        "md5_checksum": release['md5_checksum'],
+        "size_bytes": release['file_size'],
+        "force_update": release['force_update'],
+        "min_version": release['min_version'],
+        "rollback_version": release['rollback_version'],
+        "release_notes": release['release_notes'],
+        "encodings": {
+            encoding: {
+                "download_url": f"https://energypebble.tdlx.nl/firmware/{release['filename']}?encoding={encoding}",
+                "checksum": variant_info['checksum'],
+                "md5_checksum": variant_info['md5_checksum'],
+                "size_bytes": variant_info['file_size']
+            }
+            for encoding, variant_info in release['variants'].items()
+        },
+        "deltas": {
+            delta['from_version']: {
+                "download_url": f"https://energypebble.tdlx.nl/firmware/delta/{delta['filename']}",
+                "checksum": delta['checksum'],
+                "md5_checksum": delta['md5_checksum'],
+                "size_bytes": delta['file_size'],
+                "format": f"detools-sequential-{DELTA_COMPRESSION}"
+            }
+            for delta in release['deltas'].values()
+        }
+    })
+    return manifest
+
+def write_manifest_file(path: Path, manifest: Dict[str, Any]) -> bool:
+    """Atomically replace a manifest file if its content changed (keeps the web server's ETag otherwise)."""
+    data = (json.dumps(manifest, indent=2) + "\n").encode()
+    if path.exists() and path.read_bytes() == data:
+        return False
+    
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".part")
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(data)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        # Readable by the web server
+        os.chmod(temp_name, 0o644)
+        os.replace(temp_name, path)
+    except BaseException:
+        Path(temp_name).unlink(missing_ok=True)
+        raise
+    return True
+
+def publish_firmware_manifests(catalog: Dict[tuple, List[Dict[str, Any]]]):
+    """Write the static manifests for a catalog and remove those of keys without releases."""
+    keys = set(catalog) | {(DEFAULT_FIRMWARE_PRODUCT, DEFAULT_FIRMWARE_VARIANT, channel) for channel in FIRMWARE_CHANNELS}
+    manifest_storage = get_manifest_storage_path()
+    
+    with firmware_manifest_lock:
+        published = set()
+        updated = 0
+        for key in keys:
+            product, variant, channel = key
+            if not all(re.fullmatch(r'[a-z0-9_-]+', part or '') for part in key):
+                continue
+            manifest = build_firmware_manifest(key, catalog.get(key, []))
+            path = manifest_storage / product / variant / f"{channel}.json"
+            updated += write_manifest_file(path, manifest)
+            published.add(path)
+            if key == (DEFAULT_FIRMWARE_PRODUCT, DEFAULT_FIRMWARE_VARIANT, DEFAULT_FIRMWARE_CHANNEL):
+                write_manifest_file(manifest_storage / "latest.json", manifest)
+        
+        for path in manifest_storage.glob('*/*/*.json'):
+            if path not in published:
+                path.unlink()
+                updated += 1
+    
+    if updated:
+        logger.info(f"Published static OTA manifests ({updated} changed)")
+
+def load_firmware_catalog():
+    """Load firmware releases into the in-memory catalog, drop cached answers and publish static manifests."""
+    global firmware_catalog, firmware_catalog_generation, firmware_files
+    
     with sqlite3.connect(DB_PATH) as conn:
         cursor = conn.cursor()
+        refresh_firmware_latest(cursor)
+        conn.commit()
         
-        # Get latest stable firmware that's newer than current version
         cursor.execute('''
-            SELECT version, filename, checksum, file_size, force_update, rollback_version, release_notes, min_version, md5_checksum
-            FROM firmware_versions 
-            WHERE is_stable = TRUE 
-            AND (target_devices IS NULL OR target_devices LIKE ? OR target_devices = '[]')
-            ORDER BY release_date DESC
-            LIMIT 1
-        ''', (f'%{device_id}%',))
-        
-        result = cursor.fetchone()
-        if not result:
-            return None
-            
-        version, filename, checksum, file_size, force_update, rollback_version, release_notes, min_version, md5_checksum = result
+            SELECT fv.version, fv.filename, fv.checksum, fv.file_size, fv.force_update, fv.rollback_version, fv.release_notes,
+                   fv.min_version, fv.md5_checksum, fv.target_devices,
+                   CASE WHEN r.state = 'paused' THEN 0 ELSE COALESCE(r.percentage, 100) END,
+                   fv.product, fv.variant, fv.channel
+            FROM firmware_versions fv
+            LEFT JOIN firmware_rollouts r ON r.version = fv.version
+            ORDER BY fv.version_key DESC, fv.release_date DESC
+        ''')
+        rows = cursor.fetchall()
         
-        # Check if this version is newer than current
-        if not version_is_newer(version, current_version):
-            return None
-            
-        # Check minimum version requirement
-        if min_version and compare_versions(current_version, min_version) < 0:
-            return None
-            
-        return {
+        cursor.execute('''
+            SELECT to_version, from_version, from_version_key, filename, checksum, md5_checksum, file_size
+            FROM firmware_deltas
+        ''')
+        deltas: Dict[str, Dict[int, Dict[str, Any]]] = {}
+        for to_version, from_version, from_version_key, delta_filename, delta_checksum, delta_md5, delta_size in cursor.fetchall():
+            deltas.setdefault(to_version, {})[from_version_key] = {
+                'from_version': from_version,
+                'filename': delta_filename,
+                'checksum': delta_checksum,
+                'md5_checksum': delta_md5,
+                'file_size': delta_size
+            }
+        
+        cursor.execute('SELECT filename, encoding, variant_filename, checksum, md5_checksum, file_size, blob_sha256 FROM firmware_variants')
+        variants: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for variant_of, encoding, variant_filename, variant_checksum, variant_md5, variant_size, variant_blob in cursor.fetchall():
+            variants.setdefault(variant_of, {})[encoding] = {
+                'variant_filename': variant_filename,
+                'path': get_firmware_image_path(variant_filename, variant_blob),
+                'checksum': variant_checksum,
+                'md5_checksum': variant_md5,
+                'file_size': variant_size
+            }
+        
+        cursor.execute('SELECT filename, version, checksum, file_size, blob_sha256 FROM firmware_versions')
+        files = {
+            filename: {
+                'version': version,
+                'checksum': checksum,
+                'file_size': file_size,
+                'path': get_firmware_image_path(filename, blob_sha256),
+                'variants': variants.get(filename, {})
+            }
+            for filename, version, checksum, file_size, blob_sha256 in cursor.fetchall()
+        }
+    
+    catalog: Dict[tuple, List[Dict[str, Any]]] = {}
+    for (version, filename, checksum, file_size, force_update, rollback_version, release_notes, min_version, md5_checksum,
+         target_devices, rollout_percentage, product, variant, channel) in rows:
+        if channel not in FIRMWARE_CHANNELS:
+            continue
+        release = {
             'version': version,
             'filename': filename,
             'checksum': checksum,
@@ -633,32 +1624,589 @@ def get_latest_firmware_for_device(device_id: str, current_version: str) -> dict
             'file_size': file_size,
             'force_update': bool(force_update),
             'rollback_version': rollback_version,
-            'release_notes': release_notes
+            'release_notes': release_notes,
+            'min_version': min_version,
+            'targets': parse_target_devices(target_devices),
+            'rollout_percentage': rollout_percentage,
+            'deltas': deltas.get(version, {}),
+            'variants': variants.get(filename, {})
         }
-
-def log_ota_check(device_id: str, current_version: str, offered_version: str = None, ip_address: str = None, user_agent: str = None):
-    """Log an OTA check attempt"""
+        # Offered on its own channel and every less conservative one
+        for offered in FIRMWARE_CHANNELS[FIRMWARE_CHANNELS.index(channel):]:
+            catalog.setdefault((product, variant, offered), []).append(release)
+    
+    with firmware_catalog_lock:
+        firmware_catalog = catalog
+        firmware_files = files
+        firmware_catalog_generation += 1
+        firmware_answer_cache.clear()
+    
+    logger.info(f"Loaded {len(rows)} firmware versions into catalog for {len(catalog)} product/variant/channel "
+                f"combinations (generation {firmware_catalog_generation})")
+    
+    try:
+        publish_firmware_manifests(catalog)
+    except Exception as e:
+        logger.error(f"Failed to publish static OTA manifests: {e}")
+
+def firmware_rollout_in_progress(product: str, variant: str, channel: str) -> bool:
+    """Whether a release for this product, variant and channel is part way through its rollout."""
+    with firmware_catalog_lock:
+        releases = firmware_catalog.get((product, variant, channel), [])
+    return any(0 < release['rollout_percentage'] < 100 for release in releases)
+
+def get_latest_firmware_for_device(device_id: str, current_version: str, product: str = DEFAULT_FIRMWARE_PRODUCT,
+                                   variant: str = DEFAULT_FIRMWARE_VARIANT, channel: str = DEFAULT_FIRMWARE_CHANNEL) -> dict:
+    """Get the latest available firmware for a device (answered from the in-memory catalog)"""
+    cache_key = (device_id, current_version, product, variant, channel)
+    with firmware_catalog_lock:
+        if cache_key in firmware_answer_cache:
+            return firmware_answer_cache[cache_key]
+        releases = firmware_catalog.get((product, variant, channel), [])
+        generation = firmware_catalog_generation
+    
+    # Latest release for the device's product, variant and channel that it is targeted
+    # by and included in the rollout of; devices outside a release's current stage
+    # fall back to the previous release
+    device_key = device_id.lower()
+    release = next((r for r in releases
+                    if (r['targets'] is None or device_key in r['targets'])
+                    and device_in_rollout(device_key, r['version'], r['rollout_percentage'])), None)
+    
+    result = None
+    # Only offer it if it's newer than current and the minimum version requirement is met
+    if release and version_is_newer(release['version'], current_version):
+        if not release['min_version'] or compare_versions(current_version, release['min_version']) >= 0:
+            result = {key: value for key, value in release.items() if key not in ('min_version', 'targets', 'rollout_percentage')}
+    
+    with firmware_catalog_lock:
+        # Don't cache answers computed from a catalog that was replaced meanwhile
+        if generation == firmware_catalog_generation:
+            if len(firmware_answer_cache) >= FIRMWARE_ANSWER_CACHE_MAX:
+                firmware_answer_cache.clear()
+            firmware_answer_cache[cache_key] = result
+    
+    return result
+
+# Staged rollouts: a new stable release is offered to a growing percentage of devices,
+# chosen by a deterministic hash of device ID and version. A stage advances once it
+# has run for ROLLOUT_STAGE_MIN_HOURS and has at least ROLLOUT_MIN_REPORTS install
+# reports with a failure rate at or below ROLLOUT_MAX_FAILURE_RATE, and is paused when
+# the rate is exceeded. Stages with fewer known devices than ROLLOUT_MIN_REPORTS need
+# a report from each of them instead (an empty stage advances on time), so small
+# fleets don't stall at 1%. A paused release is offered to no new devices: the catalog
+# treats it as at 0%, so devices fall back to the previous release.
+ROLLOUT_STAGES = [1, 5, 25, 50, 100]
+ROLLOUT_MAX_FAILURE_RATE = 0.1
+ROLLOUT_MIN_REPORTS = 5
+ROLLOUT_STAGE_MIN_HOURS = 12
+ROLLOUT_EVALUATION_INTERVAL_SECONDS = 15 * 60
+ROLLOUT_STATES = ('active', 'paused', 'complete')
+
+def rollout_bucket(device_id: str, version: str) -> int:
+    """Stable 0-99 bucket of a device for a release (differs per release)."""
+    digest = hashlib.sha256(f"{device_id.lower()}:{version}".encode()).hexdigest()
+    return int(digest[:8], 16) % 100
+
+def device_in_rollout(device_id: str, version: str, percentage: int) -> bool:
+    """Check if a device falls within the current stage of a release's rollout."""
+    return percentage >= 100 or rollout_bucket(device_id, version) < percentage
+
+def next_rollout_stage(percentage: int) -> int:
+    """The rollout percentage following the given one."""
+    return next((stage for stage in ROLLOUT_STAGES if stage > percentage), 100)
+
+def ota_report_version(cursor, device_id: str, status: str, reported_version: Optional[str]) -> Optional[str]:
+    """The release a completed or failed install report is about (None for other statuses)."""
+    if status == 'completed':
+        return reported_version
+    if status == 'failed':
+        # Failed devices still run their old version; attribute the failure to the last offer
+        cursor.execute('''
+            SELECT offered_version FROM ota_logs
+            WHERE device_id = ? AND offered_version IS NOT NULL
+            ORDER BY id DESC LIMIT 1
+        ''', (device_id,))
+        row = cursor.fetchone()
+        return row[0] if row else reported_version
+    return None
+
+def record_rollout_report(cursor, status: str, version: Optional[str]):
+    """Count a completed or failed install towards the current stage of its release's rollout."""
+    if status not in ('completed', 'failed') or not version:
+        return
+    counter = 'stage_successes' if status == 'completed' else 'stage_failures'
+    cursor.execute(f'''
+        UPDATE firmware_rollouts SET {counter} = {counter} + 1
+        WHERE version = ? AND state != 'complete'
+    ''', (version,))
+
+# Install telemetry: per firmware version, completed installs are counted into
+# histograms of the reported install duration and of the time from the device's
+# first offer of the version to its completion report, and failures are counted
+# per (normalized) error message. Histogram buckets are powers of two seconds,
+# each counting values up to its bound.
+INSTALL_TELEMETRY_METRICS = ('install_duration', 'time_to_complete')
+INSTALL_FAILURE_REASONS_MAX = 50
+
+def histogram_bucket(seconds: float) -> int:
+    """Upper bound of the log2 bucket holding a duration in seconds (1, 2, 4, 8, ...)."""
+    return 1 << (max(int(-(-seconds // 1)), 1) - 1).bit_length()
+
+def bump_install_histogram(cursor, version: str, metric: str, seconds: float):
+    """Count a duration into a version's histogram."""
+    if seconds is None or seconds < 0:
+        return
+    cursor.execute('''
+        INSERT INTO ota_install_histograms (version, metric, bucket, count) VALUES (?, ?, ?, 1)
+        ON CONFLICT (version, metric, bucket) DO UPDATE SET count = count + 1
+    ''', (version, metric, histogram_bucket(seconds)))
+
+def bump_install_failure(cursor, version: str, error_message: Optional[str]):
+    """Count a failed install by reason; numbers are masked so similar errors group together."""
+    reason = re.sub(r'\d+', '#', (error_message or '').strip().lower())[:80] or 'unknown'
+    cursor.execute('SELECT COUNT(*), SUM(reason = ?) FROM ota_install_failures WHERE version = ?', (reason, version))
+    reasons, known = cursor.fetchone()
+    if not known and reasons >= INSTALL_FAILURE_REASONS_MAX:
+        reason = 'other'
+    cursor.execute('''
+        INSERT INTO ota_install_failures (version, reason, count) VALUES (?, ?, 1)
+        ON CONFLICT (version, reason) DO UPDATE SET count = count + 1
+    ''', (version, reason))
+
+def is_known_firmware_version(cursor, version: Optional[str]) -> bool:
+    """Whether a version is one we published (device-reported versions are untrusted)."""
+    if not version:
+        return False
+    cursor.execute('SELECT 1 FROM firmware_versions WHERE version = ?', (version,))
+    return cursor.fetchone() is not None
+
+def record_install_telemetry(cursor, device_id: str, status: str, version: Optional[str],
+                             install_duration: Optional[int], error_message: Optional[str], timestamp: Optional[str]):
+    """Count a completed or failed install report into its version's telemetry.
+    
+    Reports for versions that are not in firmware_versions are ignored, so devices
+    can't create telemetry rows for arbitrary version strings.
+    """
+    if not is_known_firmware_version(cursor, version):
+        return
+    if status == 'failed':
+        bump_install_failure(cursor, version, error_message)
+        return
+    if status != 'completed':
+        return
+    
+    bump_install_histogram(cursor, version, 'install_duration', install_duration)
+    cursor.execute('''
+        SELECT strftime('%s', COALESCE(?, CURRENT_TIMESTAMP)) - strftime('%s', first_offered_at)
+        FROM ota_offers WHERE device_id = ? AND version = ?
+    ''', (timestamp, device_id, version))
+    row = cursor.fetchone()
+    if row:
+        bump_install_histogram(cursor, version, 'time_to_complete', max(row[0], 0))
+        cursor.execute('DELETE FROM ota_offers WHERE device_id = ? AND version = ?', (device_id, version))
+
+def histogram_quantile(buckets: List[tuple], quantile: float) -> Optional[int]:
+    """Bucket bound below which the given fraction of a histogram's values fall."""
+    total = sum(count for _, count in buckets)
+    if not total:
+        return None
+    running = 0
+    for bucket, count in sorted(buckets):
+        running += count
+        if running >= quantile * total:
+            return bucket
+    return None
+
+def get_install_telemetry(cursor, version: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Install telemetry per firmware version, highest version first."""
+    version_filter = 'WHERE version = ?' if version else ''
+    params = (version,) if version else ()
+    
+    cursor.execute(f'SELECT version, metric, bucket, count FROM ota_install_histograms {version_filter}', params)
+    histograms: Dict[str, Dict[str, List[tuple]]] = {}
+    for row_version, metric, bucket, count in cursor.fetchall():
+        histograms.setdefault(row_version, {}).setdefault(metric, []).append((bucket, count))
+    
+    cursor.execute(f'SELECT version, reason, count FROM ota_install_failures {version_filter} ORDER BY count DESC', params)
+    failures: Dict[str, List[Dict[str, Any]]] = {}
+    for row_version, reason, count in cursor.fetchall():
+        failures.setdefault(row_version, []).append({"reason": reason, "count": count})
+    
+    telemetry = []
+    for row_version in sorted(set(histograms) | set(failures), key=lambda v: version_sort_key(v) or -1, reverse=True):
+        entry = {"version": row_version}
+        for metric in INSTALL_TELEMETRY_METRICS:
+            buckets = histograms.get(row_version, {}).get(metric, [])
+            entry[metric] = {
+                "count": sum(count for _, count in buckets),
+                "p50_seconds": histogram_quantile(buckets, 0.5),
+                "p90_seconds": histogram_quantile(buckets, 0.9),
+                "buckets": [{"le_seconds": bucket, "count": count} for bucket, count in sorted(buckets)]
+            }
+        reasons = failures.get(row_version, [])
+        entry["failures"] = {"count": sum(reason["count"] for reason in reasons), "reasons": reasons}
+        telemetry.append(entry)
+    return telemetry
+
+def rollout_stage_device_count(conn, version: str, percentage: int, target_devices: Optional[str]) -> int:
+    """Number of known devices the current stage of a release's rollout is offered to."""
+    targets = parse_target_devices(target_devices)
+    rows = conn.execute('''
+        SELECT device_id FROM devices
+        WHERE device_id IS NOT NULL AND current_firmware_version_key <= ?
+    ''', (version_sort_key(version),)).fetchall()
+    return sum(1 for (device_id,) in rows
+               if (targets is None or device_id.lower() in targets) and device_in_rollout(device_id, version, percentage))
+
+def evaluate_rollouts() -> List[Dict[str, Any]]:
+    """Advance or pause active rollouts based on their current stage's install reports.
+
+    Reloads the firmware catalog when a stage changes. Returns the changes made.
+    """
+    changes = []
+    with sqlite3.connect(DB_PATH) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT r.version, r.percentage, r.stage_successes, r.stage_failures,
+                   r.stage_started_at <= datetime('now', ?) AS stage_elapsed, fv.target_devices
+            FROM firmware_rollouts r
+            LEFT JOIN firmware_versions fv ON fv.version = r.version
+            WHERE r.state = 'active'
+        ''', (f'-{ROLLOUT_STAGE_MIN_HOURS} hours',))
+        
+        for version, percentage, successes, failures, stage_elapsed, target_devices in cursor.fetchall():
+            reports = successes + failures
+            failure_rate = failures / reports if reports else 0.0
+            # A stage can't produce more reports than it has devices
+            min_reports = min(ROLLOUT_MIN_REPORTS, rollout_stage_device_count(conn, version, percentage, target_devices))
+            
+            if reports and reports >= min_reports and failure_rate > ROLLOUT_MAX_FAILURE_RATE:
+                cursor.execute("UPDATE firmware_rollouts SET state = 'paused' WHERE version = ?", (version,))
+                changes.append({"version": version, "state": "paused", "percentage": percentage, "failure_rate": failure_rate})
+            elif stage_elapsed and reports >= min_reports:
+                # Stages only advance on evidence: time alone doesn't make a release safe
+                next_percentage = next_rollout_stage(percentage)
+                next_state = 'complete' if next_percentage >= 100 else 'active'
+                cursor.execute('''
+                    UPDATE firmware_rollouts
+                    SET percentage = ?, state = ?, stage_started_at = CURRENT_TIMESTAMP,
+                        stage_successes = 0, stage_failures = 0
+                    WHERE version = ?
+                ''', (next_percentage, next_state, version))
+                changes.append({"version": version, "state": next_state, "percentage": next_percentage, "failure_rate": failure_rate})
+        
+        conn.commit()
+    
+    for change in changes:
+        logger.info(f"Rollout of {change['version']}: {change['state']} at {change['percentage']}% "
+                    f"(stage failure rate {change['failure_rate']:.1%})")
+    if changes:
+        load_firmware_catalog()
+    return changes
+
+def run_rollout_evaluation(stop_event: threading.Event):
+    """Background loop evaluating staged rollouts until stop_event is set."""
+    while not stop_event.is_set():
+        try:
+            evaluate_rollouts()
+        except Exception as e:
+            logger.error(f"Rollout evaluation failed: {e}")
+        stop_event.wait(ROLLOUT_EVALUATION_INTERVAL_SECONDS)
+
+# Download admission: offering an update leases one of MAX_CONCURRENT_DOWNLOADS slots
+# to the device until it reports the download finished (or the lease expires), so a
+# rollout stage can't saturate the uplink. Devices over the cap are told to retry.
+MAX_CONCURRENT_DOWNLOADS = 10
+DOWNLOAD_LEASE_SECONDS = 15 * 60
+DOWNLOAD_RETRY_AFTER_SECONDS = 5 * 60
+download_leases: Dict[str, float] = {}  # device_id -> lease expiry (monotonic time)
+download_leases_lock = threading.Lock()
+
+def acquire_download_lease(device_id: str) -> Optional[int]:
+    """Admit a device to download firmware.
+
+    Returns None if the device holds a download slot, otherwise the number of
+    seconds it should wait before checking again.
+    """
+    device_key = device_id.lower()
+    now = time.monotonic()
+    with download_leases_lock:
+        for expired in [device for device, expiry in download_leases.items() if expiry <= now]:
+            del download_leases[expired]
+        if device_key in download_leases or len(download_leases) < MAX_CONCURRENT_DOWNLOADS:
+            download_leases[device_key] = now + DOWNLOAD_LEASE_SECONDS
+            return None
+        next_free = min(download_leases.values()) - now
+    
+    # Spread deferred devices out so they don't all return at the same moment
+    jitter = int(hashlib.sha256(device_key.encode()).hexdigest()[:8], 16) % DOWNLOAD_RETRY_AFTER_SECONDS
+    return max(1, min(int(next_free), DOWNLOAD_RETRY_AFTER_SECONDS)) + jitter
+
+def release_download_lease(device_id: str):
+    """Free a device's download slot."""
+    with download_leases_lock:
+        download_leases.pop(device_id.lower(), None)
+
+def get_active_download_count() -> int:
+    """Number of unexpired download leases."""
+    now = time.monotonic()
+    with download_leases_lock:
+        return sum(1 for expiry in download_leases.values() if expiry > now)
+
+def record_ota_check(cursor, device_id: str, current_version: str, offered_version: Optional[str] = None,
+                     ip_address: Optional[str] = None, user_agent: Optional[str] = None, log_entry: bool = True):
+    """Record an OTA check in the caller's transaction.
+
+    With log_entry an ota_logs row is written; otherwise only the OTA check
+    counters are bumped (see touch_ota_check). The device's last check and
+    firmware version are updated either way.
+    """
+    if log_entry:
+        cursor.execute('''
+            INSERT INTO ota_logs (device_id, current_version, offered_version, status, ip_address, user_agent)
+            VALUES (?, ?, ?, 'check', ?, ?)
+        ''', (device_id, current_version, offered_version, ip_address, user_agent))
+        
+        # Remember the first offer of a version, for time-to-complete telemetry
+        if offered_version:
+            cursor.execute('INSERT OR IGNORE INTO ota_offers (device_id, version) VALUES (?, ?)', (device_id, offered_version))
+    else:
+        bump_ota_check_counters(cursor)
+    
+    # Update device's last OTA check timestamp and current firmware version
+    cursor.execute('''
+        UPDATE devices 
+        SET last_ota_check = CURRENT_TIMESTAMP,
+            current_firmware_version = ?,
+            current_firmware_version_key = ?
+        WHERE device_id = ?
+    ''', (current_version, version_sort_key(current_version), device_id))
+
+def log_ota_check(device_id: str, current_version: str, offered_version: str = None, ip_address: str = None, user_agent: str = None):
+    """Log an OTA check attempt"""
     try:
         with sqlite3.connect(DB_PATH) as conn:
             cursor = conn.cursor()
-            
-            # Insert OTA log entry
+            record_ota_check(cursor, device_id, current_version, offered_version, ip_address, user_agent)
+            conn.commit()
+    except Exception as e:
+        logger.error(f"Failed to log OTA check: {e}")
+
+def touch_ota_check(device_id: str, current_version: str):
+    """Cheaply record an OTA check that was answered with 304 Not Modified.
+
+    Only the device row and the OTA check counters are updated; no ota_logs
+    entry is written because the device already holds the answer for this
+    catalog generation.
+    """
+    try:
+        with sqlite3.connect(DB_PATH) as conn:
+            cursor = conn.cursor()
+            record_ota_check(cursor, device_id, current_version, log_entry=False)
+            conn.commit()
+    except Exception as e:
+        logger.error(f"Failed to record OTA check: {e}")
+
+def ota_check_etag(offered: Optional[Dict[str, Any]], device_id: str, current_version: str, product: str, variant: str, channel: str) -> str:
+    """ETag for an OTA check answer.
+
+    Built from the offered release itself (or "none") and the device's ID, current version,
+    product, variant and channel, so it stays valid across restarts and changes whenever
+    the answer does.
+    """
+    answer = json.dumps(offered, sort_keys=True, default=str) if offered else "none"
+    digest = hashlib.sha256(f"{answer}:{device_id.lower()}:{current_version}:{product}:{variant}:{channel}".encode()).hexdigest()[:20]
+    return f'"ota-{digest}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header against an ETag (weak comparison)."""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(',')]
+    return '*' in candidates or etag in [candidate[2:] if candidate.startswith('W/') else candidate for candidate in candidates]
+
+# OTA status ingestion: status reports are queued and written by a background writer
+# in batched transactions, so a rollout's burst of downloading/installing/completed
+# events costs one commit per batch instead of one per event. When the queue is full
+# reports are written synchronously instead. A batch that fails is retried while the
+# database is locked, then written event by event so only events that fail themselves
+# are lost.
+OTA_STATUS_QUEUE_MAX = 10000
+OTA_STATUS_WRITE_BATCH_SIZE = 500
+OTA_STATUS_FLUSH_SECONDS = 1.0
+OTA_STATUS_MAX_BATCH_EVENTS = 100
+OTA_STATUS_WRITE_RETRIES = 4
+OTA_STATUS_RETRY_SECONDS = 0.5
+
+ota_status_queue: "queue.Queue[tuple]" = queue.Queue(maxsize=OTA_STATUS_QUEUE_MAX)
+
+def ota_status_event(device_id: str, report: OTAStatusReport, ip_address: Optional[str], user_agent: Optional[str]) -> tuple:
+    """Queue entry for a status report; reported times are stored as UTC and never in the future."""
+    timestamp = None
+    if report.timestamp:
+        reported = report.timestamp.astimezone(timezone.utc) if report.timestamp.tzinfo else report.timestamp.replace(tzinfo=timezone.utc)
+        timestamp = min(reported, datetime.now(timezone.utc)).strftime('%Y-%m-%d %H:%M:%S')
+    return (device_id, report.status, report.error_message, report.install_duration, report.current_version,
+            ip_address, user_agent, timestamp)
+
+def write_ota_status_events(events: List[tuple]):
+    """Write status events to ota_logs and apply them to their devices in one transaction."""
+    with sqlite3.connect(DB_PATH, timeout=30) as conn:
+        cursor = conn.cursor()
+        for device_id, status, error_message, install_duration, current_version, ip_address, user_agent, timestamp in events:
             cursor.execute('''
-                INSERT INTO ota_logs (device_id, current_version, offered_version, status, ip_address, user_agent)
-                VALUES (?, ?, ?, 'check', ?, ?)
-            ''', (device_id, current_version, offered_version, ip_address, user_agent))
+                INSERT INTO ota_logs (device_id, current_version, status, error_message, install_duration, ip_address, user_agent, check_timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+            ''', (device_id, current_version, status, error_message, install_duration, ip_address, user_agent, timestamp))
             
-            # Update device's last OTA check timestamp and current firmware version
-            cursor.execute('''
-                UPDATE devices 
-                SET last_ota_check = CURRENT_TIMESTAMP,
-                    current_firmware_version = ?
-                WHERE device_id = ?
-            ''', (current_version, device_id))
+            # Count the outcome towards the release's rollout stage and install telemetry
+            version = ota_report_version(cursor, device_id, status, current_version)
+            record_rollout_report(cursor, status, version)
+            record_install_telemetry(cursor, device_id, status, version, install_duration, error_message, timestamp)
             
+            # Update device status and firmware version if completed successfully
+            if status == "completed" and current_version:
+                cursor.execute('''
+                    UPDATE devices 
+                    SET current_firmware_version = ?, current_firmware_version_key = ?, ota_status = 'idle'
+                    WHERE device_id = ?
+                ''', (current_version, version_sort_key(current_version), device_id))
+            elif status in ["downloading", "installing"]:
+                cursor.execute('''
+                    UPDATE devices 
+                    SET ota_status = ?
+                    WHERE device_id = ?
+                ''', (status, device_id))
+            elif status == "failed":
+                cursor.execute('''
+                    UPDATE devices 
+                    SET ota_status = 'failed'
+                    WHERE device_id = ?
+                ''', (device_id,))
+        
+        conn.commit()
+
+def write_ota_status_events_with_retry(events: List[tuple]):
+    """Write status events, retrying with exponential backoff while the database is locked or busy."""
+    for attempt in range(OTA_STATUS_WRITE_RETRIES):
+        try:
+            write_ota_status_events(events)
+            return
+        except sqlite3.OperationalError as e:
+            transient = 'locked' in str(e) or 'busy' in str(e)
+            if not transient or attempt == OTA_STATUS_WRITE_RETRIES - 1:
+                raise
+            delay = OTA_STATUS_RETRY_SECONDS * 2 ** attempt
+            logger.warning(f"Writing {len(events)} OTA status events failed ({e}), retrying in {delay}s")
+            time.sleep(delay)
+
+def enqueue_ota_status_events(events: List[tuple]) -> bool:
+    """Queue status events for the writer. Returns False (nothing queued) if they don't fit."""
+    if ota_status_queue.qsize() + len(events) > OTA_STATUS_QUEUE_MAX:
+        return False
+    for position, event in enumerate(events):
+        try:
+            ota_status_queue.put_nowait(event)
+        except queue.Full:
+            # Raced with another request for the last slots; the rest is written directly
+            write_ota_status_events_with_retry(events[position:])
+            break
+    return True
+
+def flush_ota_status_queue(first: Optional[tuple] = None) -> int:
+    """Write queued status events in batches until the queue is empty. Returns the number written."""
+    written = 0
+    batch = [first] if first else []
+    while True:
+        while len(batch) < OTA_STATUS_WRITE_BATCH_SIZE:
+            try:
+                batch.append(ota_status_queue.get_nowait())
+            except queue.Empty:
+                break
+        if not batch:
+            return written
+        try:
+            write_ota_status_events_with_retry(batch)
+            written += len(batch)
+        except Exception as e:
+            # Don't let one bad event (or a persistent error) take the whole batch down
+            logger.warning(f"Failed to write {len(batch)} OTA status events, writing them one at a time: {e}")
+            for event in batch:
+                try:
+                    write_ota_status_events_with_retry([event])
+                    written += 1
+                except Exception as e:
+                    logger.error(f"Dropped OTA status event {event[1]!r} of device {event[0]}: {e}")
+        batch = []
+
+def run_ota_status_writer(stop_event: threading.Event):
+    """Background writer for queued OTA status events; drains the queue when stopping."""
+    while not stop_event.is_set():
+        try:
+            first = ota_status_queue.get(timeout=OTA_STATUS_FLUSH_SECONDS)
+        except queue.Empty:
+            continue
+        flush_ota_status_queue(first)
+    flush_ota_status_queue()
+
+# OTA log retention: raw ota_logs rows older than the retention window are
+# rolled up into ota_log_daily and deleted in batches by a background job.
+OTA_LOG_RETENTION_DAYS = 30
+OTA_LOG_COMPACTION_BATCH_SIZE = 5000
+OTA_LOG_COMPACTION_INTERVAL_SECONDS = 6 * 3600
+
+def compact_ota_logs(retention_days: int = OTA_LOG_RETENTION_DAYS, batch_size: int = OTA_LOG_COMPACTION_BATCH_SIZE) -> int:
+    """Roll ota_logs rows older than retention_days into daily rollups and delete them.
+
+    Each batch is rolled up and deleted in its own transaction so writers are
+    never blocked for long. Returns the number of raw rows compacted.
+    """
+    batch_query = '''
+        SELECT id FROM ota_logs
+        WHERE check_timestamp < datetime('now', ?)
+        ORDER BY check_timestamp
+        LIMIT ?
+    '''
+    batch_params = (f'-{retention_days} days', batch_size)
+    compacted = 0
+    
+    while True:
+        with sqlite3.connect(DB_PATH, timeout=30) as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                INSERT INTO ota_log_daily (day, version, status, count)
+                SELECT DATE(check_timestamp), COALESCE(current_version, ''), COALESCE(status, 'check'), COUNT(*)
+                FROM ota_logs
+                WHERE id IN ({batch_query})
+                GROUP BY 1, 2, 3
+                ON CONFLICT (day, version, status) DO UPDATE SET count = count + excluded.count
+            ''', batch_params)
+            cursor.execute(f'DELETE FROM ota_logs WHERE id IN ({batch_query})', batch_params)
+            deleted = cursor.rowcount
             conn.commit()
-    except Exception as e:
-        logger.error(f"Failed to log OTA check: {e}")
+        
+        compacted += deleted
+        if deleted < batch_size:
+            break
+    
+    # Offers never followed by a completed install are forgotten after the same window
+    with sqlite3.connect(DB_PATH, timeout=30) as conn:
+        conn.execute("DELETE FROM ota_offers WHERE first_offered_at < datetime('now', ?)", (f'-{retention_days} days',))
+        conn.commit()
+    
+    if compacted:
+        logger.info(f"Compacted {compacted} OTA log rows older than {retention_days} days into daily rollups")
+    return compacted
+
+def run_ota_log_compaction(stop_event: threading.Event):
+    """Background loop running OTA log compaction until stop_event is set."""
+    while not stop_event.is_set():
+        try:
+            compact_ota_logs()
+        except Exception as e:
+            logger.error(f"OTA log compaction failed: {e}")
+        stop_event.wait(OTA_LOG_COMPACTION_INTERVAL_SECONDS)
 
 def calculate_file_checksum(file_path: Path) -> str:
     """Calculate SHA256 checksum of a file (legacy function for compatibility)"""
@@ -680,9 +2228,562 @@ def calculate_file_checksums(file_path: Path) -> tuple[str, str]:
     
     return f"sha256:{sha256_hash.hexdigest()}", md5_hash.hexdigest()
 
+# Firmware uploads are streamed to disk in large chunks and hashed in the same pass
+FIRMWARE_UPLOAD_CHUNK_SIZE = 1024 * 1024
+FIRMWARE_MAX_UPLOAD_BYTES = 8 * 1024 * 1024
+
+def receive_firmware_upload(source, directory: Path, filename: str) -> tuple[Path, int, str, str]:
+    """Copy an upload into a temp file in directory, computing SHA256 and MD5.
+
+    Returns (temp_path, size, sha256_hex, md5_hex). The caller renames or removes
+    the temp file. Raises HTTPException(413) once the size limit is exceeded.
+    """
+    sha256_hash = hashlib.sha256()
+    md5_hash = hashlib.md5()
+    size = 0
+    
+    fd, temp_name = tempfile.mkstemp(dir=directory, prefix=f".{filename}.", suffix=".part")
+    temp_path = Path(temp_name)
+    try:
+        with os.fdopen(fd, 'wb') as buffer:
+            for chunk in iter(lambda: source.read(FIRMWARE_UPLOAD_CHUNK_SIZE), b""):
+                size += len(chunk)
+                if size > FIRMWARE_MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail=f"Firmware file exceeds {FIRMWARE_MAX_UPLOAD_BYTES} bytes")
+                sha256_hash.update(chunk)
+                md5_hash.update(chunk)
+                buffer.write(chunk)
+            buffer.flush()
+            os.fsync(buffer.fileno())
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    
+    return temp_path, size, sha256_hash.hexdigest(), md5_hash.hexdigest()
+
 def get_firmware_storage_path() -> Path:
     """Get the firmware storage directory path"""
-    return Path("/home/cumulus/github/energy_pebble/firmware")
+    return Path(os.getenv("ENERGY_PEBBLE_FIRMWARE_PATH", "/home/cumulus/github/energy_pebble/firmware"))
+
+# Delta updates: patches from the most recent stable releases to a new one, in the
+# detools sequential format with heatshrink compression (as applied by esp_delta_ota).
+# Patches that don't save enough over the full image are not kept.
+DELTA_BASE_VERSIONS = 3
+DELTA_MAX_SIZE_RATIO = 0.7
+DELTA_COMPRESSION = "heatshrink"
+
+def get_delta_storage_path() -> Path:
+    """Get the firmware delta directory path"""
+    return get_firmware_storage_path() / "deltas"
+
+# Content-addressed blob store: each distinct firmware image or compressed variant is
+# stored once under blobs/sha256/<first two hex digits>/<sha256>. The blob_sha256
+# columns of firmware_versions and firmware_variants point at the blobs and filenames
+# are only aliases; triggers keep firmware_blobs.refcount current and unreferenced
+# blobs are garbage collected. Blobs never change.
+def get_blob_path(sha256_hex: str) -> Path:
+    """Path of a firmware blob"""
+    return get_firmware_storage_path() / "blobs" / "sha256" / sha256_hex[:2] / sha256_hex
+
+def get_firmware_image_path(filename: str, blob_sha256: Optional[str]) -> Path:
+    """Path of a firmware image or variant: its blob, or the legacy file not imported yet."""
+    return get_blob_path(blob_sha256) if blob_sha256 else get_firmware_storage_path() / filename
+
+def store_firmware_blob(temp_path: Path, sha256_hex: str) -> bool:
+    """Move an uploaded file into the blob store unless the blob already exists.
+
+    Must run inside the write transaction that references the blob, so garbage
+    collection can't remove an existing blob in between. Returns True if the
+    blob was newly stored.
+    """
+    blob_path = get_blob_path(sha256_hex)
+    if blob_path.exists():
+        return False
+    blob_path.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(temp_path, blob_path)
+    return True
+
+def collect_firmware_blobs() -> int:
+    """Delete blobs no firmware version references anymore. Returns the number removed."""
+    with sqlite3.connect(DB_PATH, timeout=30) as conn:
+        cursor = conn.cursor()
+        # Hold the write lock so no upload can start referencing a blob being removed
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('SELECT sha256 FROM firmware_blobs WHERE refcount <= 0')
+        unreferenced = [row[0] for row in cursor.fetchall()]
+        for sha256_hex in unreferenced:
+            get_blob_path(sha256_hex).unlink(missing_ok=True)
+        cursor.executemany('DELETE FROM firmware_blobs WHERE sha256 = ?', [(sha256_hex,) for sha256_hex in unreferenced])
+        conn.commit()
+    
+    if unreferenced:
+        logger.info(f"Garbage collected {len(unreferenced)} unreferenced firmware blobs")
+    return len(unreferenced)
+
+def import_legacy_firmware_files():
+    """Move firmware files stored by filename into the blob store. Images are hardlinked,
+    so the legacy name keeps working and no extra space is used; compressed variants
+    are only served through the API and are moved."""
+    with sqlite3.connect(DB_PATH) as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT id, filename FROM firmware_versions WHERE blob_sha256 IS NULL')
+        legacy = cursor.fetchall()
+    
+    imported = 0
+    for firmware_id, filename in legacy:
+        legacy_path = get_firmware_storage_path() / filename
+        if not legacy_path.exists():
+            continue
+        
+        sha256_hex = hash_file_sha256(legacy_path)
+        blob_path = get_blob_path(sha256_hex)
+        if not blob_path.exists():
+            blob_path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.link(legacy_path, blob_path)
+            except OSError:
+                temp_path = blob_path.with_name(blob_path.name + '.tmp')
+                shutil.copyfile(legacy_path, temp_path)
+                os.replace(temp_path, blob_path)
+        
+        with sqlite3.connect(DB_PATH) as conn:
+            conn.execute('INSERT OR IGNORE INTO firmware_blobs (sha256, size) VALUES (?, ?)', (sha256_hex, blob_path.stat().st_size))
+            conn.execute('UPDATE firmware_versions SET blob_sha256 = ? WHERE id = ?', (sha256_hex, firmware_id))
+            conn.commit()
+        imported += 1
+    
+    # Compressed variants stored by name are moved into the blob store
+    with sqlite3.connect(DB_PATH) as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT variant_filename FROM firmware_variants WHERE blob_sha256 IS NULL')
+        legacy_variants = [row[0] for row in cursor.fetchall()]
+    
+    for variant_filename in legacy_variants:
+        legacy_path = get_firmware_storage_path() / variant_filename
+        if not legacy_path.exists():
+            continue
+        
+        sha256_hex = hash_file_sha256(legacy_path)
+        size = legacy_path.stat().st_size
+        with sqlite3.connect(DB_PATH) as conn:
+            conn.execute('INSERT OR IGNORE INTO firmware_blobs (sha256, size) VALUES (?, ?)', (sha256_hex, size))
+            conn.execute('UPDATE firmware_variants SET blob_sha256 = ? WHERE variant_filename = ?', (sha256_hex, variant_filename))
+            if not store_firmware_blob(legacy_path, sha256_hex):
+                legacy_path.unlink()
+            conn.commit()
+        imported += 1
+    
+    if imported:
+        logger.info(f"Imported {imported} legacy firmware files into the blob store")
+
+def create_firmware_deltas(version: str) -> List[Dict[str, Any]]:
+    """Create patches to a firmware version from the previous stable releases.
+
+    Existing patches are kept. Returns the patches created.
+    """
+    if detools is None:
+        logger.warning(f"detools is not installed, skipping delta creation for {version}")
+        return []
+    
+    with sqlite3.connect(DB_PATH) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT filename, file_size, version_key, blob_sha256, product, variant
+            FROM firmware_versions WHERE version = ?
+        ''', (version,))
+        target = cursor.fetchone()
+        if not target:
+            return []
+        filename, file_size, version_key, blob_sha256, product, variant = target
+        # Patches only apply between builds for the same hardware and variant
+        cursor.execute('''
+            SELECT version, version_key, filename, blob_sha256
+            FROM firmware_versions
+            WHERE product = ? AND variant = ? AND channel = 'stable' AND version_key < ?
+              AND version NOT IN (SELECT from_version FROM firmware_deltas WHERE to_version = ?)
+            ORDER BY version_key DESC
+            LIMIT ?
+        ''', (product, variant, version_key, version, DELTA_BASE_VERSIONS))
+        bases = cursor.fetchall()
+    
+    target_path = get_firmware_image_path(filename, blob_sha256)
+    delta_storage = get_delta_storage_path()
+    delta_storage.mkdir(parents=True, exist_ok=True)
+    
+    created = []
+    for from_version, from_version_key, from_filename, from_blob_sha256 in bases:
+        from_path = get_firmware_image_path(from_filename, from_blob_sha256)
+        if not from_path.exists() or not target_path.exists():
+            continue
+        
+        delta_filename = f"{Path(filename).stem}_from_{from_version}.patch"
+        delta_path = delta_storage / delta_filename
+        temp_path = delta_path.with_suffix('.tmp')
+        try:
+            with open(from_path, 'rb') as ffrom, open(target_path, 'rb') as fto, open(temp_path, 'wb') as fpatch:
+                detools.create_patch(ffrom, fto, fpatch, compression=DELTA_COMPRESSION)
+            
+            delta_size = temp_path.stat().st_size
+            if delta_size > file_size * DELTA_MAX_SIZE_RATIO:
+                logger.info(f"Skipping delta {from_version} -> {version}: {delta_size} bytes is not worth it")
+                temp_path.unlink()
+                continue
+            
+            temp_path.replace(delta_path)
+            delta_checksum, delta_md5 = calculate_file_checksums(delta_path)
+            with sqlite3.connect(DB_PATH) as conn:
+                conn.execute('''
+                    INSERT OR REPLACE INTO firmware_deltas
+                    (from_version, from_version_key, to_version, filename, checksum, md5_checksum, file_size)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (from_version, from_version_key, version, delta_filename, delta_checksum, delta_md5, delta_size))
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to create delta {from_version} -> {version}: {e}")
+            if temp_path.exists():
+                temp_path.unlink()
+            continue
+        
+        logger.info(f"Created delta {from_version} -> {version}: {delta_size} of {file_size} bytes")
+        created.append({
+            "from_version": from_version,
+            "to_version": version,
+            "filename": delta_filename,
+            "checksum": delta_checksum,
+            "file_size": delta_size
+        })
+    
+    return created
+
+# Precompressed firmware variants, created once at upload and served by content
+# negotiation: 'gzip' and the lighter zlib-wrapped 'deflate' (inflatable by the
+# ESP32 ROM miniz). Variants that barely compress are not kept.
+FIRMWARE_ENCODINGS = {
+    'gzip': {'suffix': '.gz', 'compress': lambda data: gzip.compress(data, compresslevel=9, mtime=0)},
+    'deflate': {'suffix': '.zz', 'compress': lambda data: zlib.compress(data, 9)}
+}
+VARIANT_MAX_SIZE_RATIO = 0.95
+
+def create_firmware_variants(filename: str, image_path: Path) -> List[Dict[str, Any]]:
+    """Create the compressed variants of a firmware image. Returns the variants kept."""
+    data = image_path.read_bytes()
+    
+    created = []
+    for encoding, codec in FIRMWARE_ENCODINGS.items():
+        variant_filename = filename + codec['suffix']
+        compressed = codec['compress'](data)
+        if len(compressed) > len(data) * VARIANT_MAX_SIZE_RATIO:
+            logger.info(f"Skipping {encoding} variant of {filename}: {len(compressed)} of {len(data)} bytes")
+            continue
+        
+        sha256_hex = hashlib.sha256(compressed).hexdigest()
+        checksum = f"sha256:{sha256_hex}"
+        md5_checksum = hashlib.md5(compressed).hexdigest()
+        
+        # Variants are blobs too: identical images share them, and they are garbage
+        # collected once no variant row references them
+        temp_path = get_firmware_storage_path() / (variant_filename + '.tmp')
+        temp_path.write_bytes(compressed)
+        try:
+            with sqlite3.connect(DB_PATH) as conn:
+                cursor = conn.cursor()
+                cursor.execute('INSERT OR IGNORE INTO firmware_blobs (sha256, size) VALUES (?, ?)', (sha256_hex, len(compressed)))
+                cursor.execute('''
+                    INSERT INTO firmware_variants (filename, encoding, variant_filename, checksum, md5_checksum, file_size, blob_sha256)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (filename, encoding) DO UPDATE SET
+                        checksum = excluded.checksum, md5_checksum = excluded.md5_checksum,
+                        file_size = excluded.file_size, blob_sha256 = excluded.blob_sha256
+                ''', (filename, encoding, variant_filename, checksum, md5_checksum, len(compressed), sha256_hex))
+                
+                # Store the blob while the insert holds the write lock, then commit
+                blob_stored = store_firmware_blob(temp_path, sha256_hex)
+                try:
+                    conn.commit()
+                except Exception:
+                    if blob_stored:
+                        get_blob_path(sha256_hex).unlink()
+                    raise
+        finally:
+            if temp_path.exists():
+                temp_path.unlink()
+        verify_firmware_file(variant_filename, checksum, len(compressed), get_blob_path(sha256_hex))
+        
+        created.append({"encoding": encoding, "filename": variant_filename, "checksum": checksum, "file_size": len(compressed)})
+    
+    if created:
+        logger.info(f"Created {', '.join(v['encoding'] for v in created)} variants of {filename}")
+    return created
+
+def delete_firmware_variants(filename: str):
+    """Delete the compressed variants of a firmware image.
+
+    Their blobs are removed by collect_firmware_blobs once nothing references them.
+    """
+    with sqlite3.connect(DB_PATH) as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT variant_filename FROM firmware_variants WHERE filename = ?', (filename,))
+        variant_filenames = [row[0] for row in cursor.fetchall()]
+        cursor.execute('DELETE FROM firmware_variants WHERE filename = ?', (filename,))
+        conn.commit()
+    
+    forget_firmware_integrity(*variant_filenames)
+    for variant_filename in variant_filenames:
+        # Variants stored by name before they moved into the blob store
+        (get_firmware_storage_path() / variant_filename).unlink(missing_ok=True)
+
+def parse_accept_encoding(accept_encoding: Optional[str]) -> Dict[str, float]:
+    """Parse an Accept-Encoding header into {coding: q}."""
+    codings = {}
+    for item in (accept_encoding or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        if not coding:
+            continue
+        q = 1.0
+        match = re.search(r'q=([0-9.]+)', params)
+        if match:
+            try:
+                q = float(match.group(1))
+            except ValueError:
+                q = 0.0
+        codings[coding.strip().lower()] = q
+    return codings
+
+def choose_firmware_encoding(available: Dict[str, int], accept_encoding: Optional[str]) -> Optional[str]:
+    """Pick the smallest available variant acceptable to the client ({encoding: size})."""
+    accepted = parse_accept_encoding(accept_encoding)
+    candidates = [encoding for encoding in available
+                  if accepted.get(encoding, accepted.get('*', 0)) > 0]
+    return min(candidates, key=lambda encoding: available[encoding]) if candidates else None
+
+def resolve_firmware_representation(filename: str, encoding: Optional[str] = None, accept_encoding: Optional[str] = None) -> Dict[str, Any]:
+    """Find the file to serve for a firmware download (from the in-memory download index).
+
+    An explicit encoding ('identity' for the raw image) wins over Accept-Encoding.
+    Raises HTTPException when the firmware or variant is unknown or failed
+    integrity verification.
+    """
+    # Validate filename to prevent directory traversal
+    if not re.match(r'^[a-zA-Z0-9_\-\.]+\.bin$', filename):
+        raise HTTPException(status_code=400, detail="Invalid firmware filename")
+    
+    firmware_info = firmware_files.get(filename)
+    if not firmware_info:
+        raise HTTPException(status_code=404, detail="Firmware not found")
+    variants = firmware_info['variants']
+    
+    # Pick the representation: an explicit variant, or the smallest acceptable one
+    if encoding:
+        encoding = encoding.lower()
+        if encoding != 'identity' and encoding not in variants:
+            raise HTTPException(status_code=404, detail=f"Firmware variant '{encoding}' not found")
+        content_encoding = None if encoding == 'identity' else encoding
+    else:
+        content_encoding = choose_firmware_encoding({name: variant['file_size'] for name, variant in variants.items()}, accept_encoding)
+    
+    if content_encoding:
+        variant = variants[content_encoding]
+        file_name, checksum, size = variant['variant_filename'], variant['checksum'], variant['file_size']
+        path = variant['path']
+    else:
+        file_name, checksum, size = filename, firmware_info['checksum'], firmware_info['file_size']
+        path = firmware_info['path']
+    
+    # Files are hashed at upload, at startup and periodically; never serve a bad one
+    integrity = get_firmware_integrity(file_name)
+    if integrity and integrity['status'] != 'ok':
+        logger.error(f"Refusing to serve {file_name}: integrity {integrity['status']}")
+        if integrity['status'] == 'missing':
+            raise HTTPException(status_code=404, detail="Firmware file not found on disk")
+        raise HTTPException(status_code=500, detail="Firmware file corrupted")
+    
+    return {
+        'version': firmware_info['version'],
+        'firmware_checksum': firmware_info['checksum'],
+        'content_encoding': content_encoding,
+        'path': path,
+        'size': size,
+        'checksum': checksum
+    }
+
+# Firmware integrity: every served file (images and their compressed variants) is
+# hashed in full at upload, at startup and periodically in the background, so
+# corruption is caught without hashing on the download path.
+FIRMWARE_VERIFY_INTERVAL_SECONDS = 6 * 3600
+FIRMWARE_HASH_BLOCK_SIZE = 8 * 1024 * 1024
+firmware_integrity: Dict[str, Dict[str, Any]] = {}
+firmware_integrity_lock = threading.Lock()
+firmware_integrity_last_run: Optional[str] = None
+
+def hash_file_sha256(path: Path) -> str:
+    """SHA256 hex digest of a file, read through mmap in large blocks."""
+    sha256_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return sha256_hash.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for offset in range(0, len(mapped), FIRMWARE_HASH_BLOCK_SIZE):
+                sha256_hash.update(mapped[offset:offset + FIRMWARE_HASH_BLOCK_SIZE])
+    return sha256_hash.hexdigest()
+
+def verify_firmware_file(file_name: str, expected_checksum: str, expected_size: int, path: Optional[Path] = None) -> Dict[str, Any]:
+    """Hash a firmware file against its recorded size and SHA256 and record the result.
+
+    file_name is the name the file is served as; path defaults to that name in
+    the firmware directory (files in the blob store pass their blob path).
+    """
+    path = path or get_firmware_storage_path() / file_name
+    expected = (expected_checksum or '').split(':', 1)[-1].lower()
+    actual = None
+    
+    try:
+        actual_size = path.stat().st_size
+        if actual_size != expected_size:
+            status = 'size_mismatch'
+        else:
+            actual = hash_file_sha256(path)
+            status = 'ok' if actual == expected else 'checksum_mismatch'
+    except FileNotFoundError:
+        actual_size = None
+        status = 'missing'
+    
+    result = {
+        "file": file_name,
+        "status": status,
+        "expected_checksum": expected,
+        "actual_checksum": actual,
+        "expected_size": expected_size,
+        "actual_size": actual_size,
+        "verified_at": datetime.now(timezone.utc).isoformat()
+    }
+    with firmware_integrity_lock:
+        firmware_integrity[file_name] = result
+    
+    if status != 'ok':
+        logger.error(f"Firmware integrity check failed for {file_name}: {status}")
+    return result
+
+def verify_all_firmware() -> List[Dict[str, Any]]:
+    """Verify every firmware image and variant; forgets files no longer in the database."""
+    global firmware_integrity_last_run
+    
+    with sqlite3.connect(DB_PATH) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT filename, checksum, file_size, blob_sha256 FROM firmware_versions
+            UNION ALL
+            SELECT variant_filename, checksum, file_size, blob_sha256 FROM firmware_variants
+        ''')
+        files = cursor.fetchall()
+    
+    results = [
+        verify_firmware_file(file_name, checksum, file_size, get_firmware_image_path(file_name, blob_sha256))
+        for file_name, checksum, file_size, blob_sha256 in files
+    ]
+    
+    known = {row[0] for row in files}
+    with firmware_integrity_lock:
+        for file_name in [name for name in firmware_integrity if name not in known]:
+            del firmware_integrity[file_name]
+        firmware_integrity_last_run = datetime.now(timezone.utc).isoformat()
+    
+    failed = sum(1 for result in results if result['status'] != 'ok')
+    logger.info(f"Verified {len(results)} firmware files ({failed} failed)")
+    return results
+
+def get_firmware_integrity(file_name: str) -> Optional[Dict[str, Any]]:
+    """Last verification result of a firmware file, if it has been verified."""
+    with firmware_integrity_lock:
+        return firmware_integrity.get(file_name)
+
+def forget_firmware_integrity(*file_names: str):
+    """Drop verification results of deleted firmware files."""
+    with firmware_integrity_lock:
+        for file_name in file_names:
+            firmware_integrity.pop(file_name, None)
+
+def run_firmware_verification(stop_event: threading.Event):
+    """Background loop re-verifying firmware files until stop_event is set."""
+    while not stop_event.wait(FIRMWARE_VERIFY_INTERVAL_SECONDS):
+        try:
+            verify_all_firmware()
+        except Exception as e:
+            logger.error(f"Firmware verification failed: {e}")
+
+# Resumable downloads: firmware responses carry a strong ETag per representation
+# and honour single byte ranges; chunk manifests let devices verify what they have.
+FIRMWARE_CHUNK_SIZE = 64 * 1024
+FIRMWARE_READ_SIZE = 64 * 1024
+
+# Transfer offload: when enabled, download_firmware() validates and logs the request
+# and then hands the transfer to the Caddy front end with an X-Accel-Redirect to
+# FIRMWARE_ACCEL_PREFIX (see Caddyfile); Caddy then handles Range itself.
+FIRMWARE_ACCEL_REDIRECT = os.getenv("FIRMWARE_ACCEL_REDIRECT", "false").lower() in ("1", "true", "yes")
+FIRMWARE_ACCEL_PREFIX = "/internal/firmware/"
+
+def firmware_etag(checksum: str) -> str:
+    """Strong ETag of a firmware representation, derived from its checksum."""
+    return f'"{checksum.split(":", 1)[-1][:32]}"'
+
+def parse_byte_range(range_header: str, size: int) -> Optional[tuple]:
+    """Parse a Range header into an inclusive (start, end) byte range.
+
+    Returns None for headers that are ignored (other units, multiple ranges,
+    malformed) and raises ValueError if the range can't be satisfied.
+    """
+    match = re.fullmatch(r'\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*', range_header)
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    first, last = match.groups()
+    
+    if not first:
+        # Suffix range: the last N bytes
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise ValueError("unsatisfiable range")
+        return max(0, size - suffix), size - 1
+    
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError("unsatisfiable range")
+    return start, min(int(last), size - 1) if last else size - 1
+
+def iter_file_range(path: Path, start: int, end: int):
+    """Yield bytes start..end (inclusive) of a file."""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = f.read(min(FIRMWARE_READ_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+@lru_cache(maxsize=64)
+def compute_chunk_hashes(path: str, mtime_ns: int, size: int, chunk_size: int) -> tuple:
+    """SHA256 of each chunk of a file (cached per file version and chunk size)."""
+    hashes = []
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hashes.append(hashlib.sha256(chunk).hexdigest())
+    return tuple(hashes)
+
+def delete_firmware_deltas(version: str):
+    """Delete the patches from and to a firmware version."""
+    with sqlite3.connect(DB_PATH) as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT filename FROM firmware_deltas WHERE from_version = ? OR to_version = ?', (version, version))
+        filenames = [row[0] for row in cursor.fetchall()]
+        cursor.execute('DELETE FROM firmware_deltas WHERE from_version = ? OR to_version = ?', (version, version))
+        conn.commit()
+    
+    for delta_filename in filenames:
+        delta_path = get_delta_storage_path() / delta_filename
+        if delta_path.exists():
+            delta_path.unlink()
 
 def is_admin_user(user_id: str, request: Request = None) -> bool:
     """Check if user has admin privileges"""
@@ -809,8 +2910,12 @@ def revoke_api_token(token_id: int) -> bool:
             conn.commit()
             return cursor.rowcount > 0
 
-def log_device_request(client_ip: str, user_agent: str, device_id: Optional[str] = None):
-    """Log a device request for tracking purposes. Only tracks devices with device_id."""
+def log_device_request(client_ip: str, user_agent: str, device_id: Optional[str] = None, ota_check: Optional[tuple] = None):
+    """Log a device request for tracking purposes. Only tracks devices with device_id.
+
+    ota_check is an optional (current_version, offered_version) recorded in the same
+    transaction; checks without an offer only bump the counters, like touch_ota_check.
+    """
     try:
         # Only log devices that provide a device_id
         if not device_id:
@@ -821,42 +2926,86 @@ def log_device_request(client_ip: str, user_agent: str, device_id: Optional[str]
                 cursor = conn.cursor()
                 
                 now = datetime.now(pytz.UTC)
-                
-                # Update existing device or create new one
+
+                # Known devices are updated by primary key via the registry
+                registered = get_registered_device(device_id)
+                if registered:
+                    cursor.execute('''
+                        UPDATE devices
+                        SET last_seen = ?, request_count = request_count + 1, client_ip = ?
+                        WHERE id = ?
+                    ''', (now, client_ip, registered['id']))
+                    if cursor.rowcount:
+                        if ota_check:
+                            record_ota_check(cursor, device_id, *ota_check, client_ip, user_agent, log_entry=ota_check[1] is not None)
+                        conn.commit()
+                        record_device_presence(device_id, now.timestamp())
+                        return
+                    
+                    # The row is gone (deleted outside the registry): forget it and register anew
+                    unregister_device(registered['id'])
+
+                # Unknown to the registry: update existing device or create new one
                 cursor.execute('''
-                    UPDATE devices 
+                    UPDATE devices
                     SET last_seen = ?, request_count = request_count + 1, client_ip = ?
                     WHERE device_id = ?
                 ''', (now, client_ip, device_id))
-                
+
                 # If no rows updated, insert new device with device_id
                 if cursor.rowcount == 0:
                     fingerprint = create_device_fingerprint(client_ip, user_agent or "unknown", now)
-                    
+
                     # Get MAC address from predefined devices or generate one
-                    mac_address = None
-                    cursor.execute('SELECT mac_address FROM predefined_devices WHERE device_id = ?', (device_id,))
-                    predefined_result = cursor.fetchone()
-                    if predefined_result and predefined_result[0]:
-                        mac_address = predefined_result[0]
-                    else:
-                        mac_address = generate_mac_from_device_id(device_id)
-                    
+                    mac_address = get_device_mac_address(device_id, None)
+
                     cursor.execute('''
-                        INSERT OR IGNORE INTO devices 
+                        INSERT OR IGNORE INTO devices
                         (client_ip, device_fingerprint, first_seen, last_seen, user_agent, device_id, mac_address)
                         VALUES (?, ?, ?, ?, ?, ?, ?)
                     ''', (client_ip, fingerprint, now, now, user_agent, device_id, mac_address))
-                    
+
                     logger.info(f"New device registered: {device_id} with MAC {mac_address}")
-                
+
+                if ota_check:
+                    record_ota_check(cursor, device_id, *ota_check, client_ip, user_agent, log_entry=ota_check[1] is not None)
                 conn.commit()
+
+                cursor.execute('SELECT id, mac_address FROM devices WHERE device_id = ?', (device_id,))
+                row = cursor.fetchone()
+                if row:
+                    register_device(row[0], device_id, row[1])
+                record_device_presence(device_id, now.timestamp())
                 
     except Exception as e:
         logger.error(f"Error logging device request: {e}")
 
 # Initialize database on startup
 init_database()
+load_device_registry()
+load_device_presence()
+import_legacy_firmware_files()
+collect_firmware_blobs()
+load_firmware_catalog()
+verify_all_firmware()
+
+# Background jobs run in daemon threads for the lifetime of the app
+background_jobs_stop = threading.Event()
+
+@app.on_event("startup")
+def start_background_jobs():
+    """Start periodic maintenance jobs."""
+    background_jobs_stop.clear()
+    threading.Thread(target=run_ota_log_compaction, args=(background_jobs_stop,), name="ota-log-compaction", daemon=True).start()
+    threading.Thread(target=run_rollout_evaluation, args=(background_jobs_stop,), name="rollout-evaluation", daemon=True).start()
+    threading.Thread(target=run_firmware_verification, args=(background_jobs_stop,), name="firmware-verification", daemon=True).start()
+    threading.Thread(target=run_ota_status_writer, args=(background_jobs_stop,), name="ota-status-writer", daemon=True).start()
+
+@app.on_event("shutdown")
+def stop_background_jobs():
+    """Signal periodic maintenance jobs to stop and write out queued OTA status events."""
+    background_jobs_stop.set()
+    flush_ota_status_queue()
 
 # Add custom logging middleware
 @app.middleware("http")
@@ -989,7 +3138,7 @@ async def fetch_data_for_date_range(start_date: datetime, num_days: int = 3):
 
 # Global cache for committed colors
 committed_colors_cache = {}
-cache_file_path = Path("/tmp/committed_colors.json")
+cache_file_path = Path(os.getenv("ENERGY_PEBBLE_COLOR_CACHE_PATH", "/tmp/committed_colors.json"))
 
 def load_committed_colors():
     """Load committed colors from file cache."""
@@ -1028,6 +3177,27 @@ def get_committed_colors_for_window(commitment_hours: int = 8) -> Dict[str, str]
     
     return committed_colors
 
+def get_committed_schedule() -> List[Dict[str, str]]:
+    """Get the committed colors from the current hour on, up to the first uncommitted hour.
+    
+    Committed colors never change, so each entry stays valid until the end of its hour.
+    """
+    hour = datetime.now(pytz.UTC).replace(minute=0, second=0, microsecond=0)
+    schedule = []
+    
+    while True:
+        hour_key = hour.isoformat().replace('+00:00', 'Z')
+        if hour_key not in committed_colors_cache:
+            break
+        hour += timedelta(hours=1)
+        schedule.append({
+            "hour": hour_key,
+            "color_code": committed_colors_cache[hour_key],
+            "valid_until": hour.isoformat().replace('+00:00', 'Z')
+        })
+    
+    return schedule
+
 def commit_colors_for_window(color_codes: List[Dict[str, Any]], commitment_hours: int = 8):
     """Commit colors for the next N hours to ensure stability."""
     global committed_colors_cache
@@ -1183,6 +3353,7 @@ async def root():
         "endpoints": {
             "/api/json": "Get electricity price data in JSON format (Optional query param: date=YYYY-MM-DD)",
             "/api/color-code": "Get color codes for current hour and next 11 hours (Optional query params: date=YYYY-MM-DD, device_id=string)",
+            "/api/device/sync": "Get colors, OTA availability and server time in one request (Headers: X-Device-ID, optional X-Current-Version)",
             "/api/sample": "Get sample electricity price data for testing",
             "/api/sample-color-code": "Get sample color codes for current hour and next 11 hours",
             "/docs": "API documentation (Swagger UI)"
@@ -1228,30 +3399,8 @@ async def get_json_data(date: Optional[str] = None):
         logger.error(f"Unexpected error in get_json_data: {e}")
         raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
 
-@app.get("/api/color-code", tags=["public"])
-async def get_color_code(request: Request, date: Optional[str] = None, device_id: Optional[str] = None):
-    """
-    Get color codes (G, Y, R) for the current hour and next 7 hours based on price analysis.
-    Uses commitment-based stability - colors won't change once committed.
-    
-    Optional query parameters:
-    - date: Date in YYYY-MM-DD format
-    - device_id: ESP32 eFuse MAC address (12-character hex string, e.g., '904fb0453ab4') for device tracking
-    
-    Alternative device identification:
-    Device ID can also be provided via X-Device-ID header for improved security and cleaner URLs.
-    """
-    # Log device request for tracking (non-breaking)
-    try:
-        client_ip = get_real_client_ip(request)
-        user_agent = request.headers.get("user-agent", "unknown")
-        final_device_id = device_id or request.headers.get("x-device-id")
-        
-        # Log request asynchronously to avoid blocking
-        log_device_request(client_ip, user_agent, final_device_id)
-    except Exception as e:
-        logger.warning(f"Device logging failed (non-critical): {e}")
-    
+async def compute_color_codes(date: Optional[str] = None) -> Dict[str, Any]:
+    """Color codes for the current hour and next 8 hours, committing new colors (see /api/color-code)."""
     # Validate date format if provided
     if date and not re.match(r'^\d{4}-\d{2}-\d{2}$', date):
         raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
@@ -1295,10 +3444,20 @@ async def get_color_code(request: Request, date: Optional[str] = None, device_id
     # Add metadata about commitment status
     committed_count = sum(1 for color in display_colors if color.get("committed", False))
     
+    # Committed hours (including the ones just committed) get a validity window, so
+    # devices can render them locally without calling home. The schedule is about
+    # today, so it is left out when another date was requested.
+    committed_schedule = get_committed_schedule()
+    valid_until = {entry["hour"]: entry["valid_until"] for entry in committed_schedule}
+    for color in display_colors:
+        color["valid_until"] = valid_until.get(color["hour"])
+    
     # Return both the current hour and display color codes
     return {
         "current_hour": current_hour,
         "hour_color_codes": display_colors,
+        "committed_schedule": None if date else committed_schedule,
+        "schedule_valid_until": committed_schedule[-1]["valid_until"] if committed_schedule and not date else None,
         "meta": {
             "total_hours": len(display_colors),
             "committed_hours": committed_count,
@@ -1308,6 +3467,197 @@ async def get_color_code(request: Request, date: Optional[str] = None, device_id
         }
     }
 
+@app.get("/api/color-code", tags=["public"])
+async def get_color_code(request: Request, response: Response, date: Optional[str] = None, device_id: Optional[str] = None):
+    """
+    Get color codes (G, Y, R) for the current hour and next 7 hours based on price analysis.
+    Uses commitment-based stability - colors won't change once committed.
+    
+    Optional query parameters:
+    - date: Date in YYYY-MM-DD format
+    - device_id: ESP32 eFuse MAC address (12-character hex string, e.g., '904fb0453ab4') for device tracking
+    
+    Alternative device identification:
+    Device ID can also be provided via X-Device-ID header for improved security and cleaner URLs.
+    
+    Validity:
+    Committed hours carry valid_until (the end of that hour); flexible hours have
+    valid_until null and may still change. committed_schedule lists every committed
+    hour from the current one on, and schedule_valid_until is the end of the last one:
+    until then a device can show its colors without requesting them again. Both are
+    null when a date is given.
+    
+    Polling:
+    For requests with a device ID, next_poll_at and poll_interval (also sent as
+    Retry-After, in seconds) say when to request colors again; see /api/device/sync.
+    """
+    client_ip = get_real_client_ip(request)
+    final_device_id = device_id or request.headers.get("x-device-id")
+    
+    # Log device request for tracking (non-breaking)
+    try:
+        user_agent = request.headers.get("user-agent", "unknown")
+        
+        # Log request asynchronously to avoid blocking
+        log_device_request(client_ip, user_agent, final_device_id)
+    except Exception as e:
+        logger.warning(f"Device logging failed (non-critical): {e}")
+    
+    result = await compute_color_codes(date)
+    # Only devices are scheduled and counted towards the poll rate; browsers refresh on their own
+    if final_device_id:
+        apply_poll_schedule(result, response, schedule_next_poll(final_device_id, committed_hours_ahead()))
+    return result
+
+# Server-directed polling: color and sync responses tell each device when to poll
+# next (next_poll_at, and Retry-After in seconds). Every device polls at its own
+# stable phase of the poll interval (a hash of its ID), so a fleet that rebooted
+# together spreads out within one interval. The interval grows while colors are
+# committed hours ahead, and is stretched when the observed poll rate exceeds
+# DEVICE_POLL_TARGET_RATE, so the request rate can be tuned without a firmware release.
+# Syncs also discover firmware updates, so devices may take up to DEVICE_POLL_MAX_SECONDS
+# to see a new release; while one is rolling out to their channel they sync at least
+# every DEVICE_POLL_ROLLOUT_MAX_SECONDS so stages fill in time.
+DEVICE_POLL_MIN_SECONDS = 5 * 60
+DEVICE_POLL_INTERVAL_SECONDS = 15 * 60
+DEVICE_POLL_MAX_SECONDS = 6 * 60 * 60
+DEVICE_POLL_ROLLOUT_MAX_SECONDS = 60 * 60
+DEVICE_POLL_TARGET_RATE = float(os.environ.get("DEVICE_POLL_TARGET_RATE", "5"))  # polls per second
+
+device_poll_times: deque = deque()
+device_poll_lock = threading.Lock()
+
+def record_device_poll(now: float) -> float:
+    """Count a device poll. Returns the poll rate per second over the last minute."""
+    with device_poll_lock:
+        device_poll_times.append(now)
+        while device_poll_times[0] <= now - 60:
+            device_poll_times.popleft()
+        return len(device_poll_times) / 60
+
+def committed_hours_ahead() -> int:
+    """Number of consecutive hours, starting with the current one, whose colors are committed."""
+    return len(get_committed_schedule())
+
+def schedule_next_poll(device_key: str, committed_hours: int = 0, max_interval: int = DEVICE_POLL_MAX_SECONDS) -> int:
+    """Seconds until a device should poll again."""
+    now = time.time()
+    rate = record_device_poll(now)
+    
+    # Committed colors can't change, so the device only needs to top up its window
+    # before it runs out (keeping two hours in hand)
+    interval = DEVICE_POLL_INTERVAL_SECONDS
+    if committed_hours > 2:
+        interval = max(interval, min((committed_hours - 2) * 3600, max_interval))
+    
+    # Stretch the interval while devices poll faster than the target rate
+    if rate > DEVICE_POLL_TARGET_RATE:
+        interval = min(int(interval * rate / DEVICE_POLL_TARGET_RATE), max_interval)
+    
+    # Poll at the device's own phase of the interval, at least DEVICE_POLL_MIN_SECONDS from now
+    # and never later than the interval (which keeps the committed hours in hand)
+    window = interval - DEVICE_POLL_MIN_SECONDS
+    phase = int(hashlib.sha256(device_key.lower().encode()).hexdigest()[:8], 16) % window
+    return DEVICE_POLL_MIN_SECONDS + (phase - int(now)) % window
+
+def apply_poll_schedule(result: Dict[str, Any], response: Response, wait: int):
+    """Add next_poll_at/poll_interval to a device response and send Retry-After."""
+    result["next_poll_at"] = (datetime.now(timezone.utc) + timedelta(seconds=wait)).isoformat()
+    result["poll_interval"] = wait
+    response.headers["Retry-After"] = str(wait)
+
+# Combined device sync: colors, OTA availability and the server time in one request,
+# recorded with a single write. Replaces polling /api/color-code and /api/ota/check.
+
+@app.get("/api/device/sync", tags=["public"])
+async def device_sync(request: Request, response: Response):
+    """
+    Get everything a device needs in one request: colors, OTA availability and server time.
+    
+    Required headers:
+    - X-Device-ID: ESP32 eFuse MAC address (12-character hex string, e.g., '904fb0453ab4')
+    
+    Optional headers:
+    - X-Current-Version: Current firmware version; without it the OTA check is skipped and ota is null
+    - X-Device-Product, X-Device-Variant, X-Device-Channel: as for /api/ota/check
+    
+    Response:
+    - server_time: Current server time (UTC)
+    - next_poll_at / poll_interval: When to sync next, also sent as Retry-After in seconds.
+      Spread per device, longer while colors are committed ahead and under load (up to
+      6 hours, so new releases may take that long to be offered), at most an hour while
+      a release is rolling out to the device's channel, and sooner while a download
+      slot is awaited.
+    - current_hour, colors: One G/Y/R letter per hour starting at the current hour (9 hours);
+      the first committed_hours of them won't change and can be shown until valid_until
+      without syncing again. colors is null with a colors_error when price data is
+      unavailable, the rest of the sync still works.
+    - ota: The /api/ota/check answer: update details, or update_available false
+      (with retry_after when the download capacity is in use)
+    
+    The heartbeat and the OTA check are recorded in one transaction. Checks without
+    an offer only bump the OTA check counters instead of writing an ota_logs row.
+    """
+    device_id = None
+    try:
+        device_id = request.headers.get("x-device-id")
+        current_version = request.headers.get("x-current-version")
+        if not device_id:
+            raise HTTPException(status_code=400, detail="X-Device-ID header is required")
+        product, variant, channel = get_device_firmware_target(request)
+        
+        client_ip = get_real_client_ip(request)
+        user_agent = request.headers.get("user-agent", "unknown")
+        retry_after = None
+        
+        ota = None
+        offered_version = None
+        if current_version:
+            latest_firmware = get_latest_firmware_for_device(device_id, current_version, product, variant, channel)
+            retry_after = acquire_download_lease(device_id) if latest_firmware else None
+            if retry_after is not None:
+                ota = {"update_available": False, "current_version": current_version, "retry_after": retry_after}
+            elif latest_firmware:
+                offered_version = latest_firmware['version']
+                ota = build_ota_update(latest_firmware, current_version)
+            else:
+                ota = {"update_available": False, "current_version": current_version}
+        
+        log_device_request(client_ip, user_agent, device_id, (current_version, offered_version) if current_version else None)
+        
+        sync = {"server_time": datetime.now(timezone.utc).isoformat()}
+        
+        try:
+            color_codes = await compute_color_codes()
+            sync["current_hour"] = color_codes["current_hour"]
+            sync["colors"] = "".join(color["color_code"] for color in color_codes["hour_color_codes"])
+            sync["committed_hours"] = min(len(color_codes["committed_schedule"]), len(sync["colors"]))
+            sync["valid_until"] = color_codes["schedule_valid_until"]
+        except Exception as e:
+            logger.warning(f"Colors unavailable for device sync of {device_id}: {e}")
+            sync["current_hour"] = None
+            sync["colors"] = None
+            sync["committed_hours"] = 0
+            sync["valid_until"] = None
+            sync["colors_error"] = e.detail if isinstance(e, HTTPException) else str(e)
+        
+        # Come back sooner while a rollout is filling its stages or when waiting for a download slot
+        max_interval = DEVICE_POLL_MAX_SECONDS
+        if current_version and firmware_rollout_in_progress(product, variant, channel):
+            max_interval = DEVICE_POLL_ROLLOUT_MAX_SECONDS
+        wait = schedule_next_poll(device_id, committed_hours_ahead(), max_interval)
+        apply_poll_schedule(sync, response, min(wait, retry_after) if retry_after is not None else wait)
+        
+        sync["ota"] = ota
+        response.headers["Cache-Control"] = "no-store"
+        return sync
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error syncing device {device_id}: {e}")
+        raise HTTPException(status_code=500, detail=f"Error syncing device: {str(e)}")
+
 @app.get("/api/sample", tags=["public"])
 async def get_sample_data():
     """
@@ -1471,11 +3821,10 @@ async def test_user_devices(request: Request, user: str = Query("thomas", descri
             for row in cursor.fetchall():
                 status, minutes_ago = calculate_device_status(row[3])
                 
-                # Get MAC address using helper function
+                # Get MAC address from the device registry
                 stored_mac = row[8]  # mac_address from database
                 device_id = row[6]
-                device_db_id = row[0]
-                mac_address = get_device_mac_address(cursor, conn, device_db_id, device_id, stored_mac)
+                mac_address = get_device_mac_address(device_id, stored_mac)
                 
                 device = {
                     "id": row[0],
@@ -1539,11 +3888,10 @@ async def get_user_devices(request: Request):
             for row in cursor.fetchall():
                 status, minutes_ago = calculate_device_status(row[3])
                 
-                # Get MAC address using helper function
+                # Get MAC address from the device registry
                 stored_mac = row[8]  # mac_address from database
                 device_id = row[6]
-                device_db_id = row[0]
-                mac_address = get_device_mac_address(cursor, conn, device_db_id, device_id, stored_mac)
+                mac_address = get_device_mac_address(device_id, stored_mac)
                 
                 device = {
                     "id": row[0],
@@ -1651,6 +3999,7 @@ async def update_user_profile(request: Request):
                 cursor.execute('UPDATE user_devices SET user_id = ? WHERE user_id = ?', (new_username, user_id))
                 conn.commit()
                 logger.info(f"Updated user_devices: {user_id} -> {new_username}")
+            rename_registered_device_owner(user_id, new_username)
         
         return {
             "message": "Profile updated successfully",
@@ -1691,6 +4040,7 @@ async def test_update_user_profile(request: Request, user: str = Query("thomas",
                 cursor.execute('UPDATE user_devices SET user_id = ? WHERE user_id = ?', (new_username, user))
                 conn.commit()
                 logger.info(f"Test: Updated user_devices: {user} -> {new_username}")
+            rename_registered_device_owner(user, new_username)
         
         logger.info(f"Test: User {user} updated profile: username={new_username}, password_changed={bool(new_password)}")
         
@@ -1757,12 +4107,14 @@ async def upload_firmware(
     version: str = Form(...),
     product_name: str = Form("energy_pebble"),
     variant: str = Form("release"),
+    channel: str = Form(None),
     is_stable: bool = Form(True),
     force_update: bool = Form(False),
     min_version: str = Form(None),
     rollback_version: str = Form(None),
     release_notes: str = Form(None),
     target_devices: str = Form(None),
+    staged_rollout: bool = Form(False),
     sha256_checksum: str = Form(...),
     md5_checksum: str = Form(...)
 ):
@@ -1775,16 +4127,21 @@ async def upload_firmware(
     - version: Version in semantic versioning format (e.g., "v1.2.0", "1.2.0") - 'v' prefix will be added if missing
     - product_name: Product name (default: "energy_pebble")  
     - variant: Build variant (default: "release")
-    - is_stable: Whether this is a stable release (default: true)
+    - channel: Release channel, "stable", "beta" or "nightly" (optional, overrides is_stable)
+    - is_stable: Whether this is a stable release (default: true); without a channel, non-stable releases go to beta
     - force_update: Whether to force device updates (default: false)
     - min_version: Minimum version required for update in same format as version (optional)
     - rollback_version: Version to rollback to if update fails in same format as version (optional)
     - release_notes: Release notes for this version (optional)
     - target_devices: JSON array of target ESP32 eFuse MAC addresses (optional, e.g., '["904fb0453ab4"]')
+    - staged_rollout: Roll a stable release out in stages starting at 1% of devices (default: false, the release is offered to all devices at once)
     - sha256_checksum: Pre-calculated SHA256 checksum (required)
     - md5_checksum: Pre-calculated MD5 checksum (required)
     
-    Both checksums are trusted from the compilation process and stored directly.
+    The file is streamed to a temporary file while both checksums are computed;
+    uploads that don't match the provided checksums or exceed the size limit are
+    rejected, and the binary only appears under its final name once the database
+    entry exists.
     """
     try:
         # Check authentication and admin privileges
@@ -1812,14 +4169,17 @@ async def upload_firmware(
             if cursor.fetchone():
                 raise HTTPException(status_code=409, detail=f"Firmware version {version} already exists")
         
-        # Validate and sanitize product name and variant
-        product_name = re.sub(r'[^a-zA-Z0-9_-]', '', product_name.lower())
-        variant = re.sub(r'[^a-zA-Z0-9_-]', '', variant.lower())
+        # Validate and sanitize product name, variant and channel
+        product_name = normalize_firmware_target(product_name, DEFAULT_FIRMWARE_PRODUCT)
+        variant = normalize_firmware_target(variant, DEFAULT_FIRMWARE_VARIANT)
         
-        if not product_name:
-            product_name = "energy_pebble"
-        if not variant:
-            variant = "release"
+        if channel:
+            channel = channel.strip().lower()
+            if channel not in FIRMWARE_CHANNELS:
+                raise HTTPException(status_code=400, detail=f"channel must be one of: {', '.join(FIRMWARE_CHANNELS)}")
+            is_stable = channel == 'stable'
+        else:
+            channel = 'stable' if is_stable else 'beta'
         
         # Generate filename: product_version_variant.bin
         if variant == "release":
@@ -1827,45 +4187,91 @@ async def upload_firmware(
         else:
             filename = f"{product_name}_{version}_{variant}.bin"
         
-        # Save file to firmware directory
+        # Stream the upload into a temp file in firmware storage, hashing in the same pass
         firmware_storage = get_firmware_storage_path()
         firmware_storage.mkdir(exist_ok=True)
         
-        firmware_path = firmware_storage / filename
-        
-        # Write file
-        with open(firmware_path, "wb") as buffer:
-            shutil.copyfileobj(firmware_file.file, buffer)
+        temp_path = None
         
-        # Use provided checksums (trusted from compilation process)
-        checksum = sha256_checksum
-        logger.info(f"Using provided checksums - SHA256: {sha256_checksum}, MD5: {md5_checksum} (trusted)")
+        try:
+            temp_path, file_size, sha256_hex, md5_hex = await asyncio.to_thread(
+                receive_firmware_upload, firmware_file.file, firmware_storage, filename
+            )
+            
+            # Reject uploads that don't match the checksums from the build
+            if sha256_checksum.split(':', 1)[-1].strip().lower() != sha256_hex:
+                raise HTTPException(status_code=400, detail=f"SHA256 checksum mismatch: received file has sha256:{sha256_hex}")
+            if md5_checksum.strip().lower() != md5_hex:
+                raise HTTPException(status_code=400, detail=f"MD5 checksum mismatch: received file has {md5_hex}")
+            
+            checksum = f"sha256:{sha256_hex}"
+            md5_checksum = md5_hex
             
-        file_size = firmware_path.stat().st_size
+            # Insert into database, referencing the blob (identical bytes are stored once)
+            with sqlite3.connect(DB_PATH) as conn:
+                cursor = conn.cursor()
+                cursor.execute('INSERT OR IGNORE INTO firmware_blobs (sha256, size) VALUES (?, ?)', (sha256_hex, file_size))
+                try:
+                    cursor.execute('''
+                        INSERT INTO firmware_versions 
+                        (version, version_key, filename, checksum, md5_checksum, file_size, is_stable, force_update, 
+                         min_version, rollback_version, release_notes, target_devices, created_by, blob_sha256,
+                         product, variant, channel)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', (version, version_sort_key(version), filename, checksum, md5_checksum, file_size, is_stable, force_update,
+                          min_version, rollback_version, release_notes, target_devices, user_id, sha256_hex,
+                          product_name, variant, channel))
+                except sqlite3.IntegrityError:
+                    # Lost a race with a concurrent upload of the same version
+                    raise HTTPException(status_code=409, detail=f"Firmware version {version} already exists")
+                
+                firmware_id = cursor.lastrowid
+                
+                if is_stable and staged_rollout:
+                    cursor.execute('''
+                        INSERT OR REPLACE INTO firmware_rollouts (version, percentage, updated_by)
+                        VALUES (?, ?, ?)
+                    ''', (version, ROLLOUT_STAGES[0], user_id))
+                
+                # Store the blob while the insert holds the write lock, then commit
+                blob_stored = store_firmware_blob(temp_path, sha256_hex)
+                try:
+                    conn.commit()
+                except Exception:
+                    if blob_stored:
+                        get_blob_path(sha256_hex).unlink()
+                    raise
+        finally:
+            if temp_path and temp_path.exists():
+                temp_path.unlink()
         
-        # Insert into database
-        with sqlite3.connect(DB_PATH) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO firmware_versions 
-                (version, filename, checksum, md5_checksum, file_size, is_stable, force_update, 
-                 min_version, rollback_version, release_notes, target_devices, created_by)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (version, filename, checksum, md5_checksum, file_size, is_stable, force_update,
-                  min_version, rollback_version, release_notes, target_devices, user_id))
-            
-            firmware_id = cursor.lastrowid
-            conn.commit()
+        # Hash the stored image once; downloads refuse it if it doesn't match
+        image_path = get_blob_path(sha256_hex)
+        integrity = await asyncio.to_thread(verify_firmware_file, filename, checksum, file_size, image_path)
         
+        # Compressed variants, and patches from recent stable releases offered to devices running them
+        variants = await asyncio.to_thread(create_firmware_variants, filename, image_path)
+        deltas = await asyncio.to_thread(create_firmware_deltas, version) if is_stable else []
+        
+        load_firmware_catalog()
         logger.info(f"Firmware {version} uploaded successfully by {user_id}")
         
         return {
             "id": firmware_id,
             "version": version,
             "filename": filename,
+            "product": product_name,
+            "variant": variant,
+            "channel": channel,
             "checksum": checksum,
             "md5_checksum": md5_checksum,
             "file_size": file_size,
+            "blob_sha256": sha256_hex,
+            "deduplicated": not blob_stored,
+            "rollout_percentage": ROLLOUT_STAGES[0] if is_stable and staged_rollout else 100,
+            "integrity": integrity['status'],
+            "variants": variants,
+            "deltas": deltas,
             "message": f"Firmware {version} uploaded successfully"
         }
         
@@ -1873,12 +4279,6 @@ async def upload_firmware(
         raise
     except Exception as e:
         logger.error(f"Error uploading firmware: {e}")
-        # Clean up file if it was created
-        try:
-            if 'firmware_path' in locals() and firmware_path.exists():
-                firmware_path.unlink()
-        except:
-            pass
         raise HTTPException(status_code=500, detail=f"Error uploading firmware: {str(e)}")
 
 @app.get("/api/firmware/versions", tags=["firmware"])
@@ -1902,9 +4302,9 @@ async def list_firmware_versions(request: Request):
             cursor.execute('''
                 SELECT id, version, filename, checksum, file_size, release_date, 
                        is_stable, force_update, min_version, rollback_version, 
-                       release_notes, target_devices, created_by
+                       release_notes, target_devices, created_by, product, variant, channel
                 FROM firmware_versions 
-                ORDER BY release_date DESC
+                ORDER BY version_key DESC, release_date DESC
             ''')
             
             versions = []
@@ -1924,6 +4324,9 @@ async def list_firmware_versions(request: Request):
                     "release_notes": row[10],
                     "target_devices": row[11],
                     "created_by": row[12],
+                    "product": row[13],
+                    "variant": row[14],
+                    "channel": row[15],
                     # Add public URLs
                     "download_url": f"https://energypebble.tdlx.nl/firmware/{filename}",
                     "checksum_url": f"https://energypebble.tdlx.nl/api/firmware/{filename}/checksum"
@@ -1938,21 +4341,392 @@ async def list_firmware_versions(request: Request):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error listing firmware versions: {e}")
-        raise HTTPException(status_code=500, detail=f"Error listing firmware versions: {str(e)}")
+        logger.error(f"Error listing firmware versions: {e}")
+        raise HTTPException(status_code=500, detail=f"Error listing firmware versions: {str(e)}")
+
+@app.delete("/api/firmware/versions/{version}", tags=["firmware"])
+async def delete_firmware_version(version: str, request: Request):
+    """
+    Delete a firmware version and its associated file.
+    
+    Authentication: Requires admin privileges via Authelia.
+    
+    Path parameters:
+    - version: Firmware version to delete (e.g., 'v1.2.0')
+    
+    Permanently removes the firmware version from database and deletes the
+    associated binary file from the filesystem. This action cannot be undone.
+    """
+    try:
+        user_info = get_current_user(request)
+        user_id = user_info['user_id']
+        if not user_info['is_admin']:
+            raise HTTPException(status_code=403, detail="Admin privileges required")
+        
+        with sqlite3.connect(DB_PATH) as conn:
+            cursor = conn.cursor()
+            
+            # Get firmware info before deleting
+            cursor.execute('SELECT filename FROM firmware_versions WHERE version = ?', (version,))
+            result = cursor.fetchone()
+            
+            if not result:
+                raise HTTPException(status_code=404, detail=f"Firmware version {version} not found")
+            
+            filename = result[0]
+            
+            # Delete from database
+            cursor.execute('DELETE FROM firmware_versions WHERE version = ?', (version,))
+            
+            if cursor.rowcount == 0:
+                raise HTTPException(status_code=404, detail=f"Firmware version {version} not found")
+            
+            cursor.execute('DELETE FROM firmware_rollouts WHERE version = ?', (version,))
+            
+            conn.commit()
+        
+        delete_firmware_deltas(version)
+        delete_firmware_variants(filename)
+        forget_firmware_integrity(filename)
+        load_firmware_catalog()
+        
+        # Remove the legacy file name, if any; the blob goes once nothing references it
+        legacy_path = get_firmware_storage_path() / filename
+        if legacy_path.exists():
+            legacy_path.unlink()
+            logger.info(f"Deleted legacy firmware file: {legacy_path}")
+        collect_firmware_blobs()
+        
+        logger.info(f"Firmware {version} deleted by {user_id}")
+        
+        return {
+            "message": f"Firmware version {version} deleted successfully",
+            "version": version,
+            "filename": filename
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error deleting firmware version {version}: {e}")
+        raise HTTPException(status_code=500, detail=f"Error deleting firmware: {str(e)}")
+
+@app.post("/api/firmware/versions/{version}/deltas", tags=["firmware"])
+async def create_firmware_version_deltas(version: str, request: Request):
+    """
+    Create missing delta patches to a firmware version.
+    
+    Authentication: Requires admin privileges via Authelia.
+    
+    Path parameters:
+    - version: Firmware version to create patches to (e.g., 'v1.2.0')
+    
+    Uploads create patches automatically; this covers releases uploaded before
+    delta support or while detools was unavailable.
+    """
+    try:
+        user_info = get_current_user(request)
+        user_id = user_info['user_id']
+        if not user_info['is_admin']:
+            raise HTTPException(status_code=403, detail="Admin privileges required")
+        
+        if detools is None:
+            raise HTTPException(status_code=503, detail="Delta updates are unavailable (detools is not installed)")
+        
+        with sqlite3.connect(DB_PATH) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1 FROM firmware_versions WHERE version = ?', (version,))
+            if not cursor.fetchone():
+                raise HTTPException(status_code=404, detail=f"Firmware version {version} not found")
+        
+        deltas = await asyncio.to_thread(create_firmware_deltas, version)
+        if deltas:
+            load_firmware_catalog()
+        logger.info(f"Created {len(deltas)} deltas to {version} for {user_id}")
+        
+        return {
+            "version": version,
+            "deltas": deltas
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error creating deltas for firmware {version}: {e}")
+        raise HTTPException(status_code=500, detail=f"Error creating deltas: {str(e)}")
+
+@app.post("/api/firmware/versions/{version}/variants", tags=["firmware"])
+async def create_firmware_version_variants(version: str, request: Request):
+    """
+    (Re)create the compressed download variants of a firmware version.
+    
+    Authentication: Requires admin privileges via Authelia.
+    
+    Path parameters:
+    - version: Firmware version (e.g., 'v1.2.0')
+    
+    Uploads create variants automatically; this covers releases uploaded before
+    compressed downloads were supported.
+    """
+    try:
+        user_info = get_current_user(request)
+        user_id = user_info['user_id']
+        if not user_info['is_admin']:
+            raise HTTPException(status_code=403, detail="Admin privileges required")
+        
+        with sqlite3.connect(DB_PATH) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT filename, blob_sha256 FROM firmware_versions WHERE version = ?', (version,))
+            result = cursor.fetchone()
+            if not result:
+                raise HTTPException(status_code=404, detail=f"Firmware version {version} not found")
+        
+        filename = result[0]
+        image_path = get_firmware_image_path(filename, result[1])
+        if not image_path.exists():
+            raise HTTPException(status_code=404, detail="Firmware file not found on disk")
+        
+        variants = await asyncio.to_thread(create_firmware_variants, filename, image_path)
+        load_firmware_catalog()
+        logger.info(f"Created {len(variants)} variants of {filename} for {user_id}")
+        
+        return {
+            "version": version,
+            "filename": filename,
+            "variants": variants
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error creating variants for firmware {version}: {e}")
+        raise HTTPException(status_code=500, detail=f"Error creating variants: {str(e)}")
+
+@app.get("/api/firmware/integrity", tags=["firmware"])
+async def get_firmware_integrity_status(request: Request):
+    """
+    Get the latest integrity verification results of all firmware files.
+    
+    Authentication: Requires admin privileges via Authelia.
+    
+    Firmware images and their compressed variants are hashed in full at upload,
+    at startup and periodically in the background. Files that fail are not served.
+    """
+    try:
+        user_info = get_current_user(request)
+        user_id = user_info['user_id']
+        if not user_info['is_admin']:
+            raise HTTPException(status_code=403, detail="Admin privileges required")
+        
+        with firmware_integrity_lock:
+            files = sorted(firmware_integrity.values(), key=lambda result: result['file'])
+            last_run = firmware_integrity_last_run
+        
+        return {
+            "files": files,
+            "failed": [result['file'] for result in files if result['status'] != 'ok'],
+            "last_run": last_run,
+            "interval_seconds": FIRMWARE_VERIFY_INTERVAL_SECONDS
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting firmware integrity: {e}")
+        raise HTTPException(status_code=500, detail=f"Error getting firmware integrity: {str(e)}")
+
+@app.post("/api/firmware/integrity", tags=["firmware"])
+async def verify_firmware_integrity(request: Request):
+    """
+    Re-verify all firmware files now.
+    
+    Authentication: Requires admin privileges via Authelia.
+    
+    Runs the same full verification as the background job, e.g. after restoring
+    files on disk, and returns the results.
+    """
+    try:
+        user_info = get_current_user(request)
+        user_id = user_info['user_id']
+        if not user_info['is_admin']:
+            raise HTTPException(status_code=403, detail="Admin privileges required")
+        
+        results = await asyncio.to_thread(verify_all_firmware)
+        logger.info(f"Firmware verification triggered by {user_id}")
+        
+        return {
+            "files": results,
+            "failed": [result['file'] for result in results if result['status'] != 'ok'],
+            "last_run": firmware_integrity_last_run,
+            "interval_seconds": FIRMWARE_VERIFY_INTERVAL_SECONDS
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error verifying firmware integrity: {e}")
+        raise HTTPException(status_code=500, detail=f"Error verifying firmware integrity: {str(e)}")
+
+@app.get("/api/firmware/ota-stats", tags=["firmware"])
+async def get_ota_statistics(request: Request):
+    """
+    Get comprehensive OTA update statistics and metrics.
+    
+    Authentication: Requires admin privileges via Authelia.
+    
+    Returns detailed analytics including total checks, success rates, version
+    distribution, device activity, and update performance metrics for
+    administrative monitoring and insights.
+    """
+    try:
+        user_info = get_current_user(request)
+        user_id = user_info['user_id']
+        if not user_info['is_admin']:
+            raise HTTPException(status_code=403, detail="Admin privileges required")
+        
+        with sqlite3.connect(DB_PATH) as conn:
+            cursor = conn.cursor()
+            
+            # Status totals (maintained by the ota_logs triggers, see init_ota_stats_counters)
+            cursor.execute("SELECT name, value FROM ota_stats_counters WHERE name LIKE 'status:%'")
+            status_counts = {name[len('status:'):]: value for name, value in cursor.fetchall()}
+            total_checks = status_counts.get('check', 0)
+            successful_updates = status_counts.get('completed', 0)
+            failed_updates = status_counts.get('failed', 0)
+            
+            # Get recent activity (last 7 days)
+            cursor.execute('''
+                SELECT day, count
+                FROM ota_daily_activity
+                WHERE day >= DATE('now', '-7 days')
+                ORDER BY day DESC
+            ''')
+            recent_activity = [{"date": row[0], "count": row[1]} for row in cursor.fetchall()]
+            
+            # Get firmware version distribution
+            cursor.execute('''
+                SELECT version, device_count
+                FROM firmware_version_counts
+                ORDER BY device_count DESC
+            ''')
+            version_distribution = [{"version": row[0], "device_count": row[1]} for row in cursor.fetchall()]
+            
+            return {
+                "total_checks": total_checks,
+                "successful_updates": successful_updates,
+                "failed_updates": failed_updates,
+                "success_rate": (successful_updates / max(total_checks, 1)) * 100,
+                "recent_activity": recent_activity,
+                "version_distribution": version_distribution
+            }
+            
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting OTA statistics: {e}")
+        raise HTTPException(status_code=500, detail=f"Error getting OTA statistics: {str(e)}")
+
+@app.get("/api/firmware/install-telemetry", tags=["firmware"])
+async def get_install_telemetry_endpoint(
+    request: Request,
+    version: Optional[str] = Query(None, description="Only this firmware version (e.g., 'v1.2.0')")
+):
+    """
+    Get per-version install telemetry.
+    
+    Authentication: Requires admin privileges via Authelia.
+    
+    For each firmware version: histograms of the install duration reported by
+    devices and of the time from a device's first offer to its completed install,
+    with approximate p50/p90, and failed installs by reason. Histogram buckets are
+    powers of two seconds; le_seconds is a bucket's upper bound. The histograms are
+    updated as status reports arrive.
+    """
+    try:
+        user_info = get_current_user(request)
+        user_id = user_info['user_id']
+        if not user_info['is_admin']:
+            raise HTTPException(status_code=403, detail="Admin privileges required")
+        
+        with sqlite3.connect(DB_PATH) as conn:
+            cursor = conn.cursor()
+            versions = get_install_telemetry(cursor, version)
+        
+        return {
+            "versions": versions,
+            "total": len(versions)
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting install telemetry: {e}")
+        raise HTTPException(status_code=500, detail=f"Error getting install telemetry: {str(e)}")
+
+@app.post("/api/firmware/ota-logs/compact", tags=["firmware"])
+async def compact_ota_logs_endpoint(
+    request: Request,
+    retention_days: int = Query(OTA_LOG_RETENTION_DAYS, ge=1, description="Keep raw OTA logs for this many days")
+):
+    """
+    Roll raw OTA logs older than the retention window into daily rollups now.
+    
+    Authentication: Requires admin privileges via Authelia.
+    
+    The same compaction runs periodically in the background; this endpoint
+    triggers it on demand, e.g. after changing the retention window.
+    """
+    try:
+        user_info = get_current_user(request)
+        user_id = user_info['user_id']
+        if not user_info['is_admin']:
+            raise HTTPException(status_code=403, detail="Admin privileges required")
+        
+        compacted = await asyncio.to_thread(compact_ota_logs, retention_days)
+        logger.info(f"OTA log compaction ({retention_days} days) triggered by {user_id}: {compacted} rows")
+        
+        return {
+            "compacted_rows": compacted,
+            "retention_days": retention_days
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error compacting OTA logs: {e}")
+        raise HTTPException(status_code=500, detail=f"Error compacting OTA logs: {str(e)}")
 
-@app.delete("/api/firmware/versions/{version}", tags=["firmware"])
-async def delete_firmware_version(version: str, request: Request):
+def get_rollout_info(cursor, version: str) -> Optional[Dict[str, Any]]:
+    """Rollout details of a release as returned by the rollout endpoints."""
+    cursor.execute('''
+        SELECT version, percentage, state, stage_started_at, stage_successes, stage_failures, updated_by
+        FROM firmware_rollouts
+        WHERE version = ?
+    ''', (version,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    reports = row[4] + row[5]
+    return {
+        "version": row[0],
+        "percentage": row[1],
+        "state": row[2],
+        "stage_started_at": row[3],
+        "stage_successes": row[4],
+        "stage_failures": row[5],
+        "stage_failure_rate": row[5] / reports if reports else 0.0,
+        "next_percentage": next_rollout_stage(row[1]) if row[2] == 'active' else None,
+        "updated_by": row[6]
+    }
+
+@app.get("/api/firmware/rollouts", tags=["firmware"])
+async def list_firmware_rollouts(request: Request):
     """
-    Delete a firmware version and its associated file.
+    List staged rollouts of firmware releases and current download admission.
     
     Authentication: Requires admin privileges via Authelia.
     
-    Path parameters:
-    - version: Firmware version to delete (e.g., 'v1.2.0')
-    
-    Permanently removes the firmware version from database and deletes the
-    associated binary file from the filesystem. This action cannot be undone.
+    Releases without a rollout entry are offered to all devices.
     """
     try:
         user_info = get_current_user(request)
@@ -1962,54 +4736,44 @@ async def delete_firmware_version(version: str, request: Request):
         
         with sqlite3.connect(DB_PATH) as conn:
             cursor = conn.cursor()
-            
-            # Get firmware info before deleting
-            cursor.execute('SELECT filename FROM firmware_versions WHERE version = ?', (version,))
-            result = cursor.fetchone()
-            
-            if not result:
-                raise HTTPException(status_code=404, detail=f"Firmware version {version} not found")
-            
-            filename = result[0]
-            
-            # Delete from database
-            cursor.execute('DELETE FROM firmware_versions WHERE version = ?', (version,))
-            
-            if cursor.rowcount == 0:
-                raise HTTPException(status_code=404, detail=f"Firmware version {version} not found")
-            
-            conn.commit()
-        
-        # Delete physical file
-        firmware_path = get_firmware_storage_path() / filename
-        if firmware_path.exists():
-            firmware_path.unlink()
-            logger.info(f"Deleted firmware file: {firmware_path}")
-        
-        logger.info(f"Firmware {version} deleted by {user_id}")
+            cursor.execute('''
+                SELECT r.version
+                FROM firmware_rollouts r
+                JOIN firmware_versions fv ON fv.version = r.version
+                ORDER BY fv.version_key DESC
+            ''')
+            rollouts = [get_rollout_info(cursor, row[0]) for row in cursor.fetchall()]
         
         return {
-            "message": f"Firmware version {version} deleted successfully",
-            "version": version,
-            "filename": filename
+            "rollouts": rollouts,
+            "stages": ROLLOUT_STAGES,
+            "max_failure_rate": ROLLOUT_MAX_FAILURE_RATE,
+            "min_reports": ROLLOUT_MIN_REPORTS,
+            "stage_min_hours": ROLLOUT_STAGE_MIN_HOURS,
+            "active_downloads": get_active_download_count(),
+            "max_concurrent_downloads": MAX_CONCURRENT_DOWNLOADS
         }
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error deleting firmware version {version}: {e}")
-        raise HTTPException(status_code=500, detail=f"Error deleting firmware: {str(e)}")
+        logger.error(f"Error listing firmware rollouts: {e}")
+        raise HTTPException(status_code=500, detail=f"Error listing rollouts: {str(e)}")
 
-@app.get("/api/firmware/ota-stats", tags=["firmware"])
-async def get_ota_statistics(request: Request):
+@app.put("/api/firmware/rollouts/{version}", tags=["firmware"])
+async def update_firmware_rollout(version: str, rollout_update: FirmwareRolloutUpdate, request: Request):
     """
-    Get comprehensive OTA update statistics and metrics.
+    Change the rollout of a firmware release.
     
     Authentication: Requires admin privileges via Authelia.
     
-    Returns detailed analytics including total checks, success rates, version
-    distribution, device activity, and update performance metrics for
-    administrative monitoring and insights.
+    Path parameters:
+    - version: Firmware version (e.g., 'v1.2.0')
+    
+    Setting a percentage starts a new stage at that percentage; 100 completes
+    the rollout. Setting state 'paused' stops automatic advancement and new offers
+    (devices fall back to the previous release), 'active' resumes it and 'complete'
+    offers the release to all devices.
     """
     try:
         user_info = get_current_user(request)
@@ -2017,60 +4781,109 @@ async def get_ota_statistics(request: Request):
         if not user_info['is_admin']:
             raise HTTPException(status_code=403, detail="Admin privileges required")
         
+        percentage = rollout_update.percentage
+        state = rollout_update.state
+        if percentage is None and state is None:
+            raise HTTPException(status_code=400, detail="percentage or state is required")
+        if percentage is not None and not 0 <= percentage <= 100:
+            raise HTTPException(status_code=400, detail="percentage must be between 0 and 100")
+        if state is not None and state not in ROLLOUT_STATES:
+            raise HTTPException(status_code=400, detail=f"state must be one of: {', '.join(ROLLOUT_STATES)}")
+        
         with sqlite3.connect(DB_PATH) as conn:
             cursor = conn.cursor()
+            cursor.execute('SELECT 1 FROM firmware_versions WHERE version = ?', (version,))
+            if not cursor.fetchone():
+                raise HTTPException(status_code=404, detail=f"Firmware version {version} not found")
             
-            # Get total OTA checks
-            cursor.execute('SELECT COUNT(*) FROM ota_logs WHERE status = "check"')
-            total_checks = cursor.fetchone()[0]
-            
-            # Get successful updates
-            cursor.execute('SELECT COUNT(*) FROM ota_logs WHERE status = "completed"')
-            successful_updates = cursor.fetchone()[0]
-            
-            # Get failed updates
-            cursor.execute('SELECT COUNT(*) FROM ota_logs WHERE status = "failed"')
-            failed_updates = cursor.fetchone()[0]
-            
-            # Get recent activity (last 7 days)
-            cursor.execute('''
-                SELECT DATE(check_timestamp) as date, COUNT(*) as count
-                FROM ota_logs 
-                WHERE check_timestamp >= datetime('now', '-7 days')
-                GROUP BY DATE(check_timestamp)
-                ORDER BY date DESC
-            ''')
-            recent_activity = [{"date": row[0], "count": row[1]} for row in cursor.fetchall()]
-            
-            # Get firmware version distribution
-            cursor.execute('''
-                SELECT current_firmware_version, COUNT(*) as count
-                FROM devices 
-                WHERE current_firmware_version IS NOT NULL
-                GROUP BY current_firmware_version
-                ORDER BY count DESC
-            ''')
-            version_distribution = [{"version": row[0], "device_count": row[1]} for row in cursor.fetchall()]
+            current = get_rollout_info(cursor, version)
+            if state == 'complete' or percentage == 100:
+                percentage, state = 100, 'complete'
+            elif percentage is None:
+                percentage = current['percentage'] if current else 100
+            if state is None:
+                state = current['state'] if current and current['state'] != 'complete' else 'active'
             
-            return {
-                "total_checks": total_checks,
-                "successful_updates": successful_updates,
-                "failed_updates": failed_updates,
-                "success_rate": (successful_updates / max(total_checks, 1)) * 100,
-                "recent_activity": recent_activity,
-                "version_distribution": version_distribution
-            }
+            if current and current['percentage'] == percentage:
+                cursor.execute('''
+                    UPDATE firmware_rollouts SET state = ?, updated_by = ? WHERE version = ?
+                ''', (state, user_id, version))
+            else:
+                # A new stage starts with fresh counters
+                cursor.execute('''
+                    INSERT OR REPLACE INTO firmware_rollouts (version, percentage, state, stage_started_at, updated_by)
+                    VALUES (?, ?, ?, CURRENT_TIMESTAMP, ?)
+                ''', (version, percentage, state, user_id))
+            conn.commit()
             
+            rollout = get_rollout_info(cursor, version)
+        
+        load_firmware_catalog()
+        logger.info(f"Rollout of {version} set to {rollout['state']} at {rollout['percentage']}% by {user_id}")
+        
+        return rollout
+        
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error getting OTA statistics: {e}")
-        raise HTTPException(status_code=500, detail=f"Error getting OTA statistics: {str(e)}")
+        logger.error(f"Error updating rollout of firmware {version}: {e}")
+        raise HTTPException(status_code=500, detail=f"Error updating rollout: {str(e)}")
 
 # OTA (Over-The-Air) Update Endpoints
 
+def get_device_firmware_target(request: Request) -> tuple[str, str, str]:
+    """(product, variant, channel) from a device's X-Device-Product/Variant/Channel headers."""
+    product = normalize_firmware_target(request.headers.get("x-device-product"), DEFAULT_FIRMWARE_PRODUCT)
+    variant = normalize_firmware_target(request.headers.get("x-device-variant"), DEFAULT_FIRMWARE_VARIANT)
+    channel = (request.headers.get("x-device-channel") or DEFAULT_FIRMWARE_CHANNEL).strip().lower()
+    if channel not in FIRMWARE_CHANNELS:
+        raise HTTPException(status_code=400, detail=f"X-Device-Channel must be one of: {', '.join(FIRMWARE_CHANNELS)}")
+    return product, variant, channel
+
+def build_ota_update(latest_firmware: Dict[str, Any], current_version: str) -> Dict[str, Any]:
+    """OTA answer offering a release to a device running current_version."""
+    update = {
+        "update_available": True,
+        "version": latest_firmware['version'],
+        "download_url": f"https://energypebble.tdlx.nl/firmware/{latest_firmware['filename']}",
+        "checksum": latest_firmware['checksum'],
+        "md5_checksum": latest_firmware['md5_checksum'],
+        "size_bytes": latest_firmware['file_size'],
+        "force_update": latest_firmware['force_update'],
+        "rollback_version": latest_firmware['rollback_version'],
+        "release_notes": latest_firmware['release_notes'],
+        "estimated_install_time": "2-3 minutes"
+    }
+    
+    # Precompressed variants of the full image, for devices that inflate while downloading
+    if latest_firmware['variants']:
+        update["encodings"] = {
+            encoding: {
+                "download_url": f"https://energypebble.tdlx.nl/firmware/{latest_firmware['filename']}?encoding={encoding}",
+                "checksum": variant['checksum'],
+                "md5_checksum": variant['md5_checksum'],
+                "size_bytes": variant['file_size']
+            }
+            for encoding, variant in latest_firmware['variants'].items()
+        }
+    
+    # Offer a patch from the device's version when there is one; the patched
+    # image must match the full image checksum above
+    delta = latest_firmware['deltas'].get(version_sort_key(current_version))
+    if delta:
+        update["delta"] = {
+            "from_version": delta['from_version'],
+            "download_url": f"https://energypebble.tdlx.nl/firmware/delta/{delta['filename']}",
+            "checksum": delta['checksum'],
+            "md5_checksum": delta['md5_checksum'],
+            "size_bytes": delta['file_size'],
+            "format": f"detools-sequential-{DELTA_COMPRESSION}"
+        }
+    
+    return update
+
 @app.get("/api/ota/check", tags=["ota"])
-async def check_ota_updates(request: Request):
+async def check_ota_updates(request: Request, response: Response):
     """
     Check for available OTA updates for a device.
     Called by devices every 12 hours to check for firmware updates.
@@ -2079,6 +4892,12 @@ async def check_ota_updates(request: Request):
     - X-Device-ID: ESP32 eFuse MAC address (12-character hex string, e.g., '904fb0453ab4')
     - X-Current-Version: Current firmware version in semantic versioning format (e.g., 'v1.2.0', '1.2.0')
     
+    Optional headers:
+    - X-Device-Product: Hardware product the firmware is built for (default: 'energy_pebble')
+    - X-Device-Variant: Build variant (default: 'release')
+    - X-Device-Channel: Release channel, 'stable', 'beta' or 'nightly' (default: 'stable').
+      Channels are inclusive: beta devices are also offered stable releases, nightly devices everything.
+    
     Device ID Format:
     The device ID should be the ESP32's eFuse MAC address, which is a unique 12-character 
     hexadecimal string burned into each chip during manufacturing. This is different from 
@@ -2088,7 +4907,31 @@ async def check_ota_updates(request: Request):
     Versions should follow semantic versioning (MAJOR.MINOR.PATCH) with optional 'v' prefix.
     Examples: 'v1.0.0', '1.2.3', 'v2.1.0'. The system will normalize versions by adding 
     the 'v' prefix if missing.
+    
+    Conditional requests:
+    Every answer carries an ETag. Sending it back in If-None-Match returns
+    304 Not Modified with no body while the answer is unchanged.
+    
+    Download admission:
+    Only a limited number of devices may download firmware at once. When an
+    update is available but all download slots are taken, the response has
+    update_available false, a retry_after in seconds (also sent as Retry-After)
+    and no ETag. A 304 for an offer the device already received takes no slot.
+    
+    Compressed downloads:
+    The encodings object lists precompressed variants of the full image with their
+    own download URLs and checksums; the decoded image matches checksum.
+    
+    Delta updates:
+    When a patch from the device's current version exists, the update includes a
+    delta object with its own download URL and checksums. Devices that can't apply
+    patches use the full image.
+    
+    Static manifests:
+    Devices may poll /firmware/manifests/{product}/{variant}/{channel}.json instead
+    and only call this endpoint when the manifest says requires_check.
     """
+    device_id = None
     try:
         # Extract device info from headers
         device_id = request.headers.get("x-device-id")
@@ -2099,29 +4942,43 @@ async def check_ota_updates(request: Request):
         if not current_version:
             raise HTTPException(status_code=400, detail="X-Current-Version header is required")
         
+        product, variant, channel = get_device_firmware_target(request)
+        
         # Extract client info for logging
         client_ip = get_real_client_ip(request) if request else None
         user_agent = request.headers.get("user-agent") if request else None
         
         # Get latest firmware for this device
-        latest_firmware = get_latest_firmware_for_device(device_id, current_version)
+        latest_firmware = get_latest_firmware_for_device(device_id, current_version, product, variant, channel)
+        etag = ota_check_etag(latest_firmware, device_id, current_version, product, variant, channel)
+        
+        # The ETag is derived from the answer, so a matching one means nothing changed.
+        # Devices only hold an ETag for an offer they were admitted to, so no slot is taken here.
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            touch_ota_check(device_id, current_version)
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+        
+        # Fresh offers need a download slot; deferred answers are transient and carry no ETag
+        retry_after = acquire_download_lease(device_id) if latest_firmware else None
+        if retry_after is not None:
+            log_ota_check(device_id, current_version, None, client_ip, user_agent)
+            response.headers["Retry-After"] = str(retry_after)
+            response.headers["Cache-Control"] = "no-store"
+            return {
+                "update_available": False,
+                "current_version": current_version,
+                "retry_after": retry_after,
+                "message": "An update is available but the download capacity is in use, check again later"
+            }
+        
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "no-cache"
         
         if latest_firmware:
             # Log the OTA check with offered version
             log_ota_check(device_id, current_version, latest_firmware['version'], client_ip, user_agent)
             
-            return {
-                "update_available": True,
-                "version": latest_firmware['version'],
-                "download_url": f"https://energypebble.tdlx.nl/firmware/{latest_firmware['filename']}",
-                "checksum": latest_firmware['checksum'],
-                "md5_checksum": latest_firmware['md5_checksum'],
-                "size_bytes": latest_firmware['file_size'],
-                "force_update": latest_firmware['force_update'],
-                "rollback_version": latest_firmware['rollback_version'],
-                "release_notes": latest_firmware['release_notes'],
-                "estimated_install_time": "2-3 minutes"
-            }
+            return build_ota_update(latest_firmware, current_version)
         else:
             # Log the OTA check with no update available
             log_ota_check(device_id, current_version, None, client_ip, user_agent)
@@ -2132,6 +4989,8 @@ async def check_ota_updates(request: Request):
                 "message": "You're running the latest firmware"
             }
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error checking OTA updates for device {device_id}: {e}")
         raise HTTPException(status_code=500, detail=f"Error checking for updates: {str(e)}")
@@ -2146,42 +5005,20 @@ async def report_ota_status(device_id: str, status_report: OTAStatusReport, requ
     - device_id: ESP32 eFuse MAC address (12-character hex string, e.g., '904fb0453ab4')
     
     Request body should contain OTAStatusReport with installation status and details.
+    The optional timestamp records when the status was reached; it defaults to now.
+    Reports are queued and written in batches, so they show up within about a second.
     """
     try:
         client_ip = get_real_client_ip(request) if request else None
         user_agent = request.headers.get("user-agent") if request else None
         
-        with sqlite3.connect(DB_PATH) as conn:
-            cursor = conn.cursor()
-            
-            # Insert status report into ota_logs
-            cursor.execute('''
-                INSERT INTO ota_logs (device_id, current_version, status, error_message, install_duration, ip_address, user_agent)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (device_id, status_report.current_version, status_report.status, 
-                  status_report.error_message, status_report.install_duration, client_ip, user_agent))
-            
-            # Update device status and firmware version if completed successfully
-            if status_report.status == "completed" and status_report.current_version:
-                cursor.execute('''
-                    UPDATE devices 
-                    SET current_firmware_version = ?, ota_status = 'idle'
-                    WHERE device_id = ?
-                ''', (status_report.current_version, device_id))
-            elif status_report.status in ["downloading", "installing"]:
-                cursor.execute('''
-                    UPDATE devices 
-                    SET ota_status = ?
-                    WHERE device_id = ?
-                ''', (status_report.status, device_id))
-            elif status_report.status == "failed":
-                cursor.execute('''
-                    UPDATE devices 
-                    SET ota_status = 'failed'
-                    WHERE device_id = ?
-                ''', (device_id,))
-            
-            conn.commit()
+        events = [ota_status_event(device_id, status_report, client_ip, user_agent)]
+        if not enqueue_ota_status_events(events):
+            await asyncio.to_thread(write_ota_status_events_with_retry, events)
+        
+        # The download is over once the device installs or gives up
+        if status_report.status != "downloading":
+            release_download_lease(device_id)
             
         logger.info(f"OTA status update from {device_id}: {status_report.status}")
         
@@ -2194,6 +5031,49 @@ async def report_ota_status(device_id: str, status_report: OTAStatusReport, requ
         logger.error(f"Error recording OTA status for device {device_id}: {e}")
         raise HTTPException(status_code=500, detail=f"Error recording status: {str(e)}")
 
+@app.post("/api/ota/status/{device_id}/batch", tags=["ota"])
+async def report_ota_status_batch(device_id: str, batch: OTAStatusBatch, request: Request = None):
+    """
+    Device reports several OTA status events at once.
+    For devices that buffer status transitions (e.g. while offline) and send them together.
+    
+    Path parameters:
+    - device_id: ESP32 eFuse MAC address (12-character hex string, e.g., '904fb0453ab4')
+    
+    Request body: {"events": [OTAStatusReport, ...]} in the order they happened, at most
+    OTA_STATUS_MAX_BATCH_EVENTS events. Each event should carry its timestamp.
+    """
+    try:
+        if not batch.events:
+            raise HTTPException(status_code=400, detail="events must not be empty")
+        if len(batch.events) > OTA_STATUS_MAX_BATCH_EVENTS:
+            raise HTTPException(status_code=400, detail=f"At most {OTA_STATUS_MAX_BATCH_EVENTS} events per batch")
+        
+        client_ip = get_real_client_ip(request) if request else None
+        user_agent = request.headers.get("user-agent") if request else None
+        
+        events = [ota_status_event(device_id, report, client_ip, user_agent) for report in batch.events]
+        if not enqueue_ota_status_events(events):
+            await asyncio.to_thread(write_ota_status_events_with_retry, events)
+        
+        # The download is over once the device installs or gives up
+        if batch.events[-1].status != "downloading":
+            release_download_lease(device_id)
+        
+        logger.info(f"OTA status batch from {device_id}: {', '.join(report.status for report in batch.events)}")
+        
+        return {
+            "status": "received",
+            "events": len(events),
+            "message": f"{len(events)} status events recorded for device {device_id}"
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error recording OTA status batch for device {device_id}: {e}")
+        raise HTTPException(status_code=500, detail=f"Error recording status: {str(e)}")
+
 @app.get("/api/firmware/{filename}/checksum", tags=["ota"])
 async def get_firmware_checksum(filename: str):
     """
@@ -2234,70 +5114,253 @@ async def get_firmware_checksum(filename: str):
         logger.error(f"Error getting checksum for {filename}: {e}")
         raise HTTPException(status_code=500, detail=f"Error getting checksum: {str(e)}")
 
+@app.get("/api/firmware/{filename}/chunks", tags=["ota"])
+async def get_firmware_chunk_manifest(
+    filename: str,
+    encoding: str = Query("identity", description="Representation the chunks refer to ('identity', 'gzip' or 'deflate')"),
+    chunk_size: int = Query(FIRMWARE_CHUNK_SIZE, ge=4096, le=1024 * 1024, description="Chunk size in bytes (multiple of 4096)")
+):
+    """
+    Get the chunk manifest of a firmware download.
+    Public endpoint for resuming and verifying partial downloads.
+    
+    Lists the SHA256 of every chunk_size block of the representation, together
+    with its ETag for If-Range (null when downloads are offloaded to the web
+    server, which uses the ETag of its own responses). A device keeps the chunks
+    that verify and requests the rest with Range.
+    """
+    try:
+        if chunk_size % 4096:
+            raise HTTPException(status_code=400, detail="chunk_size must be a multiple of 4096")
+        
+        firmware = resolve_firmware_representation(filename, encoding)
+        stat = firmware['path'].stat()
+        hashes = await asyncio.to_thread(compute_chunk_hashes, str(firmware['path']), stat.st_mtime_ns, stat.st_size, chunk_size)
+        
+        return {
+            "filename": filename,
+            "encoding": firmware['content_encoding'] or "identity",
+            "size_bytes": firmware['size'],
+            "checksum": firmware['checksum'],
+            "etag": None if FIRMWARE_ACCEL_REDIRECT else firmware_etag(firmware['checksum']),
+            "chunk_size": chunk_size,
+            "chunks": [
+                {
+                    "index": index,
+                    "offset": index * chunk_size,
+                    "size": min(chunk_size, firmware['size'] - index * chunk_size),
+                    "sha256": chunk_hash
+                }
+                for index, chunk_hash in enumerate(hashes)
+            ]
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting chunk manifest for {filename}: {e}")
+        raise HTTPException(status_code=500, detail=f"Error getting chunk manifest: {str(e)}")
+
+def firmware_manifest_response(path: Path, request: Optional[Request]) -> Response:
+    """Serve a static manifest file with an ETag (the web server does this in production)."""
+    if not path.exists():
+        raise HTTPException(status_code=404, detail="Manifest not found")
+    data = path.read_bytes()
+    etag = f'"{hashlib.sha256(data).hexdigest()[:20]}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request and etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type="application/json", headers=headers)
+
+@app.get("/firmware/latest.json", tags=["ota"])
+async def get_latest_firmware_manifest(request: Request = None):
+    """
+    Static OTA manifest of the latest stable energy_pebble release build.
+    Same as /firmware/manifests/energy_pebble/release/stable.json.
+    """
+    return firmware_manifest_response(get_manifest_storage_path() / "latest.json", request)
+
+@app.get("/firmware/manifests/{product}/{variant}/{channel}.json", tags=["ota"])
+async def get_firmware_manifest(product: str, variant: str, channel: str, request: Request = None):
+    """
+    Static OTA manifest of a product, variant and channel.
+    
+    Devices can poll this (with If-None-Match) instead of /api/ota/check. It has
+    the newest release's version, download URL, size, checksums, compressed
+    encodings and delta patches keyed by the version they apply to. When
+    requires_check is true the release is targeted, still rolling out or needs a
+    minimum current version, and the device has to ask check_url whether it may
+    install it. Downloads straight from a manifest are not subject to the download
+    admission of /api/ota/check.
+    
+    Published whenever the firmware catalog changes and normally served by the
+    web server straight from firmware/manifests; this endpoint serves the same files.
+    """
+    if not all(re.fullmatch(r'[a-z0-9_-]+', part) for part in (product, variant, channel)):
+        raise HTTPException(status_code=400, detail="Invalid manifest path")
+    return firmware_manifest_response(get_manifest_storage_path() / product / variant / f"{channel}.json", request)
+
 @app.get("/firmware/{filename}", tags=["ota"])
-async def download_firmware(filename: str, request: Request = None):
+async def download_firmware(
+    filename: str,
+    request: Request = None,
+    encoding: Optional[str] = Query(None, description="Precompressed variant to serve ('gzip', 'deflate' or 'identity')")
+):
     """
     Secure firmware download endpoint.
     Serves firmware binary files for OTA updates.
+    
+    Precompressed variants are served with Content-Encoding when requested through
+    the encoding parameter (as offered by the OTA check) or accepted via
+    Accept-Encoding. X-Firmware-Checksum is always the checksum of the decoded image.
+    
+    Interrupted downloads can be resumed with a single-range Range request, guarded
+    by If-Range with the ETag of the first response. /api/firmware/{filename}/chunks
+    lists per-chunk hashes to verify partial downloads.
+    
+    With FIRMWARE_ACCEL_REDIRECT enabled the file itself is sent by the Caddy front
+    end after this endpoint answers with an X-Accel-Redirect.
+    """
+    try:
+        accept_encoding = request.headers.get("accept-encoding") if request else None
+        firmware = resolve_firmware_representation(filename, encoding, accept_encoding)
+        size = firmware['size']
+        etag = firmware_etag(firmware['checksum'])
+        
+        headers = {
+            "X-Firmware-Version": firmware['version'],
+            "X-Firmware-Checksum": firmware['firmware_checksum'],
+            "Vary": "Accept-Encoding",
+            "Accept-Ranges": "bytes",
+            "ETag": etag
+        }
+        if firmware['content_encoding']:
+            headers["Content-Encoding"] = firmware['content_encoding']
+            headers["X-Content-Checksum"] = firmware['checksum']
+        
+        if request and etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        
+        # Log download attempt
+        client_ip = get_real_client_ip(request) if request else "unknown"
+        
+        if FIRMWARE_ACCEL_REDIRECT:
+            # The web server sends the bytes (with its own ETag and Range handling)
+            logger.info(f"Firmware download: {filename} ({firmware['content_encoding'] or 'identity'}) by {client_ip}, offloaded")
+            internal_path = firmware['path'].relative_to(get_firmware_storage_path()).as_posix()
+            return Response(
+                media_type='application/octet-stream',
+                headers={
+                    **{name: value for name, value in headers.items() if name not in ("ETag", "Accept-Ranges")},
+                    "Content-Disposition": f'attachment; filename="{filename}"',
+                    "X-Accel-Redirect": f"{FIRMWARE_ACCEL_PREFIX}{internal_path}"
+                }
+            )
+        
+        # Resume support: a single byte range, unless If-Range names another representation
+        range_header = request.headers.get("range") if request else None
+        if_range = request.headers.get("if-range") if request else None
+        byte_range = None
+        if range_header and (not if_range or if_range.strip() == etag):
+            try:
+                byte_range = parse_byte_range(range_header, size)
+            except ValueError:
+                return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        
+        if byte_range:
+            start, end = byte_range
+            logger.info(f"Firmware download: {filename} ({firmware['content_encoding'] or 'identity'}) bytes {start}-{end} by {client_ip}")
+            return StreamingResponse(
+                iter_file_range(firmware['path'], start, end),
+                status_code=206,
+                media_type='application/octet-stream',
+                headers={
+                    **headers,
+                    "Content-Range": f"bytes {start}-{end}/{size}",
+                    "Content-Length": str(end - start + 1)
+                }
+            )
+        
+        logger.info(f"Firmware download: {filename} ({firmware['content_encoding'] or 'identity'}) by {client_ip}")
+        
+        # Return the binary file
+        return FileResponse(
+            firmware['path'], 
+            media_type='application/octet-stream', 
+            filename=filename,
+            headers={**headers, "Content-Length": str(size)}
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error downloading firmware {filename}: {e}")
+        raise HTTPException(status_code=500, detail=f"Error downloading firmware: {str(e)}")
+
+@app.get("/firmware/delta/{filename}", tags=["ota"])
+async def download_firmware_delta(filename: str, request: Request = None):
+    """
+    Firmware delta download endpoint.
+    Serves patches between firmware versions for delta OTA updates.
     """
     try:
         # Validate filename to prevent directory traversal
-        if not re.match(r'^[a-zA-Z0-9_\-\.]+\.bin$', filename):
-            raise HTTPException(status_code=400, detail="Invalid firmware filename")
+        if not re.match(r'^[a-zA-Z0-9_\-\.]+\.patch$', filename):
+            raise HTTPException(status_code=400, detail="Invalid delta filename")
         
-        # Check if firmware exists in database
         with sqlite3.connect(DB_PATH) as conn:
             cursor = conn.cursor()
-            cursor.execute('SELECT version, checksum, file_size FROM firmware_versions WHERE filename = ?', (filename,))
-            firmware_info = cursor.fetchone()
+            cursor.execute('SELECT from_version, to_version, checksum, file_size FROM firmware_deltas WHERE filename = ?', (filename,))
+            delta_info = cursor.fetchone()
             
-            if not firmware_info:
-                raise HTTPException(status_code=404, detail="Firmware not found")
+            if not delta_info:
+                raise HTTPException(status_code=404, detail="Delta not found")
         
-        # Check if file exists on disk
-        firmware_path = get_firmware_storage_path() / filename
-        
-        if not firmware_path.exists():
-            logger.error(f"Firmware file not found on disk: {firmware_path}")
-            raise HTTPException(status_code=404, detail="Firmware file not found on disk")
+        delta_path = get_delta_storage_path() / filename
         
-        # Verify file size matches database
-        actual_size = firmware_path.stat().st_size
-        expected_size = firmware_info[2]
+        if not delta_path.exists():
+            logger.error(f"Delta file not found on disk: {delta_path}")
+            raise HTTPException(status_code=404, detail="Delta file not found on disk")
         
-        if actual_size != expected_size:
-            logger.error(f"Firmware file size mismatch: expected {expected_size}, got {actual_size}")
-            raise HTTPException(status_code=500, detail="Firmware file corrupted")
+        if delta_path.stat().st_size != delta_info[3]:
+            logger.error(f"Delta file size mismatch: expected {delta_info[3]}, got {delta_path.stat().st_size}")
+            raise HTTPException(status_code=500, detail="Delta file corrupted")
         
-        # Log download attempt
         client_ip = get_real_client_ip(request) if request else "unknown"
-        logger.info(f"Firmware download: {filename} by {client_ip}")
+        logger.info(f"Firmware delta download: {filename} by {client_ip}")
         
-        # Return the binary file
         return FileResponse(
-            firmware_path, 
-            media_type='application/octet-stream', 
+            delta_path,
+            media_type='application/octet-stream',
             filename=filename,
             headers={
-                "X-Firmware-Version": firmware_info[0],
-                "X-Firmware-Checksum": firmware_info[1],
-                "Content-Length": str(firmware_info[2])
+                "X-Firmware-Base-Version": delta_info[0],
+                "X-Firmware-Version": delta_info[1],
+                "X-Firmware-Checksum": delta_info[2],
+                "Content-Length": str(delta_info[3])
             }
         )
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error downloading firmware {filename}: {e}")
-        raise HTTPException(status_code=500, detail=f"Error downloading firmware: {str(e)}")
+        logger.error(f"Error downloading firmware delta {filename}: {e}")
+        raise HTTPException(status_code=500, detail=f"Error downloading delta: {str(e)}")
 
 @app.get("/api/firmware/latest-stable", tags=["firmware"])
-async def get_latest_stable_firmware():
+async def get_latest_stable_firmware(
+    product: str = Query(DEFAULT_FIRMWARE_PRODUCT, description="Hardware product (e.g., 'energy_pebble')"),
+    variant: str = Query(DEFAULT_FIRMWARE_VARIANT, description="Build variant (e.g., 'release')")
+):
     """
     Get the latest stable firmware version and its details.
     
     Authentication: None required - public endpoint.
     
+    Query parameters:
+    - product: Hardware product (default: 'energy_pebble')
+    - variant: Build variant (default: 'release')
+    
     Returns the most recent stable firmware release with version info, checksums,
     file size, and release metadata. Used for displaying current stable version
     information to users and for reference purposes.
@@ -2306,21 +5369,21 @@ async def get_latest_stable_firmware():
         with sqlite3.connect(DB_PATH) as conn:
             cursor = conn.cursor()
             
-            # Get the latest stable firmware version
+            # Get the latest stable firmware version from the precomputed pointer
             cursor.execute('''
                 SELECT 
-                    version,
-                    filename,
-                    checksum,
-                    md5_checksum,
-                    file_size,
-                    release_date,
-                    release_notes
-                FROM firmware_versions 
-                WHERE is_stable = 1 
-                ORDER BY release_date DESC, version DESC 
-                LIMIT 1
-            ''')
+                    fv.version,
+                    fv.filename,
+                    fv.checksum,
+                    fv.md5_checksum,
+                    fv.file_size,
+                    fv.release_date,
+                    fv.release_notes
+                FROM firmware_latest fl
+                JOIN firmware_versions fv ON fv.version = fl.version
+                WHERE fl.product = ? AND fl.variant = ? AND fl.channel = 'stable'
+            ''', (normalize_firmware_target(product, DEFAULT_FIRMWARE_PRODUCT),
+                  normalize_firmware_target(variant, DEFAULT_FIRMWARE_VARIANT)))
             
             result = cursor.fetchone()
             
@@ -2370,18 +5433,63 @@ async def get_latest_stable_firmware():
 
 # Admin Device Management Endpoints
 
+# Filtered device totals for the admin listing, cached briefly so paging
+# through a large fleet doesn't re-count the devices table on every page.
+DEVICE_COUNT_CACHE_SECONDS = 30
+device_count_cache: Dict[tuple, tuple[float, int]] = {}
+
+def encode_device_cursor(last_seen: Optional[str], db_id: int) -> str:
+    """Encode a (last_seen, id) keyset position as an opaque cursor token."""
+    payload = json.dumps([last_seen, db_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+def decode_device_cursor(token: str) -> tuple[Optional[str], int]:
+    """Decode a cursor token produced by encode_device_cursor() (last_seen is None for never-seen devices)."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        last_seen, db_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not (last_seen is None or isinstance(last_seen, str)) or not isinstance(db_id, int):
+            raise ValueError("unexpected cursor contents")
+        return last_seen, db_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def get_cached_device_count(cursor, where_clause: str, params: list, cache_key: tuple) -> int:
+    """Count devices matching a filter, reusing a recent count for the same filter."""
+    now = time.time()
+    cached = device_count_cache.get(cache_key)
+    if cached and now - cached[0] < DEVICE_COUNT_CACHE_SECONDS:
+        return cached[1]
+    
+    cursor.execute("SELECT COUNT(*) FROM devices d LEFT JOIN user_devices ud ON d.id = ud.device_id" + where_clause, params)
+    count = cursor.fetchone()[0]
+    
+    # Drop expired entries so arbitrary search strings can't grow the cache unbounded
+    for key in [key for key, (cached_at, _) in device_count_cache.items() if now - cached_at >= DEVICE_COUNT_CACHE_SECONDS]:
+        device_count_cache.pop(key, None)
+    device_count_cache[cache_key] = (now, count)
+    return count
+
 @app.get("/api/admin/devices", tags=["admin"])
 async def get_all_devices(
     request: Request,
-    skip: int = Query(0, ge=0, description="Number of devices to skip"),
+    skip: int = Query(0, ge=0, description="Number of devices to skip (prefer cursor for deep pages)"),
     limit: int = Query(100, ge=1, le=1000, description="Number of devices to return"),
-    search: str = Query(None, description="Search devices by device_id, MAC, or IP"),
+    page_cursor: str = Query(None, alias="cursor", description="Opaque cursor from a previous page's next_cursor"),
+    include_total: bool = Query(True, description="Include the (cached) total device count"),
+    search: str = Query(None, description="Search devices by device_id, MAC, IP, nickname or owner"),
     firmware_version: str = Query(None, description="Filter by firmware version"),
-    status: str = Query(None, description="Filter by online status (online/offline)")
+    older_than_version: str = Query(None, description="Only devices running a firmware version lower than this"),
+    status: str = Query(None, description="Filter by status (online/recently_active/offline)")
 ):
     """
     Get all devices with detailed information for admin management.
     Requires admin privileges.
+
+    Status is computed in SQL from the indexed last_seen column. Pages are
+    ordered by (last_seen, id) descending; pass next_cursor back as cursor to
+    fetch the following page with an index seek instead of an OFFSET scan.
+    The total is cached per filter for a short time and may be slightly stale.
     """
     try:
         # Check authentication and admin privileges
@@ -2389,12 +5497,21 @@ async def get_all_devices(
         user_id = user_info['user_id']
         if not user_info['is_admin']:
             raise HTTPException(status_code=403, detail="Admin access required")
+
+        if status and status not in DEVICE_STATUSES:
+            raise HTTPException(status_code=400, detail=f"Invalid status. Use one of: {', '.join(DEVICE_STATUSES)}")
         
+        cursor_position = decode_device_cursor(page_cursor) if page_cursor else None
+
+        now = datetime.now(pytz.UTC)
+        cutoffs = get_device_status_cutoffs(now)
+        status_expression, status_params = device_status_sql(cutoffs)
+
         with sqlite3.connect(DB_PATH) as conn:
             cursor = conn.cursor()
             
             # Build query with filters
-            base_query = '''
+            base_query = f'''
                 SELECT 
                     d.id,
                     d.device_id,
@@ -2410,56 +5527,80 @@ async def get_all_devices(
                     d.user_agent,
                     ud.user_id as claimed_by,
                     ud.nickname as device_nickname,
-                    ud.created_at as claimed_at
+                    ud.created_at as claimed_at,
+                    {status_expression} as status
                 FROM devices d
                 LEFT JOIN user_devices ud ON d.id = ud.device_id
             '''
             
             conditions = []
-            params = []
-            
-            if search:
-                conditions.append("(d.device_id LIKE ? OR d.mac_address LIKE ? OR d.client_ip LIKE ?)")
+            params = list(status_params)
+            
+            if search and device_search_fts_enabled and len(search) >= 3:
+                # Trigram index lookup; a quoted phrase matches it as a substring
+                conditions.append("d.id IN (SELECT rowid FROM devices_search WHERE devices_search MATCH ?)")
+                params.append('"' + search.replace('"', '""') + '"')
+            elif search:
+                # Trigrams need at least 3 characters, shorter searches scan
+                conditions.append("(d.device_id LIKE ? OR d.mac_address LIKE ? OR d.client_ip LIKE ? OR ud.nickname LIKE ? OR ud.user_id LIKE ?)")
                 search_param = f"%{search}%"
-                params.extend([search_param, search_param, search_param])
+                params.extend([search_param] * 5)
             
             if firmware_version:
                 conditions.append("d.current_firmware_version = ?")
                 params.append(firmware_version)
             
-            # Note: Status filtering is done post-query since we need to calculate status using our function
-            
-            if conditions:
-                base_query += " WHERE " + " AND ".join(conditions)
+            if older_than_version:
+                older_than_key = version_sort_key(older_than_version)
+                if older_than_key is None:
+                    raise HTTPException(status_code=400, detail="older_than_version must be in format v1.2.3 or 1.2.3")
+                conditions.append("d.current_firmware_version_key < ?")
+                params.append(older_than_key)
+            
+            if status:
+                status_condition, status_condition_params = device_status_condition(status, cutoffs)
+                conditions.append(status_condition)
+                params.extend(status_condition_params)
+            
+            where_clause = " WHERE " + " AND ".join(conditions) if conditions else ""
+            filter_params = params[len(status_params):]
+            
+            # Keyset pagination: seek past the last row of the previous page.
+            # idx_devices_last_seen is (last_seen, rowid) and id is the rowid, so this is an index seek.
+            # NULL last_seen sorts last in DESC order and never compares, so those rows get their own branch.
+            page_conditions = list(conditions)
+            if cursor_position:
+                last_seen, db_id = cursor_position
+                if last_seen is None:
+                    page_conditions.append("(d.last_seen IS NULL AND d.id < ?)")
+                    params.append(db_id)
+                else:
+                    page_conditions.append("((d.last_seen, d.id) < (?, ?) OR d.last_seen IS NULL)")
+                    params.extend([last_seen, db_id])
+                skip = 0
+            if page_conditions:
+                base_query += " WHERE " + " AND ".join(page_conditions)
             
-            # Add ordering and pagination
-            base_query += " ORDER BY d.last_seen DESC LIMIT ? OFFSET ?"
-            params.extend([limit, skip])
+            # Fetch one extra row to know whether another page follows
+            base_query += " ORDER BY d.last_seen DESC, d.id DESC LIMIT ? OFFSET ?"
+            params.extend([limit + 1, skip])
             
             cursor.execute(base_query, params)
             devices = cursor.fetchall()
+            has_more = len(devices) > limit
+            devices = devices[:limit]
+            next_cursor = encode_device_cursor(devices[-1][7], devices[-1][0]) if has_more else None
             
-            # Get total count for pagination
-            count_query = '''
-                SELECT COUNT(DISTINCT d.id)
-                FROM devices d
-                LEFT JOIN user_devices ud ON d.id = ud.device_id
-            '''
-            if conditions:
-                count_query += " WHERE " + " AND ".join(conditions[:-2] if status else conditions)  # Remove LIMIT params
-            
-            cursor.execute(count_query, params[:-2])  # Remove LIMIT and OFFSET params
-            total_count = cursor.fetchone()[0]
+            total_count = None
+            if include_total:
+                total_count = get_cached_device_count(cursor, where_clause, filter_params, (search, firmware_version, older_than_version, status))
             
-            # Format response and apply status filtering
+            # Format response
             device_list = []
             for device in devices:
-                # Use the same status calculation as personal dashboard
-                device_status, minutes_ago = calculate_device_status(device[7])  # device[7] is last_seen
-                
-                # Apply status filter if specified
-                if status and device_status != status:
-                    continue
+                device_status = device[15]
+                last_seen_ts = parse_last_seen_timestamp(device[7])
+                minutes_ago = int((now.timestamp() - last_seen_ts) / 60) if last_seen_ts is not None else 999999
                 
                 is_online = device_status == "online"
                 
@@ -2477,7 +5618,7 @@ async def get_all_devices(
                     "id": device[0],
                     "device_id": device[1],
                     "client_ip": device[2],
-                    "mac_address": device[3],
+                    "mac_address": get_device_mac_address(device[1], device[3]) if device[1] else device[3],
                     "current_firmware_version": device[4] or "Unknown",
                     "software_version": device[5],
                     "first_seen": device[6],
@@ -2495,15 +5636,13 @@ async def get_all_devices(
                     "minutes_since_last_seen": minutes_ago
                 })
             
-            # Adjust total count if status filtering was applied
-            actual_total = len(device_list) if status else total_count
-            
             return {
                 "devices": device_list,
-                "total": actual_total,
+                "total": total_count,
                 "skip": skip,
                 "limit": limit,
-                "has_more": skip + len(device_list) < actual_total
+                "has_more": has_more,
+                "next_cursor": next_cursor
             }
             
     except HTTPException:
@@ -2531,26 +5670,19 @@ async def get_device_stats(request: Request):
             cursor.execute('SELECT COUNT(*) FROM devices')
             total_devices = cursor.fetchone()[0]
             
-            # Online devices (using correct 20-minute window)
-            cursor.execute("SELECT last_seen FROM devices WHERE last_seen IS NOT NULL")
-            all_devices_last_seen = cursor.fetchall()
-            online_devices = 0
-            for (last_seen,) in all_devices_last_seen:
-                status, _ = calculate_device_status(last_seen)
-                if status == "online":
-                    online_devices += 1
+            # Online devices (maintained incrementally by the presence tracker)
+            presence_counts = get_presence_counts()
+            online_devices = presence_counts["online"]
             
             # Claimed devices
             cursor.execute('SELECT COUNT(DISTINCT device_id) FROM user_devices')
             claimed_devices = cursor.fetchone()[0]
             
-            # Firmware version distribution
+            # Firmware version distribution (maintained by the devices triggers)
             cursor.execute('''
-                SELECT current_firmware_version, COUNT(*) as count
-                FROM devices 
-                WHERE current_firmware_version IS NOT NULL
-                GROUP BY current_firmware_version
-                ORDER BY count DESC
+                SELECT version, device_count
+                FROM firmware_version_counts
+                ORDER BY device_count DESC
             ''')
             firmware_distribution = [
                 {"version": row[0], "count": row[1]}
@@ -2564,7 +5696,9 @@ async def get_device_stats(request: Request):
             return {
                 "total_devices": total_devices,
                 "online_devices": online_devices,
-                "offline_devices": total_devices - online_devices,
+                "recently_active_devices": presence_counts["recently_active"],
+                "offline_devices": total_devices - online_devices - presence_counts["recently_active"],
+                "went_offline_last_hour": get_recently_offline_devices(),
                 "claimed_devices": claimed_devices,
                 "unclaimed_devices": total_devices - claimed_devices,
                 "recent_devices": recent_devices,
@@ -2607,6 +5741,9 @@ async def delete_device(device_id: int, request: Request):
             cursor.execute('DELETE FROM devices WHERE id = ?', (device_id,))
             
             conn.commit()
+            unregister_device(device_id)
+            if device[0]:
+                forget_device_presence(device[0])
             
             logger.info(f"Admin {user_id} deleted device {device[0]} (ID: {device_id})")
             
@@ -2672,6 +5809,7 @@ async def set_device_nickname(device_id: int, nickname_data: DeviceNicknameUpdat
                 action = "set"
             
             conn.commit()
+            update_registered_device_claim(device_id, user_id=user_id, nickname=nickname)
             
             logger.info(f"Admin {user_id} {action} nickname for device {device_uuid} (ID: {device_id}) to: {nickname}")
             
@@ -2766,6 +5904,7 @@ async def claim_device_for_user(device_id: int, claim_data: DeviceClaimRequest,
                 action = f"claimed by {user}"
             
             conn.commit()
+            update_registered_device_claim(device_id, user_id=user)
             
             logger.info(f"Admin {admin_user} {action} device {device_uuid} (ID: {device_id})")
             
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Benchmark full-file vs resumable (Range) firmware downloads under simulated connection loss
+
+Each run downloads the same firmware twice with the same loss pattern:
+- full: every dropped connection restarts the download from byte 0 (current device behaviour)
+- resume: dropped connections continue with Range/If-Range, and the result is
+  verified against the chunk manifest
+
+Loss is simulated on the client: after every received block the connection is
+dropped with the given probability, the way a pebble on weak WiFi loses its TCP stream.
+"""
+
+import argparse
+import hashlib
+import random
+import time
+
+import requests
+
+BLOCK_SIZE = 4096
+MAX_ATTEMPTS = 500
+
+def download_full(session, url, rng, loss):
+    """Download the whole file, restarting from scratch after every drop"""
+    stats = {"requests": 0, "bytes": 0}
+    for _ in range(MAX_ATTEMPTS):
+        stats["requests"] += 1
+        data = bytearray()
+        dropped = False
+        with session.get(url, headers={'Accept-Encoding': 'identity'}, stream=True, timeout=30) as response:
+            response.raise_for_status()
+            for block in response.iter_content(BLOCK_SIZE):
+                data.extend(block)
+                stats["bytes"] += len(block)
+                if rng.random() < loss:
+                    dropped = True
+                    break
+        if not dropped:
+            return bytes(data), stats
+    return None, stats
+
+def download_resumable(session, url, rng, loss):
+    """Download with Range requests, continuing where the previous attempt stopped"""
+    stats = {"requests": 0, "bytes": 0}
+    data = bytearray()
+    etag = None
+    size = None
+
+    for _ in range(MAX_ATTEMPTS):
+        stats["requests"] += 1
+        headers = {'Accept-Encoding': 'identity'}
+        if data:
+            headers['Range'] = f"bytes={len(data)}-"
+            headers['If-Range'] = etag
+
+        dropped = False
+        with session.get(url, headers=headers, stream=True, timeout=30) as response:
+            response.raise_for_status()
+            if response.status_code == 200:
+                # Fresh start (first request, or the file changed underneath us)
+                data = bytearray()
+                etag = response.headers.get('ETag')
+                size = int(response.headers['Content-Length'])
+            for block in response.iter_content(BLOCK_SIZE):
+                data.extend(block)
+                stats["bytes"] += len(block)
+                if rng.random() < loss:
+                    dropped = True
+                    break
+        if not dropped and len(data) >= size:
+            return bytes(data), stats
+    return None, stats
+
+def verify_chunks(session, manifest_url, data):
+    """Check downloaded data against the chunk manifest, returns indexes of bad chunks"""
+    manifest = session.get(manifest_url, timeout=30).json()
+    bad = []
+    for chunk in manifest['chunks']:
+        block = data[chunk['offset']:chunk['offset'] + chunk['size']]
+        if hashlib.sha256(block).hexdigest() != chunk['sha256']:
+            bad.append(chunk['index'])
+    return bad
+
+def run_benchmark(base_url, filename, loss, runs, seed):
+    """Run both strategies with identical loss patterns and print a comparison"""
+    print(f"=== Firmware download benchmark: {filename} ({loss:.1%} drop chance per {BLOCK_SIZE} byte block) ===")
+
+    session = requests.Session()
+    url = f"{base_url}/firmware/{filename}"
+    manifest_url = f"{base_url}/api/firmware/{filename}/chunks"
+
+    head = session.get(url, headers={'Accept-Encoding': 'identity'}, timeout=30)
+    head.raise_for_status()
+    expected = hashlib.sha256(head.content).hexdigest()
+    size = len(head.content)
+    print(f"File size: {size} bytes, ETag {head.headers.get('ETag')}, Accept-Ranges: {head.headers.get('Accept-Ranges')}")
+
+    results = {}
+    for name, strategy in (("full", download_full), ("resume", download_resumable)):
+        totals = {"requests": 0, "bytes": 0, "seconds": 0.0, "failures": 0}
+        for run in range(runs):
+            rng = random.Random(seed + run)
+            started = time.time()
+            data, stats = strategy(session, url, rng, loss)
+            totals["seconds"] += time.time() - started
+            totals["requests"] += stats["requests"]
+            totals["bytes"] += stats["bytes"]
+
+            if data is None or hashlib.sha256(data).hexdigest() != expected:
+                totals["failures"] += 1
+            elif name == "resume" and verify_chunks(session, manifest_url, data):
+                totals["failures"] += 1
+        results[name] = totals
+
+    print(f"{'strategy':<10}{'requests':>12}{'bytes':>16}{'overhead':>12}{'seconds':>12}{'failures':>10}")
+    for name, totals in results.items():
+        overhead = totals["bytes"] / (size * runs) if size else 0
+        print(f"{name:<10}{totals['requests'] / runs:>12.1f}{totals['bytes'] // runs:>16}{overhead:>11.2f}x"
+              f"{totals['seconds'] / runs:>12.3f}{totals['failures']:>10}")
+
+    if results["resume"]["bytes"]:
+        saved = 1 - results["resume"]["bytes"] / results["full"]["bytes"]
+        print(f"✅ Resumable downloads transfer {saved:.1%} fewer bytes than full restarts")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("filename", help="Firmware filename, e.g. energy_pebble_v1.1.0.bin")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--loss", type=float, default=0.01, help="Drop probability per received block")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    run_benchmark(args.base_url.rstrip('/'), args.filename, args.loss, args.runs, args.seed)
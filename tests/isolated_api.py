@@ -0,0 +1,50 @@
+"""
+Shared setup for the in-process API tests.
+
+Imports main against a throwaway database, firmware directory and color cache,
+so running the tests never touches the live ones. Import this module before
+anything else imports main.
+"""
+
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+if "main" in sys.modules:
+    raise RuntimeError("main was imported before the isolated test environment was set up")
+
+TEST_ROOT = tempfile.mkdtemp(prefix="energy_pebble_tests_")
+atexit.register(shutil.rmtree, TEST_ROOT, ignore_errors=True)
+os.makedirs(os.path.join(TEST_ROOT, "firmware"))
+os.environ["ENERGY_PEBBLE_DB_PATH"] = os.path.join(TEST_ROOT, "energy_pebble.db")
+os.environ["ENERGY_PEBBLE_FIRMWARE_PATH"] = os.path.join(TEST_ROOT, "firmware")
+os.environ["ENERGY_PEBBLE_COLOR_CACHE_PATH"] = os.path.join(TEST_ROOT, "committed_colors.json")
+
+# Add the repository root to the path so we can import main
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+
+import main
+
+client = TestClient(main.app)
+
+ADMIN_HEADERS = {"Remote-User": "thomas", "Remote-Groups": "admins"}
+
+def run_tests(title, tests):
+    """Run test functions as a script, printing a summary. Returns True if all passed."""
+    print(title)
+    print("=" * 50)
+
+    failures = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            failures += 1
+            print(f"   ❌ {test.__name__} failed: {e}")
+
+    print(f"\n📊 Results: {len(tests) - failures}/{len(tests)} tests passed")
+    return failures == 0
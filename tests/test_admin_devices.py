@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Test script for the admin device listing: cursor (keyset) pagination, status
+filtering and totals.
+Runs the API in-process with FastAPI's TestClient against a throwaway database
+(see isolated_api); test devices share a prefix and are removed afterwards.
+"""
+
+import os
+import sqlite3
+import sys
+from datetime import datetime, timedelta, timezone
+
+# Add the repository root to the path so the tests package imports when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.isolated_api import ADMIN_HEADERS, client, main, run_tests
+
+PREFIX = "pagetest"
+
+def add_devices(count):
+    """Insert test devices; every other one has never been seen."""
+    remove_devices()
+    with sqlite3.connect(main.DB_PATH) as conn:
+        for index in range(count):
+            conn.execute('''
+                INSERT INTO devices (device_id, client_ip, device_fingerprint, last_seen)
+                VALUES (?, '192.0.2.1', ?, ?)
+            ''', (f"{PREFIX}{index:02d}", f"{PREFIX}-fp{index}",
+                  None if index % 2 else f"2026-01-{index + 1:02d} 10:00:00"))
+    return [f"{PREFIX}{index:02d}" for index in range(count)]
+
+def add_devices_seen(minutes_ago):
+    """Insert test devices last seen the given numbers of minutes ago (None: never seen)."""
+    remove_devices()
+    now = datetime.now(timezone.utc)
+    with sqlite3.connect(main.DB_PATH) as conn:
+        for index, minutes in enumerate(minutes_ago):
+            conn.execute('''
+                INSERT INTO devices (device_id, client_ip, device_fingerprint, last_seen)
+                VALUES (?, '192.0.2.1', ?, ?)
+            ''', (f"{PREFIX}{index:02d}", f"{PREFIX}-fp{index}",
+                  None if minutes is None else now - timedelta(minutes=minutes)))
+
+def remove_devices():
+    with sqlite3.connect(main.DB_PATH) as conn:
+        conn.execute("DELETE FROM devices WHERE device_id LIKE ?", (f"{PREFIX}%",))
+    main.device_count_cache.clear()
+
+def list_all_pages(limit, **params):
+    """Follow next_cursor through every page, returning device IDs and the number of pages."""
+    device_ids, pages, page_cursor = [], 0, None
+    while True:
+        query = {"limit": limit, "search": PREFIX, **params}
+        if page_cursor:
+            query["cursor"] = page_cursor
+        response = client.get("/api/admin/devices", params=query, headers=ADMIN_HEADERS)
+        assert response.status_code == 200, response.text
+        result = response.json()
+        device_ids += [device["device_id"] for device in result["devices"]]
+        pages += 1
+        page_cursor = result.get("next_cursor")
+        if not page_cursor:
+            return device_ids, pages
+
+def test_listing_requires_admin():
+    """Non-admin users can't list devices"""
+    print("1. Testing device listing as a regular user...")
+    response = client.get("/api/admin/devices", headers={"Remote-User": "someone", "Remote-Groups": "users"})
+    assert response.status_code == 403, response.text
+    print("   ✅ Rejected with 403")
+
+def test_cursor_pages_include_never_seen_devices():
+    """Paging returns every device once, including those without last_seen"""
+    print("2. Testing cursor pagination over never-seen devices...")
+    devices = add_devices(9)
+    try:
+        device_ids, pages = list_all_pages(limit=2)
+        assert sorted(device_ids) == devices, device_ids
+        assert len(set(device_ids)) == len(device_ids)
+        assert pages == 5
+
+        # Seen devices first (newest first), then never-seen ones
+        seen = [device for index, device in enumerate(devices) if index % 2 == 0]
+        assert device_ids[:len(seen)] == list(reversed(seen))
+        print(f"   ✅ {len(device_ids)} devices over {pages} pages")
+    finally:
+        remove_devices()
+
+def test_cursor_with_null_last_seen_is_accepted():
+    """A cursor positioned on a never-seen device decodes and continues"""
+    print("3. Testing a cursor on a never-seen device...")
+    token = main.encode_device_cursor(None, 123)
+    assert main.decode_device_cursor(token) == (None, 123)
+    print("   ✅ Cursor round-trips")
+
+def test_invalid_cursor_is_rejected():
+    """Garbage cursors are a client error"""
+    print("4. Testing an invalid cursor...")
+    response = client.get("/api/admin/devices", params={"cursor": "not-a-cursor"}, headers=ADMIN_HEADERS)
+    assert response.status_code == 400, response.text
+    print("   ✅ Rejected with 400")
+
+def test_total_matches_filter():
+    """The total counts the filtered devices, not the page"""
+    print("5. Testing totals...")
+    devices = add_devices(5)
+    try:
+        result = client.get("/api/admin/devices", params={"limit": 2, "search": PREFIX}, headers=ADMIN_HEADERS).json()
+        assert result["total"] == len(devices), result["total"]
+        assert len(result["devices"]) == 2
+        print(f"   ✅ total {result['total']} with a page of {len(result['devices'])}")
+    finally:
+        remove_devices()
+
+def test_status_filter_pages_and_counts():
+    """The status filter is applied before paging, and total counts every match"""
+    print("6. Testing the status filter...")
+    online, active = main.DEVICE_ONLINE_MINUTES, main.DEVICE_RECENTLY_ACTIVE_MINUTES
+    add_devices_seen([1, 2, online - 5, online + 5, active - 5, active + 5, 3000, None])
+    try:
+        expected = {"online": 3, "recently_active": 2, "offline": 3}
+        for status, count in expected.items():
+            device_ids, pages = list_all_pages(limit=2, status=status)
+            assert len(device_ids) == count, (status, device_ids)
+            assert pages == (count + 1) // 2, (status, pages)
+
+            result = client.get("/api/admin/devices", params={"limit": 1, "search": PREFIX, "status": status},
+                                headers=ADMIN_HEADERS).json()
+            assert result["total"] == count, (status, result["total"])
+            assert [device["status"] for device in result["devices"]] == [status], result["devices"]
+        print(f"   ✅ {expected}")
+    finally:
+        remove_devices()
+
+def main_tests():
+    return run_tests("📱 Testing Admin Device Listing", [
+        test_listing_requires_admin,
+        test_cursor_pages_include_never_seen_devices,
+        test_cursor_with_null_last_seen_is_accepted,
+        test_invalid_cursor_is_rejected,
+        test_total_matches_filter,
+        test_status_filter_pages_and_counts,
+    ])
+
+if __name__ == "__main__":
+    sys.exit(0 if main_tests() else 1)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Test script for color validity windows: valid_until on committed hours and the
+committed schedule of /api/color-code.
+Runs the API in-process with FastAPI's TestClient against a throwaway database
+(see isolated_api); price data comes from the bundled sample data instead of
+the network.
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+
+# Add the repository root to the path so the tests package imports when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.isolated_api import client, main, run_tests
+
+async def fetch_sample_data(start_date, num_days=3):
+    return (await main.get_sample_data())['data']
+
+main.fetch_data_for_date_range = fetch_sample_data
+
+DEVICE_ID = "a0b1c2d3e4f7"
+
+def reset_polling_state():
+    """Start from an empty commitment window and an idle poll rate."""
+    main.committed_colors_cache.clear()
+    main.device_poll_times.clear()
+
+def test_color_code_validity_windows():
+    """Committed hours are valid until the end of their hour, flexible hours have no validity"""
+    print("1. Testing color validity windows...")
+    reset_polling_state()
+    result = client.get("/api/color-code", headers={"X-Device-ID": DEVICE_ID}).json()
+
+    hours = result["hour_color_codes"]
+    committed = [hour for hour in hours if hour["valid_until"]]
+    assert len(committed) == 8 and hours[-1]["valid_until"] is None
+    for hour in committed:
+        start = datetime.fromisoformat(hour["hour"].replace('Z', '+00:00'))
+        end = datetime.fromisoformat(hour["valid_until"].replace('Z', '+00:00'))
+        assert end - start == timedelta(hours=1), hour
+
+    assert [entry["color_code"] for entry in result["committed_schedule"]] == [hour["color_code"] for hour in committed]
+    assert result["schedule_valid_until"] == committed[-1]["valid_until"]
+    print(f"   ✅ Schedule of {len(committed)} hours valid until {result['schedule_valid_until']}")
+
+def test_color_code_other_date_has_no_schedule():
+    """The committed schedule describes today, so it is left out for other dates"""
+    print("2. Testing color codes for a specific date...")
+    reset_polling_state()
+    result = client.get("/api/color-code", params={"date": "2025-07-21"}).json()
+    assert result["committed_schedule"] is None
+    assert result["schedule_valid_until"] is None
+    print("   ✅ committed_schedule and schedule_valid_until are null")
+
+def test_color_code_invalid_date():
+    """Malformed dates are rejected"""
+    print("3. Testing an invalid date...")
+    response = client.get("/api/color-code", params={"date": "21-07-2025"})
+    assert response.status_code == 400, response.text
+    print("   ✅ Rejected with 400")
+
+def main_tests():
+    return run_tests("🎨 Testing Color Validity Windows", [
+        test_color_code_validity_windows,
+        test_color_code_other_date_has_no_schedule,
+        test_color_code_invalid_date,
+    ])
+
+if __name__ == "__main__":
+    sys.exit(0 if main_tests() else 1)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Test script for the fleet presence tracker and the admin device stats built on it.
+Runs against a throwaway database (see isolated_api).
+"""
+
+import os
+import sys
+import time
+
+# Add the repository root to the path so the tests package imports when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.isolated_api import ADMIN_HEADERS, client, main, run_tests
+
+def minutes_ago(minutes):
+    return time.time() - minutes * 60
+
+def test_heartbeats_set_status():
+    """A heartbeat puts a device in the bucket matching its last-seen time"""
+    print("1. Testing presence status from heartbeats...")
+    before = main.get_presence_counts()
+    main.record_device_presence("dd0000000001")
+    main.record_device_presence("dd0000000002", seen_at=minutes_ago(main.DEVICE_ONLINE_MINUTES + 5))
+    main.record_device_presence("dd0000000003", seen_at=minutes_ago(main.DEVICE_RECENTLY_ACTIVE_MINUTES + 5))
+    try:
+        counts = main.get_presence_counts()
+        assert counts["online"] == before["online"] + 1, counts
+        assert counts["recently_active"] == before["recently_active"] + 1, counts
+        assert counts["offline"] == before["offline"] + 1, counts
+        print(f"   ✅ {counts}")
+    finally:
+        for device_id in ("dd0000000001", "dd0000000002", "dd0000000003"):
+            main.forget_device_presence(device_id)
+
+def test_devices_age_through_the_wheel():
+    """Silent devices move to recently_active and then offline without a new heartbeat"""
+    print("2. Testing status changes driven by the timer wheel...")
+    device_id = "dd0000000004"
+    real_time = time.time
+    start = real_time()
+    main.record_device_presence(device_id, seen_at=start)
+    try:
+        main.time.time = lambda: start + (main.DEVICE_ONLINE_MINUTES + 2) * 60
+        main.get_presence_counts()
+        assert main.presence_state[device_id] == "recently_active"
+
+        main.time.time = lambda: start + (main.DEVICE_RECENTLY_ACTIVE_MINUTES + 2) * 60
+        main.get_presence_counts()
+        assert main.presence_state[device_id] == "offline"
+        went_offline = [device["device_id"] for device in main.get_recently_offline_devices()]
+        assert device_id in went_offline, went_offline
+        print("   ✅ online → recently_active → offline, listed as went offline")
+    finally:
+        main.time.time = real_time
+        main.forget_device_presence(device_id)
+        # Rewind the wheel from the simulated future
+        main.presence_wheel_minute = None
+        main.load_device_presence()
+
+def test_stats_buckets_sum_to_total():
+    """online + recently_active + offline add up to the total device count"""
+    print("3. Testing admin device stats...")
+    main.log_device_request("192.0.2.21", "ESP32-HTTPClient/1.0", "dd0000000005")
+    main.record_device_presence("dd0000000005", seen_at=minutes_ago(main.DEVICE_ONLINE_MINUTES + 5))
+    response = client.get("/api/admin/devices/stats", headers=ADMIN_HEADERS)
+    assert response.status_code == 200, response.text
+    stats = response.json()
+    assert stats["recently_active_devices"] >= 1, stats
+    buckets = stats["online_devices"] + stats["recently_active_devices"] + stats["offline_devices"]
+    assert buckets == stats["total_devices"], stats
+    print(f"   ✅ {stats['online_devices']} + {stats['recently_active_devices']} + {stats['offline_devices']} = {stats['total_devices']}")
+
+def main_tests():
+    return run_tests("📡 Testing Device Presence", [
+        test_heartbeats_set_status,
+        test_devices_age_through_the_wheel,
+        test_stats_buckets_sum_to_total,
+    ])
+
+if __name__ == "__main__":
+    sys.exit(0 if main_tests() else 1)
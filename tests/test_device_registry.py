@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Test script for the in-memory device registry used on the device request hot path.
+Runs against a throwaway database (see isolated_api).
+"""
+
+import os
+import sqlite3
+import sys
+
+# Add the repository root to the path so the tests package imports when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.isolated_api import ADMIN_HEADERS, client, main, run_tests
+
+def device_row(device_id):
+    # Each test device uses its own IP, since new devices are fingerprinted by IP and user agent
+    with sqlite3.connect(main.DB_PATH) as conn:
+        return conn.execute("SELECT id, request_count FROM devices WHERE device_id = ?", (device_id,)).fetchone()
+
+def test_new_device_is_registered():
+    """A first request inserts the device and registers it"""
+    print("1. Testing registration of a new device...")
+    main.log_device_request("192.0.2.1", "ESP32-HTTPClient/1.0", "c0ffee000001")
+    row = device_row("c0ffee000001")
+    registered = main.get_registered_device("c0ffee000001")
+    assert row and registered and registered["id"] == row[0], (row, registered)
+    assert registered["mac_address"]
+    print(f"   ✅ Registered with id {row[0]}")
+
+def test_known_device_uses_fast_path():
+    """Later requests update the registered row by primary key"""
+    print("2. Testing requests from a known device...")
+    main.log_device_request("192.0.2.2", "ESP32-HTTPClient/1.0", "c0ffee000002")
+    db_id, count = device_row("c0ffee000002")
+    main.log_device_request("192.0.2.2", "ESP32-HTTPClient/1.0", "c0ffee000002")
+    assert device_row("c0ffee000002") == (db_id, count + 1)
+    print("   ✅ request_count bumped on the same row")
+
+def test_deleted_row_is_registered_again():
+    """A row deleted behind the registry's back is re-created, not silently lost"""
+    print("3. Testing a device whose row was deleted outside the registry...")
+    main.log_device_request("192.0.2.3", "ESP32-HTTPClient/1.0", "c0ffee000003")
+    old_id = device_row("c0ffee000003")[0]
+    with sqlite3.connect(main.DB_PATH) as conn:
+        conn.execute("DELETE FROM devices WHERE id = ?", (old_id,))
+
+    main.log_device_request("192.0.2.3", "ESP32-HTTPClient/1.0", "c0ffee000003")
+    row = device_row("c0ffee000003")
+    assert row is not None, "request was lost"
+    assert main.get_registered_device("c0ffee000003")["id"] == row[0]
+    assert old_id not in main.device_registry_ids or main.device_registry_ids[old_id] != "c0ffee000003"
+    print(f"   ✅ Re-registered with id {row[0]}")
+
+def test_claim_updates_can_clear_fields():
+    """None clears the owner or nickname; fields not passed stay as they are"""
+    print("4. Testing registry claim updates...")
+    main.log_device_request("192.0.2.4", "ESP32-HTTPClient/1.0", "c0ffee000004")
+    db_id = device_row("c0ffee000004")[0]
+
+    main.update_registered_device_claim(db_id, user_id="alice", nickname="Kitchen")
+    main.update_registered_device_claim(db_id, user_id="bob")
+    entry = main.get_registered_device("c0ffee000004")
+    assert (entry["user_id"], entry["nickname"]) == ("bob", "Kitchen"), entry
+
+    main.update_registered_device_claim(db_id, nickname=None)
+    main.update_registered_device_claim(db_id, user_id=None)
+    entry = main.get_registered_device("c0ffee000004")
+    assert (entry["user_id"], entry["nickname"]) == (None, None), entry
+    print("   ✅ Owner and nickname cleared")
+
+def test_admin_claim_updates_registry():
+    """Admin claims and nicknames are visible in the registry without a reload"""
+    print("5. Testing admin claim and nickname endpoints...")
+    main.log_device_request("192.0.2.5", "ESP32-HTTPClient/1.0", "c0ffee000005")
+    db_id = device_row("c0ffee000005")[0]
+
+    response = client.put(f"/api/admin/devices/{db_id}/claim", json={"user": "carol"}, headers=ADMIN_HEADERS)
+    assert response.status_code == 200, response.text
+    response = client.put(f"/api/admin/devices/{db_id}/nickname", json={"nickname": "Hallway"}, headers=ADMIN_HEADERS)
+    assert response.status_code == 200, response.text
+
+    entry = main.get_registered_device("c0ffee000005")
+    assert entry["nickname"] == "Hallway" and entry["user_id"] is not None, entry
+    print(f"   ✅ Registry shows {entry['user_id']} / {entry['nickname']}")
+
+def test_deleted_device_is_unregistered():
+    """Deleting a device through the API removes it from the registry"""
+    print("6. Testing device deletion...")
+    main.log_device_request("192.0.2.6", "ESP32-HTTPClient/1.0", "c0ffee000006")
+    db_id = device_row("c0ffee000006")[0]
+    response = client.delete(f"/api/admin/devices/{db_id}", headers=ADMIN_HEADERS)
+    assert response.status_code == 200, response.text
+    assert main.get_registered_device("c0ffee000006") is None
+    print("   ✅ Removed from the registry")
+
+def main_tests():
+    return run_tests("🗂️ Testing Device Registry", [
+        test_new_device_is_registered,
+        test_known_device_uses_fast_path,
+        test_deleted_row_is_registered_again,
+        test_claim_updates_can_clear_fields,
+        test_admin_claim_updates_registry,
+        test_deleted_device_is_unregistered,
+    ])
+
+if __name__ == "__main__":
+    sys.exit(0 if main_tests() else 1)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Test script for the admin device search and the devices_search trigram index behind it.
+Runs the API in-process against a throwaway database (see isolated_api).
+"""
+
+import os
+import sqlite3
+import sys
+
+# Add the repository root to the path so the tests package imports when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.isolated_api import ADMIN_HEADERS, client, main, run_tests
+
+def add_device(device_id, client_ip):
+    main.log_device_request(client_ip, "ESP32-HTTPClient/1.0", device_id)
+    with sqlite3.connect(main.DB_PATH) as conn:
+        return conn.execute("SELECT id FROM devices WHERE device_id = ?", (device_id,)).fetchone()[0]
+
+def search(term):
+    response = client.get("/api/admin/devices", params={"search": term, "limit": 100}, headers=ADMIN_HEADERS)
+    assert response.status_code == 200, response.text
+    return sorted(device["device_id"] for device in response.json()["devices"])
+
+def test_index_is_enabled():
+    """This SQLite build has FTS5 trigrams, so searches use the index"""
+    print("1. Testing that the search index is available...")
+    assert main.device_search_fts_enabled
+    print("   ✅ devices_search in use")
+
+def test_search_device_fields():
+    """Substrings of device_id, MAC and IP match"""
+    print("2. Testing search by device ID, MAC and IP...")
+    add_device("ee5ea1000001", "198.51.100.71")
+    add_device("ee5ea1000002", "198.51.100.72")
+    assert search("5ea1000001") == ["ee5ea1000001"]
+    assert search("00:A1:5E") == ["ee5ea1000001", "ee5ea1000002"]
+    assert search(".100.72") == ["ee5ea1000002"]
+    print("   ✅ Matched on each field")
+
+def test_search_follows_claims_and_nicknames():
+    """Owner and nickname changes are indexed as they are written"""
+    print("3. Testing search by owner and nickname...")
+    db_id = add_device("ee5ea1000003", "198.51.100.73")
+    assert search("Greenhouse") == []
+
+    client.put(f"/api/admin/devices/{db_id}/claim", json={"user": "searchowner"}, headers=ADMIN_HEADERS)
+    assert search("searchowner") == ["ee5ea1000003"]
+
+    client.put(f"/api/admin/devices/{db_id}/nickname", json={"nickname": "Greenhouse"}, headers=ADMIN_HEADERS)
+    assert search("eenhou") == ["ee5ea1000003"]
+    print("   ✅ Claims and nicknames searchable without a rebuild")
+
+def test_search_follows_device_updates():
+    """IP changes and deletions are reflected in the index"""
+    print("4. Testing index updates on IP changes and deletes...")
+    db_id = add_device("ee5ea1000004", "198.51.100.74")
+    with sqlite3.connect(main.DB_PATH) as conn:
+        conn.execute("UPDATE devices SET client_ip = '203.0.113.74' WHERE id = ?", (db_id,))
+    assert search("198.51.100.74") == []
+    assert search("203.0.113.74") == ["ee5ea1000004"]
+
+    assert client.delete(f"/api/admin/devices/{db_id}", headers=ADMIN_HEADERS).status_code == 200
+    assert search("203.0.113.74") == []
+    with sqlite3.connect(main.DB_PATH) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM devices_search WHERE rowid = ?", (db_id,)).fetchone()[0] == 0
+    print("   ✅ Index follows updates and deletes")
+
+def test_short_and_quoted_searches():
+    """Short terms fall back to LIKE, and quotes in a term are matched literally"""
+    print("5. Testing short and quoted searches...")
+    add_device("ee5ea1000005", "198.51.100.75")
+    assert "ee5ea1000005" in search("75")
+    assert search('"ee5ea1') == []
+    print("   ✅ Short search scans, quotes don't break the query")
+
+def main_tests():
+    return run_tests("🔍 Testing Device Search", [
+        test_index_is_enabled,
+        test_search_device_fields,
+        test_search_follows_claims_and_nicknames,
+        test_search_follows_device_updates,
+        test_short_and_quoted_searches,
+    ])
+
+if __name__ == "__main__":
+    sys.exit(0 if main_tests() else 1)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Test script for the combined device sync endpoint.
+Runs the API in-process with FastAPI's TestClient against a throwaway database
+(see isolated_api); price data comes from the bundled sample data instead of
+the network.
+"""
+
+import os
+import sys
+
+# Add the repository root to the path so the tests package imports when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.isolated_api import client, main, run_tests
+
+async def fetch_sample_data(start_date, num_days=3):
+    return (await main.get_sample_data())['data']
+
+main.fetch_data_for_date_range = fetch_sample_data
+
+DEVICE_ID = "a0b1c2d3e4f5"
+
+def reset_polling_state():
+    """Start from an empty commitment window and an idle poll rate."""
+    main.committed_colors_cache.clear()
+    main.device_poll_times.clear()
+
+def test_device_sync_requires_device_id():
+    """Sync without X-Device-ID is rejected"""
+    print("1. Testing sync without a device ID...")
+    response = client.get("/api/device/sync")
+    assert response.status_code == 400, response.text
+    print("   ✅ Rejected with 400")
+
+def test_device_sync_colors_and_schedule():
+    """Sync returns the colors, their validity and when to come back"""
+    print("2. Testing sync response...")
+    reset_polling_state()
+    response = client.get("/api/device/sync", headers={"X-Device-ID": DEVICE_ID})
+    assert response.status_code == 200, response.text
+    sync = response.json()
+
+    assert len(sync["colors"]) == 9 and set(sync["colors"]) <= set("GYR"), sync["colors"]
+    assert sync["committed_hours"] == 8, sync["committed_hours"]
+    assert sync["valid_until"] is not None
+    assert sync["ota"] is None  # no X-Current-Version, no OTA check
+    assert response.headers["Retry-After"] == str(sync["poll_interval"])
+    assert main.DEVICE_POLL_MIN_SECONDS <= sync["poll_interval"] <= main.DEVICE_POLL_MAX_SECONDS
+    assert response.headers["Cache-Control"] == "no-store"
+    print(f"   ✅ {sync['colors']}, {sync['committed_hours']} committed until {sync['valid_until']}, "
+          f"next sync in {sync['poll_interval']}s")
+
+def main_tests():
+    return run_tests("🔄 Testing Device Sync", [
+        test_device_sync_requires_device_id,
+        test_device_sync_colors_and_schedule,
+    ])
+
+if __name__ == "__main__":
+    sys.exit(0 if main_tests() else 1)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Test script for the content-addressed firmware blob store: shared blobs,
+reference counting, garbage collection and the import of legacy firmware files.
+Runs the API in-process against a throwaway database and firmware directory
+(see isolated_api); test releases are removed afterwards.
+"""
+
+import hashlib
+import os
+import sqlite3
+import sys
+
+# Add the repository root to the path so the tests package imports when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.isolated_api import ADMIN_HEADERS, client, main, run_tests
+
+PRODUCT = "test_blobs"
+
+def upload_release(version, data):
+    """Upload a release through the admin API, replacing an earlier test upload."""
+    delete_release(version)
+    response = client.post("/api/firmware/upload", headers=ADMIN_HEADERS, files={
+        "firmware_file": (f"{PRODUCT}_{version}.bin", data, "application/octet-stream")
+    }, data={
+        "version": version,
+        "product_name": PRODUCT,
+        "sha256_checksum": hashlib.sha256(data).hexdigest(),
+        "md5_checksum": hashlib.md5(data).hexdigest()
+    })
+    assert response.status_code == 200, response.text
+    return response.json()["blob_sha256"]
+
+def delete_release(version):
+    client.delete(f"/api/firmware/versions/{version}", headers=ADMIN_HEADERS)
+
+def blob_refcount(sha256_hex):
+    with sqlite3.connect(main.DB_PATH) as conn:
+        row = conn.execute("SELECT refcount FROM firmware_blobs WHERE sha256 = ?", (sha256_hex,)).fetchone()
+    return row[0] if row else None
+
+def test_identical_uploads_share_a_blob():
+    """Releases with the same image are stored once and counted twice"""
+    print("1. Testing identical uploads...")
+    data = os.urandom(8192)
+    try:
+        first = upload_release("v94.0.0", data)
+        second = upload_release("v94.0.1", data)
+        assert first == second == hashlib.sha256(data).hexdigest()
+        assert blob_refcount(first) == 2
+        assert main.get_blob_path(first).read_bytes() == data
+        print(f"   ✅ One blob, refcount {blob_refcount(first)}")
+    finally:
+        delete_release("v94.0.0")
+        delete_release("v94.0.1")
+
+def test_blob_is_collected_after_last_release():
+    """A blob survives while any release references it and is removed afterwards"""
+    print("2. Testing garbage collection...")
+    data = os.urandom(8192)
+    try:
+        blob = upload_release("v94.1.0", data)
+        upload_release("v94.1.1", data)
+
+        delete_release("v94.1.0")
+        assert blob_refcount(blob) == 1 and main.get_blob_path(blob).exists()
+
+        delete_release("v94.1.1")
+        assert blob_refcount(blob) is None and not main.get_blob_path(blob).exists()
+        assert main.collect_firmware_blobs() == 0
+        print("   ✅ Kept after the first delete, collected after the second")
+    finally:
+        delete_release("v94.1.0")
+        delete_release("v94.1.1")
+
+def test_legacy_files_are_imported():
+    """Images stored by filename are linked into the blob store and keep their name"""
+    print("3. Testing the legacy firmware import...")
+    data = os.urandom(4096)
+    filename = f"{PRODUCT}_v94.2.0.bin"
+    legacy_path = main.get_firmware_storage_path() / filename
+    legacy_path.write_bytes(data)
+    try:
+        with sqlite3.connect(main.DB_PATH) as conn:
+            conn.execute('''
+                INSERT INTO firmware_versions (version, version_key, filename, checksum, file_size, product, variant, channel)
+                VALUES ('v94.2.0', ?, ?, ?, ?, ?, 'release', 'stable')
+            ''', (main.version_sort_key("v94.2.0"), filename, f"sha256:{hashlib.sha256(data).hexdigest()}", len(data), PRODUCT))
+
+        main.import_legacy_firmware_files()
+        with sqlite3.connect(main.DB_PATH) as conn:
+            blob = conn.execute("SELECT blob_sha256 FROM firmware_versions WHERE version = 'v94.2.0'").fetchone()[0]
+        assert blob == hashlib.sha256(data).hexdigest()
+        assert blob_refcount(blob) == 1 and main.get_blob_path(blob).read_bytes() == data
+        assert legacy_path.read_bytes() == data
+        print("   ✅ Blob stored, legacy name still readable")
+    finally:
+        delete_release("v94.2.0")
+        legacy_path.unlink(missing_ok=True)
+
+def main_tests():
+    return run_tests("🧱 Testing Firmware Blob Store", [
+        test_identical_uploads_share_a_blob,
+        test_blob_is_collected_after_last_release,
+        test_legacy_files_are_imported,
+    ])
+
+if __name__ == "__main__":
+    sys.exit(0 if main_tests() else 1)
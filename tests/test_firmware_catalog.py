@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Test script for the in-memory firmware catalog that answers OTA checks.
+Runs against a throwaway database (see isolated_api); test releases use their own
+product name and are removed afterwards.
+"""
+
+import os
+import sqlite3
+import sys
+
+# Add the repository root to the path so the tests package imports when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.isolated_api import main, run_tests
+
+PRODUCT = "test_catalog"
+
+def add_release(version, target_devices=None, min_version=None):
+    """Insert a release straight into the catalog tables and reload the catalog."""
+    with sqlite3.connect(main.DB_PATH) as conn:
+        conn.execute('''
+            INSERT INTO firmware_versions (version, version_key, filename, checksum, file_size, product, variant, channel,
+                                           min_version, target_devices)
+            VALUES (?, ?, ?, ?, 1024, ?, 'release', 'stable', ?, ?)
+        ''', (version, main.version_sort_key(version), f"{PRODUCT}_{version}.bin", '0' * 64, PRODUCT, min_version, target_devices))
+    main.load_firmware_catalog()
+
+def remove_releases():
+    with sqlite3.connect(main.DB_PATH) as conn:
+        conn.execute("DELETE FROM firmware_versions WHERE product = ?", (PRODUCT,))
+    main.load_firmware_catalog()
+
+def offered(device_id, current_version="v1.0.0"):
+    answer = main.get_latest_firmware_for_device(device_id, current_version, product=PRODUCT)
+    return answer and answer['version']
+
+def test_parse_target_devices():
+    """target_devices is parsed once into a lower-case set"""
+    print("1. Testing target_devices parsing...")
+    assert main.parse_target_devices('["AABBCCDDEEFF", "112233445566"]') == {"aabbccddeeff", "112233445566"}
+    assert main.parse_target_devices("aabbccddeeff, 112233445566") == {"aabbccddeeff", "112233445566"}
+    assert main.parse_target_devices('"aabbccddeeff"') == {"aabbccddeeff"}
+    assert main.parse_target_devices("") is None and main.parse_target_devices("[]") is None
+    print("   ✅ JSON, comma separated and empty values parsed")
+
+def test_targeted_release():
+    """Targeted releases are only offered to their devices; others get the previous release"""
+    print("2. Testing targeted releases...")
+    try:
+        add_release("v85.0.0")
+        add_release("v85.1.0", target_devices='["CC0000000001"]')
+        assert offered("cc0000000001") == "v85.1.0"
+        assert offered("cc0000000002") == "v85.0.0"
+        assert offered("cc0000000002", current_version="v85.0.0") is None
+        print("   ✅ Targeted device gets v85.1.0, others v85.0.0")
+    finally:
+        remove_releases()
+
+def test_min_version():
+    """Devices below a release's min_version are not offered it"""
+    print("3. Testing min_version...")
+    try:
+        add_release("v85.2.0", min_version="v2.0.0")
+        assert offered("cc0000000003", current_version="v1.9.9") is None
+        assert offered("cc0000000003", current_version="v2.0.0") == "v85.2.0"
+        print("   ✅ min_version enforced")
+    finally:
+        remove_releases()
+
+def test_answers_are_cached_and_invalidated():
+    """Answers come from memory without SQL and are dropped when the catalog reloads"""
+    print("4. Testing the answer cache...")
+    try:
+        add_release("v85.3.0")
+        generation = main.firmware_catalog_generation
+        connect = sqlite3.connect
+
+        def no_sql(*args, **kwargs):
+            raise AssertionError("OTA decision touched the database")
+
+        main.sqlite3.connect = no_sql
+        try:
+            assert offered("cc0000000004") == "v85.3.0"
+            assert ("cc0000000004", "v1.0.0", PRODUCT, main.DEFAULT_FIRMWARE_VARIANT,
+                    main.DEFAULT_FIRMWARE_CHANNEL) in main.firmware_answer_cache
+        finally:
+            main.sqlite3.connect = connect
+
+        add_release("v85.4.0")
+        assert main.firmware_catalog_generation == generation + 1
+        assert offered("cc0000000004") == "v85.4.0"
+        print("   ✅ Answered without SQL, new release seen after reload")
+    finally:
+        remove_releases()
+
+def main_tests():
+    return run_tests("🗃️ Testing Firmware Catalog", [
+        test_parse_target_devices,
+        test_targeted_release,
+        test_min_version,
+        test_answers_are_cached_and_invalidated,
+    ])
+
+if __name__ == "__main__":
+    sys.exit(0 if main_tests() else 1)
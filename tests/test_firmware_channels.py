@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Test script for the product, variant and channel aware firmware catalog: the
+firmware_latest pointers, /api/firmware/latest-stable and channel selection in
+OTA checks.
+Runs the API in-process against a throwaway database (see isolated_api); test
+releases are removed afterwards.
+"""
+
+import os
+import sqlite3
+import sys
+
+# Add the repository root to the path so the tests package imports when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.isolated_api import client, main, run_tests
+
+PRODUCT = "test_channels"
+
+# (version, variant, channel): beta is ahead of stable, nightly is behind beta
+RELEASES = [
+    ("v95.0.0", "release", "stable"),
+    ("v95.1.0", "release", "beta"),
+    ("v95.0.5", "release", "nightly"),
+    ("v95.0.1", "debug", "stable"),
+]
+
+def add_releases():
+    """Insert fully rolled out releases straight into the catalog tables."""
+    remove_releases()
+    with sqlite3.connect(main.DB_PATH) as conn:
+        for version, variant, channel in RELEASES:
+            conn.execute('''
+                INSERT INTO firmware_versions (version, version_key, filename, checksum, file_size, product, variant, channel)
+                VALUES (?, ?, ?, ?, 1024, ?, ?, ?)
+            ''', (version, main.version_sort_key(version), f"{PRODUCT}_{version}.bin", '0' * 64, PRODUCT, variant, channel))
+    main.load_firmware_catalog()
+
+def remove_releases():
+    with sqlite3.connect(main.DB_PATH) as conn:
+        conn.execute("DELETE FROM firmware_versions WHERE product = ?", (PRODUCT,))
+    main.load_firmware_catalog()
+
+def latest_pointers():
+    with sqlite3.connect(main.DB_PATH) as conn:
+        rows = conn.execute("SELECT variant, channel, version FROM firmware_latest WHERE product = ?", (PRODUCT,)).fetchall()
+    return {(variant, channel): version for variant, channel, version in rows}
+
+def check(variant="release", channel="stable"):
+    return client.get("/api/ota/check", headers={
+        "X-Device-ID": "cc0000000001", "X-Current-Version": "v1.0.0",
+        "X-Device-Product": PRODUCT, "X-Device-Variant": variant, "X-Device-Channel": channel
+    })
+
+def test_latest_pointers():
+    """Each channel points at its newest release, counting more conservative channels"""
+    print("1. Testing firmware_latest pointers...")
+    add_releases()
+    try:
+        assert latest_pointers() == {
+            ("release", "stable"): "v95.0.0",
+            ("release", "beta"): "v95.1.0",
+            ("release", "nightly"): "v95.1.0",
+            ("debug", "stable"): "v95.0.1",
+            ("debug", "beta"): "v95.0.1",
+            ("debug", "nightly"): "v95.0.1",
+        }, latest_pointers()
+        print("   ✅ Nightly follows beta, variants are separate")
+    finally:
+        remove_releases()
+    assert latest_pointers() == {}
+
+def test_latest_stable_endpoint():
+    """/api/firmware/latest-stable answers per product and variant"""
+    print("2. Testing /api/firmware/latest-stable...")
+    add_releases()
+    try:
+        release = client.get("/api/firmware/latest-stable", params={"product": PRODUCT}).json()
+        debug = client.get("/api/firmware/latest-stable", params={"product": PRODUCT, "variant": "debug"}).json()
+        assert (release["version"], debug["version"]) == ("v95.0.0", "v95.0.1"), (release, debug)
+        missing = client.get("/api/firmware/latest-stable", params={"product": "test_channels_none"}).json()
+        assert missing["version"] is None
+        print("   ✅ v95.0.0 for release, v95.0.1 for debug, none for unknown products")
+    finally:
+        remove_releases()
+
+def test_ota_check_by_channel():
+    """Devices are offered the newest release on their product, variant and channel"""
+    print("3. Testing OTA checks by channel...")
+    add_releases()
+    try:
+        offered = {
+            (variant, channel): check(variant, channel).json()["version"]
+            for variant, channel in [("release", "stable"), ("release", "beta"), ("release", "nightly"), ("debug", "stable")]
+        }
+        assert offered == {
+            ("release", "stable"): "v95.0.0",
+            ("release", "beta"): "v95.1.0",
+            ("release", "nightly"): "v95.1.0",
+            ("debug", "stable"): "v95.0.1",
+        }, offered
+        assert check(channel="canary").status_code == 400
+        print("   ✅ Offers match the pointers, unknown channels rejected")
+    finally:
+        remove_releases()
+
+def test_filename_scheme():
+    """Product and variant are parsed from product_version[_variant].bin"""
+    print("4. Testing the upload filename scheme...")
+    assert main.parse_firmware_filename("energy_pebble_v1.2.0.bin", "v1.2.0") == ("energy_pebble", "release")
+    assert main.parse_firmware_filename("energy_pebble_v1.2.0_debug.bin", "v1.2.0") == ("energy_pebble", "debug")
+    assert main.parse_firmware_filename("firmware.bin", "v1.2.0") == (main.DEFAULT_FIRMWARE_PRODUCT, main.DEFAULT_FIRMWARE_VARIANT)
+    print("   ✅ Filenames parsed")
+
+def main_tests():
+    return run_tests("📡 Testing Firmware Channels", [
+        test_latest_pointers,
+        test_latest_stable_endpoint,
+        test_ota_check_by_channel,
+        test_filename_scheme,
+    ])
+
+if __name__ == "__main__":
+    sys.exit(0 if main_tests() else 1)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Test script for firmware delivery: static OTA manifests and resumable
+(Range) firmware downloads.
+Runs the API in-process with FastAPI's TestClient against a throwaway database
+and firmware directory (see isolated_api); test releases are removed afterwards.
+"""
+
+import hashlib
+import os
+import sqlite3
+import sys
+
+# Add the repository root to the path so the tests package imports when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.isolated_api import ADMIN_HEADERS, client, main, run_tests
+
+PRODUCT = "test_delivery"
+
+def add_release(version, min_version=None):
+    """Insert a fully rolled out release straight into the catalog tables."""
+    remove_release(version)
+    with sqlite3.connect(main.DB_PATH) as conn:
+        conn.execute('''
+            INSERT INTO firmware_versions (version, version_key, filename, checksum, file_size, product, variant, channel, min_version)
+            VALUES (?, ?, ?, ?, 1024, ?, 'release', 'stable', ?)
+        ''', (version, main.version_sort_key(version), f"{PRODUCT}_{version}.bin", '0' * 64, PRODUCT, min_version))
+    main.load_firmware_catalog()
+
+def remove_release(version):
+    with sqlite3.connect(main.DB_PATH) as conn:
+        conn.execute("DELETE FROM firmware_versions WHERE version = ?", (version,))
+    main.load_firmware_catalog()
+
+def upload_release(version, data):
+    """Upload a release through the admin API, replacing an earlier test upload."""
+    client.delete(f"/api/firmware/versions/{version}", headers=ADMIN_HEADERS)
+    response = client.post("/api/firmware/upload", headers=ADMIN_HEADERS, files={
+        "firmware_file": (f"{PRODUCT}_{version}.bin", data, "application/octet-stream")
+    }, data={
+        "version": version,
+        "product_name": PRODUCT,
+        "staged_rollout": "false",
+        "sha256_checksum": hashlib.sha256(data).hexdigest(),
+        "md5_checksum": hashlib.md5(data).hexdigest()
+    })
+    assert response.status_code == 200, response.text
+    return response.json()["filename"]
+
+def manifest_path():
+    return f"/firmware/manifests/{PRODUCT}/release/stable.json"
+
+def test_manifest_offers_complete_release():
+    """A fully rolled out release is published with its download URL"""
+    print("1. Testing manifest of a complete release...")
+    add_release("v84.0.0")
+    try:
+        response = client.get(manifest_path())
+        assert response.status_code == 200, response.text
+        manifest = response.json()
+        assert manifest["version"] == "v84.0.0" and manifest["requires_check"] is False
+        assert manifest["download_url"].endswith(f"/firmware/{PRODUCT}_v84.0.0.bin")
+
+        cached = client.get(manifest_path(), headers={"If-None-Match": response.headers["ETag"]})
+        assert cached.status_code == 304
+        print("   ✅ Download URL published, 304 on If-None-Match")
+    finally:
+        remove_release("v84.0.0")
+
+def test_manifest_requires_check_for_min_version():
+    """Releases with a min_version must go through the OTA check"""
+    print("2. Testing manifest of a release with a min_version...")
+    add_release("v84.0.0", min_version="v2.0.0")
+    try:
+        manifest = client.get(manifest_path()).json()
+        assert manifest["requires_check"] is True and "download_url" not in manifest, manifest
+
+        check = client.get("/api/ota/check", headers={
+            "X-Device-ID": "bb0000000001", "X-Current-Version": "v1.0.0", "X-Device-Product": PRODUCT
+        }).json()
+        assert check["update_available"] is False
+        print("   ✅ requires_check set, OTA check enforces the minimum version")
+    finally:
+        remove_release("v84.0.0")
+
+def test_manifest_removed_without_releases():
+    """Manifests of products without releases are removed"""
+    print("3. Testing manifest removal...")
+    add_release("v84.0.0")
+    remove_release("v84.0.0")
+    assert client.get(manifest_path()).status_code == 404
+    assert client.get("/firmware/manifests/Test/release/stable.json").status_code == 400
+    print("   ✅ 404 after the last release is gone, 400 for invalid paths")
+
+def test_latest_manifest_is_published_under_manifests():
+    """latest.json is served from the manifest directory, not the firmware checkout"""
+    print("4. Testing latest.json...")
+    response = client.get("/firmware/latest.json")
+    assert response.status_code == 200, response.text
+    assert response.json()["product"] == main.DEFAULT_FIRMWARE_PRODUCT
+    assert (main.get_manifest_storage_path() / "latest.json").exists()
+    print(f"   ✅ latest.json has version {response.json()['version']}")
+
+def test_resumable_download():
+    """Range requests return the requested bytes, unless If-Range names another version"""
+    print("5. Testing resumable firmware downloads...")
+    data = bytes(range(256)) * 64
+    filename = upload_release("v84.1.0", data)
+    try:
+        full = client.get(f"/firmware/{filename}", headers={"Accept-Encoding": "identity"})
+        assert full.status_code == 200 and full.content == data
+        assert full.headers["Accept-Ranges"] == "bytes"
+        etag = full.headers["ETag"]
+
+        partial = client.get(f"/firmware/{filename}", headers={
+            "Accept-Encoding": "identity", "Range": "bytes=1000-", "If-Range": etag
+        })
+        assert partial.status_code == 206 and partial.content == data[1000:]
+        assert partial.headers["Content-Range"] == f"bytes 1000-{len(data) - 1}/{len(data)}"
+
+        changed = client.get(f"/firmware/{filename}", headers={
+            "Accept-Encoding": "identity", "Range": "bytes=1000-", "If-Range": '"stale"'
+        })
+        assert changed.status_code == 200 and changed.content == data
+
+        unsatisfiable = client.get(f"/firmware/{filename}", headers={
+            "Accept-Encoding": "identity", "Range": f"bytes={len(data)}-"
+        })
+        assert unsatisfiable.status_code == 416
+        assert unsatisfiable.headers["Content-Range"] == f"bytes */{len(data)}"
+
+        chunks = client.get(f"/api/firmware/{filename}/chunks").json()["chunks"]
+        for chunk in chunks:
+            block = data[chunk["offset"]:chunk["offset"] + chunk["size"]]
+            assert hashlib.sha256(block).hexdigest() == chunk["sha256"]
+        print(f"   ✅ 206/200/416 as expected, {len(chunks)} chunk hashes verified")
+    finally:
+        client.delete("/api/firmware/versions/v84.1.0", headers=ADMIN_HEADERS)
+
+def main_tests():
+    return run_tests("📦 Testing Firmware Delivery", [
+        test_manifest_offers_complete_release,
+        test_manifest_requires_check_for_min_version,
+        test_manifest_removed_without_releases,
+        test_latest_manifest_is_published_under_manifests,
+        test_resumable_download,
+    ])
+
+if __name__ == "__main__":
+    sys.exit(0 if main_tests() else 1)
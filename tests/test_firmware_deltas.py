@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Test script for delta firmware updates: patch creation on upload, OTA offers and downloads.
+Runs the API in-process against a throwaway database and firmware directory
+(see isolated_api); test releases are removed afterwards.
+"""
+
+import hashlib
+import io
+import os
+import random
+import sys
+
+# Add the repository root to the path so the tests package imports when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.isolated_api import ADMIN_HEADERS, client, main, run_tests
+
+import detools
+
+PRODUCT = "test_deltas"
+
+def image(seed, size=64 * 1024):
+    return random.Random(seed).randbytes(size)
+
+def checksum(data):
+    return f"sha256:{hashlib.sha256(data).hexdigest()}"
+
+def upload_release(version, data):
+    """Upload a stable release through the admin API, replacing an earlier test upload."""
+    client.delete(f"/api/firmware/versions/{version}", headers=ADMIN_HEADERS)
+    response = client.post("/api/firmware/upload", headers=ADMIN_HEADERS, files={
+        "firmware_file": (f"{PRODUCT}_{version}.bin", data, "application/octet-stream")
+    }, data={
+        "version": version,
+        "product_name": PRODUCT,
+        "sha256_checksum": hashlib.sha256(data).hexdigest(),
+        "md5_checksum": hashlib.md5(data).hexdigest()
+    })
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def remove_releases(*versions):
+    for version in versions:
+        client.delete(f"/api/firmware/versions/{version}", headers=ADMIN_HEADERS)
+
+def ota_check(current_version):
+    response = client.get("/api/ota/check", headers={
+        "X-Device-ID": "ab3000000001", "X-Current-Version": current_version, "X-Device-Product": PRODUCT
+    })
+    main.release_download_lease("ab3000000001")
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def test_patch_created_and_offered():
+    """Uploading a stable release creates a patch from the previous one, offered to its devices"""
+    print("1. Testing delta creation and offers...")
+    old = image(1)
+    new = bytearray(old)
+    new[1000:1010] = b"0123456789"
+    new = bytes(new)
+    try:
+        upload_release("v89.0.0", old)
+        upload_release("v89.1.0", new)
+
+        update = ota_check("v89.0.0")
+        assert update["version"] == "v89.1.0" and "delta" in update, update
+        delta = update["delta"]
+        assert delta["from_version"] == "v89.0.0" and delta["size_bytes"] < len(new) * main.DELTA_MAX_SIZE_RATIO
+
+        filename = delta["download_url"].rsplit("/", 1)[1]
+        response = client.get(f"/firmware/delta/{filename}")
+        assert response.status_code == 200 and checksum(response.content) == delta["checksum"]
+
+        patched = io.BytesIO()
+        detools.apply_patch(io.BytesIO(old), io.BytesIO(response.content), patched)
+        assert checksum(patched.getvalue()) == update["checksum"]
+
+        assert "delta" not in ota_check("v1.0.0")
+        print(f"   ✅ {delta['size_bytes']} byte patch of a {len(new)} byte image rebuilds it")
+    finally:
+        remove_releases("v89.1.0", "v89.0.0")
+
+def test_unhelpful_patch_is_skipped():
+    """Patches that don't save enough over the full image are not kept"""
+    print("2. Testing delta size limits...")
+    try:
+        upload_release("v89.2.0", image(2))
+        result = upload_release("v89.3.0", image(3))
+        assert not result.get("deltas"), result.get("deltas")
+        assert "delta" not in ota_check("v89.2.0")
+        print("   ✅ No patch between unrelated images")
+    finally:
+        remove_releases("v89.3.0", "v89.2.0")
+
+def test_deleting_release_removes_patches():
+    """Deleting a release removes the patches from and to it"""
+    print("3. Testing delta cleanup...")
+    old = image(4)
+    new = old[:-16] + b"\x00" * 16
+    try:
+        upload_release("v89.4.0", old)
+        upload_release("v89.5.0", new)
+        filename = ota_check("v89.4.0")["delta"]["download_url"].rsplit("/", 1)[1]
+        assert (main.get_delta_storage_path() / filename).exists()
+
+        remove_releases("v89.4.0")
+        assert not (main.get_delta_storage_path() / filename).exists()
+        assert client.get(f"/firmware/delta/{filename}").status_code == 404
+        assert client.get("/firmware/delta/..%2Fmain.py").status_code in (400, 404)
+        print("   ✅ Patch removed with its base release")
+    finally:
+        remove_releases("v89.5.0", "v89.4.0")
+
+def main_tests():
+    return run_tests("🩹 Testing Delta Firmware Updates", [
+        test_patch_created_and_offered,
+        test_unhelpful_patch_is_skipped,
+        test_deleting_release_removes_patches,
+    ])
+
+if __name__ == "__main__":
+    sys.exit(0 if main_tests() else 1)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Test script for firmware integrity verification and the in-memory download index.
+Runs the API in-process against a throwaway database and firmware directory
+(see isolated_api); test releases are removed afterwards.
+"""
+
+import hashlib
+import os
+import sqlite3
+import sys
+
+# Add the repository root to the path so the tests package imports when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.isolated_api import ADMIN_HEADERS, client, main, run_tests
+
+PRODUCT = "test_integrity"
+VERSION = "v92.0.0"
+
+def upload_release(data):
+    """Upload the test release through the admin API, replacing an earlier test upload."""
+    client.delete(f"/api/firmware/versions/{VERSION}", headers=ADMIN_HEADERS)
+    response = client.post("/api/firmware/upload", headers=ADMIN_HEADERS, files={
+        "firmware_file": (f"{PRODUCT}_{VERSION}.bin", data, "application/octet-stream")
+    }, data={
+        "version": VERSION,
+        "product_name": PRODUCT,
+        "sha256_checksum": hashlib.sha256(data).hexdigest(),
+        "md5_checksum": hashlib.md5(data).hexdigest()
+    })
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def remove_release():
+    client.delete(f"/api/firmware/versions/{VERSION}", headers=ADMIN_HEADERS)
+
+def integrity_status(filename):
+    response = client.post("/api/firmware/integrity", headers=ADMIN_HEADERS)
+    assert response.status_code == 200, response.text
+    return next(result["status"] for result in response.json()["files"] if result["file"] == filename)
+
+def download(filename):
+    return client.get(f"/firmware/{filename}", headers={"Accept-Encoding": "identity"})
+
+def test_uploads_are_verified():
+    """Uploaded images are hashed once and reported as ok"""
+    print("1. Testing verification at upload...")
+    release = upload_release(os.urandom(8192))
+    try:
+        assert main.get_firmware_integrity(release["filename"])["status"] == "ok"
+        response = client.get("/api/firmware/integrity", headers=ADMIN_HEADERS)
+        assert response.status_code == 200 and release["filename"] not in response.json()["failed"]
+        user = {"Remote-User": "someone", "Remote-Groups": "users"}
+        assert client.get("/api/firmware/integrity", headers=user).status_code == 403
+        assert client.post("/api/firmware/integrity", headers=user).status_code == 403
+        print("   ✅ ok after upload, admin only")
+    finally:
+        remove_release()
+
+def test_corrupted_file_is_not_served():
+    """A file that no longer matches its checksum is refused until it is restored"""
+    print("2. Testing corrupted firmware...")
+    data = os.urandom(8192)
+    release = upload_release(data)
+    blob_path = main.get_blob_path(release["blob_sha256"])
+    try:
+        blob_path.write_bytes(b"\x00" * len(data))
+        assert integrity_status(release["filename"]) == "checksum_mismatch"
+        assert download(release["filename"]).status_code == 500
+
+        blob_path.write_bytes(data)
+        assert integrity_status(release["filename"]) == "ok"
+        assert download(release["filename"]).content == data
+        print("   ✅ Refused while corrupted, served again once restored")
+    finally:
+        remove_release()
+
+def test_missing_file_is_not_served():
+    """A file missing from disk is reported and answered with 404"""
+    print("3. Testing missing firmware...")
+    release = upload_release(os.urandom(8192))
+    try:
+        main.get_blob_path(release["blob_sha256"]).unlink()
+        assert integrity_status(release["filename"]) == "missing"
+        assert download(release["filename"]).status_code == 404
+        print("   ✅ Reported missing, 404 on download")
+    finally:
+        remove_release()
+
+def test_downloads_skip_the_database():
+    """Downloads are resolved from the in-memory index"""
+    print("4. Testing downloads from the in-memory index...")
+    data = os.urandom(8192)
+    release = upload_release(data)
+    connect = sqlite3.connect
+
+    def no_sql(*args, **kwargs):
+        raise AssertionError("download touched the database")
+
+    try:
+        main.sqlite3.connect = no_sql
+        try:
+            response = download(release["filename"])
+        finally:
+            main.sqlite3.connect = connect
+        assert response.status_code == 200 and response.content == data
+        print("   ✅ Served without SQL")
+    finally:
+        remove_release()
+
+def main_tests():
+    return run_tests("🔐 Testing Firmware Integrity", [
+        test_uploads_are_verified,
+        test_corrupted_file_is_not_served,
+        test_missing_file_is_not_served,
+        test_downloads_skip_the_database,
+    ])
+
+if __name__ == "__main__":
+    sys.exit(0 if main_tests() else 1)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Test script for firmware transfer offload: X-Accel-Redirect answers for the Caddy front end.
+Runs the API in-process against a throwaway database and firmware directory
+(see isolated_api) with offloading switched on; test releases are removed afterwards.
+"""
+
+import hashlib
+import os
+import sys
+
+# Add the repository root to the path so the tests package imports when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.isolated_api import ADMIN_HEADERS, client, main, run_tests
+
+PRODUCT = "test_offload"
+VERSION = "v91.0.0"
+DATA = b"".join(f"{PRODUCT} block {index}\n".encode() for index in range(4000))
+
+def remove_release():
+    """Remove the test release and switch offloading back off."""
+    main.FIRMWARE_ACCEL_REDIRECT = False
+    client.delete(f"/api/firmware/versions/{VERSION}", headers=ADMIN_HEADERS)
+
+def upload_release():
+    """Upload the test release with offloading switched on."""
+    remove_release()
+    main.FIRMWARE_ACCEL_REDIRECT = True
+    response = client.post("/api/firmware/upload", headers=ADMIN_HEADERS, files={
+        "firmware_file": (f"{PRODUCT}_{VERSION}.bin", DATA, "application/octet-stream")
+    }, data={
+        "version": VERSION,
+        "product_name": PRODUCT,
+        "sha256_checksum": hashlib.sha256(DATA).hexdigest(),
+        "md5_checksum": hashlib.md5(DATA).hexdigest()
+    })
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def internal_file(response):
+    """The file an X-Accel-Redirect answer points Caddy at."""
+    redirect = response.headers["X-Accel-Redirect"]
+    assert redirect.startswith(main.FIRMWARE_ACCEL_PREFIX), redirect
+    return main.get_firmware_storage_path() / redirect[len(main.FIRMWARE_ACCEL_PREFIX):]
+
+def test_image_download_is_offloaded():
+    """The API answers with headers only and points Caddy at the image blob"""
+    print("1. Testing offloaded image downloads...")
+    release = upload_release()
+    try:
+        response = client.get(f"/firmware/{release['filename']}", headers={"Accept-Encoding": "identity"})
+        assert response.status_code == 200 and response.content == b""
+        assert internal_file(response) == main.get_blob_path(release["blob_sha256"])
+        assert internal_file(response).read_bytes() == DATA
+        assert response.headers["X-Firmware-Checksum"] == release["checksum"]
+        assert "ETag" not in response.headers and "attachment" in response.headers["Content-Disposition"]
+        print(f"   ✅ Redirected to {response.headers['X-Accel-Redirect']}")
+    finally:
+        remove_release()
+
+def test_variant_download_is_offloaded():
+    """Compressed variants are offloaded with their Content-Encoding"""
+    print("2. Testing offloaded variant downloads...")
+    release = upload_release()
+    try:
+        response = client.get(f"/firmware/{release['filename']}", params={"encoding": "gzip"})
+        assert response.status_code == 200 and response.headers["Content-Encoding"] == "gzip"
+        compressed = internal_file(response).read_bytes()
+        assert f"sha256:{hashlib.sha256(compressed).hexdigest()}" == response.headers["X-Content-Checksum"]
+        print("   ✅ gzip variant redirected")
+    finally:
+        remove_release()
+
+def test_validation_stays_in_the_api():
+    """Unknown and invalid files are rejected before anything is offloaded"""
+    print("3. Testing request validation with offloading...")
+    release = upload_release()
+    try:
+        missing = client.get(f"/firmware/{PRODUCT}_v0.0.1.bin")
+        assert missing.status_code == 404 and "X-Accel-Redirect" not in missing.headers
+        assert client.get("/firmware/..%2Fmain.py").status_code in (400, 404)
+        assert client.get(f"/firmware/{release['filename']}", params={"encoding": "br"}).status_code == 404
+
+        chunks = client.get(f"/api/firmware/{release['filename']}/chunks").json()
+        assert chunks["etag"] is None and chunks["chunks"]
+        print("   ✅ 404/400 from the API, chunk manifests carry no ETag")
+    finally:
+        remove_release()
+
+def main_tests():
+    return run_tests("🚚 Testing Firmware Transfer Offload", [
+        test_image_download_is_offloaded,
+        test_variant_download_is_offloaded,
+        test_validation_stays_in_the_api,
+    ])
+
+if __name__ == "__main__":
+    sys.exit(0 if main_tests() else 1)
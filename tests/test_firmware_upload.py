@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Test script for firmware uploads: streaming to a temp file, server-side hashing and
+rejection of uploads that don't match their checksums or exceed the size limit.
+Runs the API in-process against a throwaway database and firmware directory
+(see isolated_api); test releases are removed afterwards.
+"""
+
+import hashlib
+import io
+import os
+import sqlite3
+import sys
+
+# Add the repository root to the path so the tests package imports when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.isolated_api import ADMIN_HEADERS, client, main, run_tests
+
+PRODUCT = "test_upload"
+VERSION = "v93.0.0"
+
+def post_upload(data, sha256_checksum=None, md5_checksum=None):
+    return client.post("/api/firmware/upload", headers=ADMIN_HEADERS, files={
+        "firmware_file": (f"{PRODUCT}_{VERSION}.bin", data, "application/octet-stream")
+    }, data={
+        "version": VERSION,
+        "product_name": PRODUCT,
+        "sha256_checksum": sha256_checksum or hashlib.sha256(data).hexdigest(),
+        "md5_checksum": md5_checksum or hashlib.md5(data).hexdigest()
+    })
+
+def remove_release():
+    client.delete(f"/api/firmware/versions/{VERSION}", headers=ADMIN_HEADERS)
+
+def release_exists():
+    with sqlite3.connect(main.DB_PATH) as conn:
+        return conn.execute("SELECT COUNT(*) FROM firmware_versions WHERE version = ?", (VERSION,)).fetchone()[0] > 0
+
+def leftover_uploads():
+    return [path.name for path in main.get_firmware_storage_path().glob("*.part")]
+
+def test_upload_is_hashed_and_stored():
+    """Accepted uploads are stored as their blob with the server's checksums"""
+    print("1. Testing a valid upload...")
+    data = os.urandom(3 * main.FIRMWARE_UPLOAD_CHUNK_SIZE // 2)
+    remove_release()
+    try:
+        response = post_upload(data, sha256_checksum=f"sha256:{hashlib.sha256(data).hexdigest().upper()}")
+        assert response.status_code == 200, response.text
+        result = response.json()
+        assert result["checksum"] == f"sha256:{hashlib.sha256(data).hexdigest()}"
+        assert result["md5_checksum"] == hashlib.md5(data).hexdigest() and result["file_size"] == len(data)
+        assert main.get_blob_path(result["blob_sha256"]).read_bytes() == data
+        assert leftover_uploads() == []
+        print(f"   ✅ {len(data)} bytes stored as blob {result['blob_sha256'][:12]}")
+    finally:
+        remove_release()
+
+def test_checksum_mismatch_is_rejected():
+    """Uploads that don't match the build's SHA256 or MD5 leave nothing behind"""
+    print("2. Testing checksum mismatches...")
+    data = os.urandom(4096)
+    remove_release()
+    for checksums in ({"sha256_checksum": "0" * 64}, {"md5_checksum": "0" * 32}):
+        response = post_upload(data, **checksums)
+        assert response.status_code == 400 and "mismatch" in response.json()["detail"], response.text
+        assert not release_exists()
+        assert not main.get_blob_path(hashlib.sha256(data).hexdigest()).exists()
+        assert leftover_uploads() == []
+    print("   ✅ 400 for SHA256 and MD5 mismatches, no files kept")
+
+def test_oversized_upload_is_rejected():
+    """Uploads over the size limit are cut off with 413"""
+    print("3. Testing the upload size limit...")
+    max_bytes = main.FIRMWARE_MAX_UPLOAD_BYTES
+    main.FIRMWARE_MAX_UPLOAD_BYTES = 4096
+    remove_release()
+    try:
+        response = post_upload(os.urandom(4097))
+        assert response.status_code == 413, response.text
+        assert not release_exists() and leftover_uploads() == []
+        print("   ✅ 413, no files kept")
+    finally:
+        main.FIRMWARE_MAX_UPLOAD_BYTES = max_bytes
+
+def test_receive_firmware_upload():
+    """The streaming copy hashes exactly what it writes"""
+    print("4. Testing the streaming copy...")
+    data = os.urandom(2 * main.FIRMWARE_UPLOAD_CHUNK_SIZE + 17)
+    temp_path, size, sha256_hex, md5_hex = main.receive_firmware_upload(io.BytesIO(data), main.get_firmware_storage_path(), "stream.bin")
+    try:
+        assert size == len(data) and temp_path.read_bytes() == data
+        assert (sha256_hex, md5_hex) == (hashlib.sha256(data).hexdigest(), hashlib.md5(data).hexdigest())
+        print(f"   ✅ {size} bytes copied and hashed in one pass")
+    finally:
+        temp_path.unlink()
+
+def main_tests():
+    return run_tests("📤 Testing Firmware Uploads", [
+        test_upload_is_hashed_and_stored,
+        test_checksum_mismatch_is_rejected,
+        test_oversized_upload_is_rejected,
+        test_receive_firmware_upload,
+    ])
+
+if __name__ == "__main__":
+    sys.exit(0 if main_tests() else 1)
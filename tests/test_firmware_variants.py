@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Test script for precompressed firmware variants: content negotiation and their
+place in the blob store.
+Runs the API in-process against a throwaway database and firmware directory
+(see isolated_api); test releases are removed afterwards.
+"""
+
+import hashlib
+import os
+import sqlite3
+import sys
+
+# Add the repository root to the path so the tests package imports when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.isolated_api import ADMIN_HEADERS, client, main, run_tests
+
+PRODUCT = "test_variants"
+
+def image(seed):
+    """A compressible firmware image."""
+    return b"".join(f"{PRODUCT} {seed} block {index}\n".encode() for index in range(4000))
+
+def upload_release(version, data):
+    """Upload a release through the admin API, replacing an earlier test upload."""
+    client.delete(f"/api/firmware/versions/{version}", headers=ADMIN_HEADERS)
+    response = client.post("/api/firmware/upload", headers=ADMIN_HEADERS, files={
+        "firmware_file": (f"{PRODUCT}_{version}.bin", data, "application/octet-stream")
+    }, data={
+        "version": version,
+        "product_name": PRODUCT,
+        "sha256_checksum": hashlib.sha256(data).hexdigest(),
+        "md5_checksum": hashlib.md5(data).hexdigest()
+    })
+    assert response.status_code == 200, response.text
+    return response.json()["filename"]
+
+def remove_releases(*versions):
+    for version in versions:
+        client.delete(f"/api/firmware/versions/{version}", headers=ADMIN_HEADERS)
+
+def variant_blobs(filename):
+    with sqlite3.connect(main.DB_PATH) as conn:
+        return dict(conn.execute("SELECT encoding, blob_sha256 FROM firmware_variants WHERE filename = ?", (filename,)).fetchall())
+
+def blob_refcount(sha256_hex):
+    with sqlite3.connect(main.DB_PATH) as conn:
+        row = conn.execute("SELECT refcount FROM firmware_blobs WHERE sha256 = ?", (sha256_hex,)).fetchone()
+    return row and row[0]
+
+def test_content_negotiation():
+    """Clients get the smallest encoding they accept, or the one they ask for"""
+    print("1. Testing content negotiation...")
+    data = image(1)
+    try:
+        filename = upload_release("v90.0.0", data)
+        gzipped = client.get(f"/firmware/{filename}", headers={"Accept-Encoding": "gzip"})
+        assert gzipped.status_code == 200 and gzipped.headers["Content-Encoding"] == "gzip"
+        assert gzipped.content == data and "Accept-Encoding" in gzipped.headers["Vary"]
+
+        identity = client.get(f"/firmware/{filename}", params={"encoding": "identity"}, headers={"Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in identity.headers and identity.content == data
+        assert client.get(f"/firmware/{filename}", params={"encoding": "br"}).status_code == 404
+        print("   ✅ gzip negotiated, identity on request, unknown encodings 404")
+    finally:
+        remove_releases("v90.0.0")
+
+def test_variants_are_blobs():
+    """Variants live in the blob store, not next to the images"""
+    print("2. Testing variant storage...")
+    data = image(2)
+    try:
+        filename = upload_release("v90.1.0", data)
+        blobs = variant_blobs(filename)
+        assert set(blobs) == set(main.FIRMWARE_ENCODINGS), blobs
+        for encoding, sha256_hex in blobs.items():
+            path = main.get_blob_path(sha256_hex)
+            assert path.exists() and hashlib.sha256(path.read_bytes()).hexdigest() == sha256_hex
+            suffix = main.FIRMWARE_ENCODINGS[encoding]['suffix']
+            assert not (main.get_firmware_storage_path() / (filename + suffix)).exists()
+        print(f"   ✅ {', '.join(sorted(blobs))} stored as blobs")
+    finally:
+        remove_releases("v90.1.0")
+
+def test_duplicate_variants_are_shared_and_collected():
+    """Identical images share variant blobs, which are removed with the last release using them"""
+    print("3. Testing variant deduplication and garbage collection...")
+    data = image(3)
+    try:
+        first = upload_release("v90.2.0", data)
+        second = upload_release("v90.3.0", data)
+        blobs = variant_blobs(first)
+        assert blobs == variant_blobs(second), (blobs, variant_blobs(second))
+        assert all(blob_refcount(sha256_hex) == 2 for sha256_hex in blobs.values())
+
+        remove_releases("v90.2.0")
+        assert all(blob_refcount(sha256_hex) == 1 and main.get_blob_path(sha256_hex).exists() for sha256_hex in blobs.values())
+        assert client.get(f"/firmware/{second}", headers={"Accept-Encoding": "gzip"}).content == data
+
+        remove_releases("v90.3.0")
+        assert not any(main.get_blob_path(sha256_hex).exists() or blob_refcount(sha256_hex) for sha256_hex in blobs.values())
+        print("   ✅ Shared once, collected after the last delete")
+    finally:
+        remove_releases("v90.2.0", "v90.3.0")
+
+def test_legacy_variants_are_imported():
+    """Variants stored by name are moved into the blob store at startup"""
+    print("4. Testing import of variants stored by name...")
+    data = image(4)
+    try:
+        filename = upload_release("v90.4.0", data)
+        compressed = main.FIRMWARE_ENCODINGS['gzip']['compress'](data)
+        legacy_path = main.get_firmware_storage_path() / (filename + ".gz")
+        legacy_path.write_bytes(compressed)
+        sha256_hex = variant_blobs(filename)['gzip']
+        with sqlite3.connect(main.DB_PATH) as conn:
+            conn.execute("UPDATE firmware_variants SET blob_sha256 = NULL WHERE filename = ? AND encoding = 'gzip'", (filename,))
+        main.collect_firmware_blobs()
+        assert not main.get_blob_path(sha256_hex).exists()
+
+        main.import_legacy_firmware_files()
+        main.load_firmware_catalog()
+        assert variant_blobs(filename)['gzip'] == sha256_hex and blob_refcount(sha256_hex) == 1
+        assert main.get_blob_path(sha256_hex).exists() and not legacy_path.exists()
+        assert client.get(f"/firmware/{filename}", params={"encoding": "gzip"}).content == data
+        print("   ✅ Moved into the blob store and still served")
+    finally:
+        remove_releases("v90.4.0")
+
+def main_tests():
+    return run_tests("🧩 Testing Firmware Variants", [
+        test_content_negotiation,
+        test_variants_are_blobs,
+        test_duplicate_variants_are_shared_and_collected,
+        test_legacy_variants_are_imported,
+    ])
+
+if __name__ == "__main__":
+    sys.exit(0 if main_tests() else 1)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Test script for install telemetry: install duration histograms, failure reasons
+and the admin telemetry endpoint.
+Runs the API in-process with FastAPI's TestClient against a throwaway database
+(see isolated_api); the test release is removed afterwards.
+"""
+
+import os
+import sqlite3
+import sys
+
+# Add the repository root to the path so the tests package imports when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.isolated_api import ADMIN_HEADERS, client, main, run_tests
+
+PRODUCT = "test_telemetry"
+VERSION = "v97.0.0"
+
+def add_release(version):
+    """Insert a fully rolled out release straight into the catalog tables."""
+    remove_release(version)
+    with sqlite3.connect(main.DB_PATH) as conn:
+        conn.execute('''
+            INSERT INTO firmware_versions (version, version_key, filename, checksum, file_size, product, variant, channel)
+            VALUES (?, ?, ?, ?, 1024, ?, 'release', 'stable')
+        ''', (version, main.version_sort_key(version), f"{PRODUCT}_{version}.bin", '0' * 64, PRODUCT))
+    main.load_firmware_catalog()
+
+def remove_release(version):
+    with sqlite3.connect(main.DB_PATH) as conn:
+        conn.execute("DELETE FROM firmware_versions WHERE version = ?", (version,))
+        conn.execute("DELETE FROM ota_install_histograms WHERE version = ?", (version,))
+        conn.execute("DELETE FROM ota_install_failures WHERE version = ?", (version,))
+    main.load_firmware_catalog()
+
+def test_install_telemetry_ignores_unknown_versions():
+    """Devices can't create telemetry for versions that were never published"""
+    print("1. Testing install telemetry for unknown versions...")
+    unknown = "<img src=x onerror=alert(1)>"
+    with sqlite3.connect(main.DB_PATH) as conn:
+        cursor = conn.cursor()
+        main.record_install_telemetry(cursor, "ae0000000001", "completed", unknown, 30, None, None)
+        main.record_install_telemetry(cursor, "ae0000000001", "failed", unknown, None, "boom", None)
+        assert main.get_install_telemetry(cursor, unknown) == []
+    print("   ✅ No telemetry rows for unknown versions")
+
+def test_durations_and_failures_are_counted():
+    """Completed installs land in duration buckets, failures are grouped by reason"""
+    print("2. Testing install histograms and failure reasons...")
+    add_release(VERSION)
+    try:
+        with sqlite3.connect(main.DB_PATH) as conn:
+            cursor = conn.cursor()
+            for duration in (3, 30, 31, 200):
+                main.record_install_telemetry(cursor, "ae0000000002", "completed", VERSION, duration, None, None)
+            main.record_install_telemetry(cursor, "ae0000000002", "failed", VERSION, None, "Timeout after 12s", None)
+            main.record_install_telemetry(cursor, "ae0000000002", "failed", VERSION, None, "timeout after 300s", None)
+            main.record_install_telemetry(cursor, "ae0000000002", "installing", VERSION, 99, None, None)
+            conn.commit()
+            (telemetry,) = main.get_install_telemetry(cursor, VERSION)
+
+        durations = telemetry["install_duration"]
+        assert durations["count"] == 4, durations
+        assert durations["buckets"] == [{"le_seconds": 4, "count": 1}, {"le_seconds": 32, "count": 2},
+                                        {"le_seconds": 256, "count": 1}], durations["buckets"]
+        assert (durations["p50_seconds"], durations["p90_seconds"]) == (32, 256)
+        assert telemetry["failures"] == {"count": 2, "reasons": [{"reason": "timeout after #s", "count": 2}]}
+        print(f"   ✅ p50 {durations['p50_seconds']}s, failures grouped as 'timeout after #s'")
+    finally:
+        remove_release(VERSION)
+
+def test_telemetry_endpoint_requires_admin():
+    """Only admins can read install telemetry"""
+    print("3. Testing the install telemetry endpoint...")
+    response = client.get("/api/firmware/install-telemetry", headers={"Remote-User": "someone", "Remote-Groups": "users"})
+    assert response.status_code == 403, response.text
+    response = client.get("/api/firmware/install-telemetry", params={"version": VERSION}, headers=ADMIN_HEADERS)
+    assert response.status_code == 200 and response.json() == {"versions": [], "total": 0}, response.text
+    print("   ✅ 403 for users, 200 for admins")
+
+def main_tests():
+    return run_tests("📈 Testing Install Telemetry", [
+        test_install_telemetry_ignores_unknown_versions,
+        test_durations_and_failures_are_counted,
+        test_telemetry_endpoint_requires_admin,
+    ])
+
+if __name__ == "__main__":
+    sys.exit(0 if main_tests() else 1)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Test script for conditional OTA checks: answer ETags and 304 Not Modified.
+Runs the API in-process against a throwaway database (see isolated_api); test
+releases use their own product name and are removed afterwards.
+"""
+
+import os
+import sqlite3
+import sys
+
+# Add the repository root to the path so the tests package imports when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.isolated_api import client, main, run_tests
+
+PRODUCT = "test_ota_check"
+
+def add_release(version, checksum='0' * 64):
+    with sqlite3.connect(main.DB_PATH) as conn:
+        conn.execute('''
+            INSERT INTO firmware_versions (version, version_key, filename, checksum, file_size, product, variant, channel)
+            VALUES (?, ?, ?, ?, 1024, ?, 'release', 'stable')
+        ''', (version, main.version_sort_key(version), f"{PRODUCT}_{version}.bin", checksum, PRODUCT))
+    main.load_firmware_catalog()
+
+def remove_releases():
+    with sqlite3.connect(main.DB_PATH) as conn:
+        conn.execute("DELETE FROM firmware_versions WHERE product = ?", (PRODUCT,))
+    main.load_firmware_catalog()
+
+def ota_check(device_id, current_version="v1.0.0", etag=None):
+    headers = {"X-Device-ID": device_id, "X-Current-Version": current_version, "X-Device-Product": PRODUCT}
+    if etag:
+        headers["If-None-Match"] = etag
+    return client.get("/api/ota/check", headers=headers)
+
+def test_unchanged_answer_is_not_modified():
+    """Repeating a check with the answer's ETag returns 304"""
+    print("1. Testing conditional OTA checks...")
+    try:
+        add_release("v86.0.0")
+        first = ota_check("ee0000000001")
+        assert first.status_code == 200 and first.json()["version"] == "v86.0.0", first.text
+        main.release_download_lease("ee0000000001")
+
+        again = ota_check("ee0000000001", etag=first.headers["ETag"])
+        assert again.status_code == 304 and again.headers["ETag"] == first.headers["ETag"]
+
+        # Unrelated catalog reloads don't invalidate it
+        main.load_firmware_catalog()
+        assert ota_check("ee0000000001", etag=first.headers["ETag"]).status_code == 304
+        print("   ✅ 304 while the answer is unchanged")
+    finally:
+        main.release_download_lease("ee0000000001")
+        remove_releases()
+
+def test_etag_differs_per_device_and_version():
+    """Different devices or current versions get different ETags"""
+    print("2. Testing ETag inputs...")
+    try:
+        add_release("v86.0.0")
+        etag = ota_check("ee0000000002").headers["ETag"]
+        main.release_download_lease("ee0000000002")
+        assert ota_check("ee0000000003", etag=etag).status_code == 200
+        main.release_download_lease("ee0000000003")
+        latest = ota_check("ee0000000002", current_version="v86.0.0", etag=etag)
+        assert latest.status_code == 200 and latest.json()["update_available"] is False
+        print("   ✅ Another device or version gets a fresh answer")
+    finally:
+        main.release_download_lease("ee0000000002")
+        main.release_download_lease("ee0000000003")
+        remove_releases()
+
+def test_no_stale_answer_after_restart():
+    """A restart resets the catalog generation, but old ETags never match a changed answer"""
+    print("3. Testing ETags across a simulated restart...")
+    try:
+        add_release("v86.1.0")
+        generation = main.firmware_catalog_generation
+        response = ota_check("ee0000000004")
+        etag = response.headers["ETag"]
+        main.release_download_lease("ee0000000004")
+
+        # The release is replaced, then the process restarts and the generation counter
+        # climbs back to the value the old answer was served under
+        remove_releases()
+        main.firmware_catalog_generation = generation - 1
+        add_release("v86.1.0", checksum='1' * 64)
+        assert main.firmware_catalog_generation == generation
+
+        fresh = ota_check("ee0000000004", etag=etag)
+        assert fresh.status_code == 200, fresh.status_code
+        assert fresh.json()["checksum"] == '1' * 64 and fresh.headers["ETag"] != etag
+        print("   ✅ Changed answer served, no stale 304")
+    finally:
+        main.release_download_lease("ee0000000004")
+        remove_releases()
+
+def main_tests():
+    return run_tests("🔁 Testing Conditional OTA Checks", [
+        test_unchanged_answer_is_not_modified,
+        test_etag_differs_per_device_and_version,
+        test_no_stale_answer_after_restart,
+    ])
+
+if __name__ == "__main__":
+    sys.exit(0 if main_tests() else 1)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Test script for OTA log retention: compaction of old ota_logs rows into daily rollups.
+Runs the API in-process against a throwaway database (see isolated_api); test log
+rows use their own version and are removed afterwards.
+"""
+
+import os
+import sqlite3
+import sys
+
+# Add the repository root to the path so the tests package imports when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.isolated_api import ADMIN_HEADERS, client, main, run_tests
+
+VERSION = "v87.0.0"
+
+def add_logs(days_ago, status, count):
+    with sqlite3.connect(main.DB_PATH) as conn:
+        conn.executemany('''
+            INSERT INTO ota_logs (device_id, check_timestamp, current_version, status)
+            VALUES (?, datetime('now', ?, 'start of day', '+12 hours'), ?, ?)
+        ''', [(f"ff00000000{index:02d}", f"-{days_ago} days", VERSION, status) for index in range(count)])
+
+def remove_logs():
+    with sqlite3.connect(main.DB_PATH) as conn:
+        conn.execute("DELETE FROM ota_logs WHERE current_version = ?", (VERSION,))
+        conn.execute("DELETE FROM ota_log_daily WHERE version = ?", (VERSION,))
+
+def log_counts():
+    with sqlite3.connect(main.DB_PATH) as conn:
+        raw = conn.execute("SELECT COUNT(*) FROM ota_logs WHERE current_version = ?", (VERSION,)).fetchone()[0]
+        rollups = conn.execute('''
+            SELECT julianday('now', 'start of day') - julianday(day), status, count
+            FROM ota_log_daily WHERE version = ? ORDER BY 1, 2
+        ''', (VERSION,)).fetchall()
+    return raw, [(int(days), status, count) for days, status, count in rollups]
+
+def ota_stats():
+    response = client.get("/api/firmware/ota-stats", headers=ADMIN_HEADERS)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def test_old_logs_are_rolled_up():
+    """Rows past the retention window become daily rollups, in batches; recent rows stay"""
+    print("1. Testing OTA log compaction...")
+    remove_logs()
+    add_logs(45, "check", 5)
+    add_logs(45, "completed", 2)
+    add_logs(40, "failed", 1)
+    add_logs(2, "check", 3)
+    try:
+        compacted = main.compact_ota_logs(retention_days=30, batch_size=3)
+        assert compacted >= 8, compacted
+        raw, rollups = log_counts()
+        assert raw == 3, raw
+        assert rollups == [(40, "failed", 1), (45, "check", 5), (45, "completed", 2)], rollups
+
+        # Compacting again finds nothing, and later rows for the same day add up
+        assert main.compact_ota_logs(retention_days=30) == 0
+        add_logs(45, "check", 1)
+        assert main.compact_ota_logs(retention_days=30) == 1
+        assert log_counts()[1][1] == (45, "check", 6)
+        print(f"   ✅ {compacted} rows rolled up in batches of 3")
+    finally:
+        remove_logs()
+
+def test_stats_unchanged_by_compaction():
+    """OTA stats totals don't change when raw rows are compacted"""
+    print("2. Testing OTA stats across compaction...")
+    remove_logs()
+    add_logs(45, "completed", 4)
+    try:
+        before = ota_stats()
+        assert main.compact_ota_logs(retention_days=30) >= 4
+        after = ota_stats()
+        for key in ("total_checks", "successful_updates", "failed_updates"):
+            assert before[key] == after[key], (key, before[key], after[key])
+        print(f"   ✅ {after['successful_updates']} successful updates before and after")
+    finally:
+        remove_logs()
+
+def test_compaction_endpoint():
+    """On-demand compaction is admin only and validates the window"""
+    print("3. Testing the compaction endpoint...")
+    remove_logs()
+    add_logs(10, "check", 2)
+    try:
+        user = {"Remote-User": "someone", "Remote-Groups": "users"}
+        assert client.post("/api/firmware/ota-logs/compact", headers=user).status_code == 403
+        assert client.post("/api/firmware/ota-logs/compact", params={"retention_days": 0}, headers=ADMIN_HEADERS).status_code == 422
+
+        response = client.post("/api/firmware/ota-logs/compact", params={"retention_days": 7}, headers=ADMIN_HEADERS)
+        assert response.status_code == 200, response.text
+        # Other tests' old rows may be compacted too
+        assert response.json()["compacted_rows"] >= 2 and response.json()["retention_days"] == 7, response.text
+        assert log_counts() == (0, [(10, "check", 2)])
+        print("   ✅ 403 for users, 422 for a zero window, rows compacted for admins")
+    finally:
+        remove_logs()
+
+def main_tests():
+    return run_tests("🗜️ Testing OTA Log Retention", [
+        test_old_logs_are_rolled_up,
+        test_stats_unchanged_by_compaction,
+        test_compaction_endpoint,
+    ])
+
+if __name__ == "__main__":
+    sys.exit(0 if main_tests() else 1)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Test script for staged rollouts and download admission.
+Runs the API in-process with FastAPI's TestClient against a throwaway database
+(see isolated_api); test releases use their own product names and are removed
+afterwards.
+"""
+
+import os
+import sqlite3
+import sys
+
+# Add the repository root to the path so the tests package imports when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.isolated_api import client, main, run_tests
+
+PRODUCT = "test_rollout"
+VERSION = "v82.0.0"
+
+def add_release(version, product=PRODUCT, rollout=None, state='active', stage_hours_ago=0, **columns):
+    """Insert a release (and optionally its rollout) straight into the catalog tables."""
+    remove_release(version)
+    with sqlite3.connect(main.DB_PATH) as conn:
+        conn.execute('''
+            INSERT INTO firmware_versions (version, version_key, filename, checksum, file_size, product, variant, channel,
+                                           min_version, target_devices)
+            VALUES (?, ?, ?, ?, 1024, ?, 'release', 'stable', ?, ?)
+        ''', (version, main.version_sort_key(version), f"{product}_{version}.bin", '0' * 64, product,
+              columns.get('min_version'), columns.get('target_devices')))
+        if rollout is not None:
+            conn.execute('''
+                INSERT INTO firmware_rollouts (version, percentage, state, stage_started_at)
+                VALUES (?, ?, ?, datetime('now', ?))
+            ''', (version, rollout, state, f'-{stage_hours_ago} hours'))
+    main.load_firmware_catalog()
+
+def remove_release(version):
+    with sqlite3.connect(main.DB_PATH) as conn:
+        conn.execute("DELETE FROM firmware_rollouts WHERE version = ?", (version,))
+        conn.execute("DELETE FROM firmware_versions WHERE version = ?", (version,))
+    main.load_firmware_catalog()
+
+def add_stage_devices(version, percentage, count):
+    """Insert devices on v1.0.0 that fall within the given stage of a release's rollout."""
+    device_ids = [device_id for device_id in (f"ac{index:010x}" for index in range(100000))
+                  if main.device_in_rollout(device_id, version, percentage)][:count]
+    with sqlite3.connect(main.DB_PATH) as conn:
+        for device_id in device_ids:
+            conn.execute('''
+                INSERT INTO devices (device_id, client_ip, device_fingerprint, current_firmware_version, current_firmware_version_key)
+                VALUES (?, '192.0.2.1', ?, 'v1.0.0', ?)
+            ''', (device_id, f"rollout-fp-{device_id}", main.version_sort_key("v1.0.0")))
+    return device_ids
+
+def remove_stage_devices():
+    with sqlite3.connect(main.DB_PATH) as conn:
+        conn.execute("DELETE FROM devices WHERE device_fingerprint LIKE 'rollout-fp-%'")
+
+def set_rollout(version, **values):
+    assignments = ", ".join(f"{column} = ?" for column in values)
+    with sqlite3.connect(main.DB_PATH) as conn:
+        conn.execute(f"UPDATE firmware_rollouts SET {assignments} WHERE version = ?", (*values.values(), version))
+
+def rollout_changes(version):
+    return [change for change in main.evaluate_rollouts() if change['version'] == version]
+
+def ota_check(device_id, current_version="v1.0.0", **headers):
+    return client.get("/api/ota/check", headers={
+        "X-Device-ID": device_id, "X-Current-Version": current_version, "X-Device-Product": PRODUCT, **headers
+    })
+
+def test_rollout_needs_reports_to_advance():
+    """A stage with devices doesn't advance on time alone"""
+    print("1. Testing rollout advancement without install reports...")
+    add_release(VERSION, rollout=1, stage_hours_ago=main.ROLLOUT_STAGE_MIN_HOURS + 1)
+    add_stage_devices(VERSION, 1, main.ROLLOUT_MIN_REPORTS + 2)
+    try:
+        assert rollout_changes(VERSION) == []
+        set_rollout(VERSION, stage_successes=main.ROLLOUT_MIN_REPORTS - 1)
+        assert rollout_changes(VERSION) == []
+        set_rollout(VERSION, stage_successes=main.ROLLOUT_MIN_REPORTS)
+        changes = rollout_changes(VERSION)
+        assert changes and changes[0]['percentage'] == 5 and changes[0]['state'] == 'active', changes
+        print("   ✅ Advanced only after enough reports")
+    finally:
+        remove_stage_devices()
+        remove_release(VERSION)
+
+def test_small_stage_needs_fewer_reports():
+    """Stages with fewer devices than the report minimum need a report from each"""
+    print("2. Testing rollout advancement on a small fleet...")
+    add_release(VERSION, rollout=1, stage_hours_ago=main.ROLLOUT_STAGE_MIN_HOURS + 1)
+    add_stage_devices(VERSION, 1, 2)
+    try:
+        set_rollout(VERSION, stage_successes=1)
+        assert rollout_changes(VERSION) == []
+        set_rollout(VERSION, stage_successes=2)
+        changes = rollout_changes(VERSION)
+        assert changes and changes[0]['percentage'] == 5, changes
+
+        # Two failures from a two-device stage pause it
+        set_rollout(VERSION, stage_successes=0, stage_failures=2)
+        changes = rollout_changes(VERSION)
+        assert changes and changes[0]['state'] == 'paused', changes
+        print("   ✅ Advanced after both devices reported, paused when both failed")
+    finally:
+        remove_stage_devices()
+        remove_release(VERSION)
+
+def test_empty_stage_advances_on_time():
+    """A stage no known device falls into advances once its time is up"""
+    print("3. Testing rollout advancement of an empty stage...")
+    # Targeted at a device that doesn't exist, so no device is in any stage
+    add_release(VERSION, rollout=1, target_devices='["000000000000"]')
+    try:
+        assert rollout_changes(VERSION) == []
+        set_rollout(VERSION, stage_started_at="2000-01-01 00:00:00")
+        changes = rollout_changes(VERSION)
+        assert changes and changes[0]['percentage'] == 5, changes
+        print("   ✅ Advanced without reports")
+    finally:
+        remove_release(VERSION)
+
+def test_rollout_reports_complete_state():
+    """The last stage reports the state actually written"""
+    print("4. Testing rollout completion...")
+    add_release(VERSION, rollout=50, stage_hours_ago=main.ROLLOUT_STAGE_MIN_HOURS + 1)
+    try:
+        set_rollout(VERSION, stage_successes=main.ROLLOUT_MIN_REPORTS)
+        changes = rollout_changes(VERSION)
+        assert changes == [{"version": VERSION, "state": "complete", "percentage": 100, "failure_rate": 0.0}], changes
+        with sqlite3.connect(main.DB_PATH) as conn:
+            state = conn.execute("SELECT state FROM firmware_rollouts WHERE version = ?", (VERSION,)).fetchone()[0]
+        assert state == 'complete'
+        print("   ✅ Completed rollout reported as complete")
+    finally:
+        remove_release(VERSION)
+
+def test_failing_rollout_is_paused_and_stops_offers():
+    """Too many failures pause the rollout, and paused releases are not offered"""
+    print("5. Testing rollout pausing...")
+    add_release(VERSION, rollout=100)
+    try:
+        assert ota_check("aa0000000001").json()["update_available"] is True
+        set_rollout(VERSION, stage_successes=2, stage_failures=main.ROLLOUT_MIN_REPORTS)
+        changes = rollout_changes(VERSION)
+        assert changes and changes[0]['state'] == 'paused', changes
+        assert ota_check("aa0000000002").json()["update_available"] is False
+        print("   ✅ Paused rollout offers no update")
+    finally:
+        remove_release(VERSION)
+
+def test_conditional_check_takes_no_download_slot():
+    """A 304 for a cached offer doesn't lease a download slot"""
+    print("6. Testing conditional OTA checks under download admission...")
+    add_release(VERSION)
+    max_downloads = main.MAX_CONCURRENT_DOWNLOADS
+    try:
+        main.download_leases.clear()
+        response = ota_check("aa0000000003")
+        assert response.json()["update_available"] is True
+        etag = response.headers["ETag"]
+
+        # All slots taken by other devices
+        main.download_leases.clear()
+        main.MAX_CONCURRENT_DOWNLOADS = 1
+        assert main.acquire_download_lease("aa0000000004") is None
+
+        response = ota_check("aa0000000003", **{"If-None-Match": etag})
+        assert response.status_code == 304
+        assert "aa0000000003" not in main.download_leases
+
+        response = ota_check("aa0000000005")
+        assert response.status_code == 200 and response.json()["retry_after"] > 0
+        assert "ETag" not in response.headers and "Retry-After" in response.headers
+        print("   ✅ 304 served without a slot, new offers deferred")
+    finally:
+        main.MAX_CONCURRENT_DOWNLOADS = max_downloads
+        main.download_leases.clear()
+        remove_release(VERSION)
+
+def main_tests():
+    return run_tests("🚀 Testing Rollouts", [
+        test_rollout_needs_reports_to_advance,
+        test_small_stage_needs_fewer_reports,
+        test_empty_stage_advances_on_time,
+        test_rollout_reports_complete_state,
+        test_failing_rollout_is_paused_and_stops_offers,
+        test_conditional_check_takes_no_download_slot,
+    ])
+
+if __name__ == "__main__":
+    sys.exit(0 if main_tests() else 1)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Test script for the incrementally maintained OTA statistics counters.
+Runs the API in-process against a throwaway database (see isolated_api); test
+rows are removed afterwards.
+"""
+
+import os
+import sqlite3
+import sys
+
+# Add the repository root to the path so the tests package imports when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.isolated_api import ADMIN_HEADERS, client, main, run_tests
+
+def ota_stats():
+    response = client.get("/api/firmware/ota-stats", headers=ADMIN_HEADERS)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def version_count(stats, version):
+    return next((entry["device_count"] for entry in stats["version_distribution"] if entry["version"] == version), 0)
+
+def today_activity(stats):
+    with sqlite3.connect(main.DB_PATH) as conn:
+        today = conn.execute("SELECT DATE('now')").fetchone()[0]
+    return next((entry["count"] for entry in stats["recent_activity"] if entry["date"] == today), 0)
+
+def test_logs_bump_status_counters():
+    """Every OTA log row bumps its status total and today's activity"""
+    print("1. Testing status counters...")
+    before = ota_stats()
+    main.log_ota_check("ab2000000001", "v1.0.0", None, "192.0.2.1", "ESP32-HTTPClient/1.0")
+    main.log_ota_check("ab2000000001", "v1.0.0", "v1.1.0", "192.0.2.1", "ESP32-HTTPClient/1.0")
+    with sqlite3.connect(main.DB_PATH) as conn:
+        conn.execute("INSERT INTO ota_logs (device_id, current_version, status) VALUES ('ab2000000001', 'v1.0.0', 'completed')")
+        conn.execute("INSERT INTO ota_logs (device_id, current_version, status) VALUES ('ab2000000001', 'v1.0.0', 'failed')")
+    after = ota_stats()
+    assert after["total_checks"] == before["total_checks"] + 2
+    assert after["successful_updates"] == before["successful_updates"] + 1
+    assert after["failed_updates"] == before["failed_updates"] + 1
+    assert today_activity(after) == today_activity(before) + 4
+    print("   ✅ Totals and daily activity bumped")
+
+def test_version_distribution_follows_devices():
+    """The version distribution follows device inserts, upgrades and deletes"""
+    print("2. Testing the firmware version distribution...")
+    with sqlite3.connect(main.DB_PATH) as conn:
+        conn.execute('''
+            INSERT INTO devices (device_id, client_ip, device_fingerprint, current_firmware_version)
+            VALUES ('ab2000000002', '192.0.2.1', 'countertest-fp', 'v88.0.0')
+        ''')
+    try:
+        assert version_count(ota_stats(), "v88.0.0") == 1
+
+        with sqlite3.connect(main.DB_PATH) as conn:
+            conn.execute("UPDATE devices SET current_firmware_version = 'v88.1.0' WHERE device_id = 'ab2000000002'")
+        stats = ota_stats()
+        assert version_count(stats, "v88.0.0") == 0 and version_count(stats, "v88.1.0") == 1
+        assert "v88.0.0" not in [entry["version"] for entry in stats["version_distribution"]]
+    finally:
+        with sqlite3.connect(main.DB_PATH) as conn:
+            conn.execute("DELETE FROM devices WHERE device_id = 'ab2000000002'")
+    assert version_count(ota_stats(), "v88.1.0") == 0
+    print("   ✅ Counts moved with the device and dropped on delete")
+
+def main_tests():
+    return run_tests("📈 Testing OTA Statistics Counters", [
+        test_logs_bump_status_counters,
+        test_version_distribution_follows_devices,
+    ])
+
+if __name__ == "__main__":
+    sys.exit(0 if main_tests() else 1)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Test script for batched OTA status ingestion: the batch endpoint, the status
+queue and its writer's retry and failure handling.
+Runs the API in-process with FastAPI's TestClient against a throwaway database
+(see isolated_api); the test release is removed afterwards.
+"""
+
+import os
+import sqlite3
+import sys
+
+# Add the repository root to the path so the tests package imports when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.isolated_api import client, main, run_tests
+
+PRODUCT = "test_status"
+VERSION = "v96.0.0"
+
+def add_release(version):
+    """Insert a fully rolled out release straight into the catalog tables."""
+    remove_release(version)
+    with sqlite3.connect(main.DB_PATH) as conn:
+        conn.execute('''
+            INSERT INTO firmware_versions (version, version_key, filename, checksum, file_size, product, variant, channel)
+            VALUES (?, ?, ?, ?, 1024, ?, 'release', 'stable')
+        ''', (version, main.version_sort_key(version), f"{PRODUCT}_{version}.bin", '0' * 64, PRODUCT))
+    main.load_firmware_catalog()
+
+def remove_release(version):
+    with sqlite3.connect(main.DB_PATH) as conn:
+        conn.execute("DELETE FROM firmware_versions WHERE version = ?", (version,))
+        conn.execute("DELETE FROM ota_install_histograms WHERE version = ?", (version,))
+        conn.execute("DELETE FROM ota_install_failures WHERE version = ?", (version,))
+    main.load_firmware_catalog()
+
+def test_batch_status_ingestion():
+    """Batched status events are queued and written in order"""
+    print("1. Testing batched status reports...")
+    device_id = "ad0000000001"
+    add_release(VERSION)
+    try:
+        response = client.post(f"/api/ota/status/{device_id}/batch", json={"events": [
+            {"status": "downloading", "timestamp": "2026-01-01T10:00:00Z"},
+            {"status": "installing", "timestamp": "2026-01-01T10:01:00Z"},
+            {"status": "completed", "current_version": VERSION, "install_duration": 95, "timestamp": "2026-01-01T10:03:00Z"},
+        ]})
+        assert response.status_code == 200 and response.json()["events"] == 3, response.text
+        main.flush_ota_status_queue()
+
+        with sqlite3.connect(main.DB_PATH) as conn:
+            rows = conn.execute("SELECT status, check_timestamp FROM ota_logs WHERE device_id = ? ORDER BY id", (device_id,)).fetchall()
+            histogram = conn.execute("SELECT SUM(count) FROM ota_install_histograms WHERE version = ? AND metric = 'install_duration'",
+                                     (VERSION,)).fetchone()[0]
+        assert rows[-3:] == [("downloading", "2026-01-01 10:00:00"), ("installing", "2026-01-01 10:01:00"),
+                             ("completed", "2026-01-01 10:03:00")], rows
+        assert histogram == 1
+        print("   ✅ Events written with their reported timestamps")
+    finally:
+        remove_release(VERSION)
+
+def test_batch_status_limits():
+    """Empty and oversized batches are rejected"""
+    print("2. Testing batch limits...")
+    assert client.post("/api/ota/status/ad0000000002/batch", json={"events": []}).status_code == 400
+    events = [{"status": "downloading"}] * (main.OTA_STATUS_MAX_BATCH_EVENTS + 1)
+    assert client.post("/api/ota/status/ad0000000002/batch", json={"events": events}).status_code == 400
+    print("   ✅ Rejected with 400")
+
+def test_status_flush_retries_and_isolates_bad_events():
+    """A locked database is retried and a bad event doesn't take its batch down"""
+    print("3. Testing status writer failure handling...")
+    write_events = main.write_ota_status_events
+    retry_seconds = main.OTA_STATUS_RETRY_SECONDS
+    attempts = {"count": 0}
+
+    def flaky_write(events):
+        attempts["count"] += 1
+        if attempts["count"] <= 2:
+            raise sqlite3.OperationalError("database is locked")
+        if any(event[1] == "bogus" for event in events):
+            raise ValueError("bogus event")
+        write_events(events)
+
+    main.write_ota_status_events = flaky_write
+    main.OTA_STATUS_RETRY_SECONDS = 0.01
+    try:
+        events = [(f"ad00000001{index:02d}", "bogus" if index == 2 else "downloading", None, None, None, None, None, None)
+                  for index in range(5)]
+        assert main.enqueue_ota_status_events(events)
+        written = main.flush_ota_status_queue()
+        assert written == 4, written
+        with sqlite3.connect(main.DB_PATH) as conn:
+            stored = conn.execute("SELECT COUNT(*) FROM ota_logs WHERE device_id LIKE 'ad00000001%'").fetchone()[0]
+        assert stored >= 4
+        print(f"   ✅ {written} of {len(events)} events written after {attempts['count']} attempts")
+    finally:
+        main.write_ota_status_events = write_events
+        main.OTA_STATUS_RETRY_SECONDS = retry_seconds
+
+def main_tests():
+    return run_tests("📨 Testing OTA Status Ingestion", [
+        test_batch_status_ingestion,
+        test_batch_status_limits,
+        test_status_flush_retries_and_isolates_bad_events,
+    ])
+
+if __name__ == "__main__":
+    sys.exit(0 if main_tests() else 1)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Test script for server-directed polling: per-device poll waits, stretching under
+load, hourly syncs during rollouts and which requests are scheduled at all.
+Runs the API in-process with FastAPI's TestClient against a throwaway database
+(see isolated_api); price data comes from the bundled sample data instead of
+the network.
+"""
+
+import os
+import sqlite3
+import sys
+
+# Add the repository root to the path so the tests package imports when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.isolated_api import client, main, run_tests
+
+async def fetch_sample_data(start_date, num_days=3):
+    return (await main.get_sample_data())['data']
+
+main.fetch_data_for_date_range = fetch_sample_data
+
+DEVICE_ID = "a0b1c2d3e4f6"
+
+def reset_polling_state():
+    """Start from an empty commitment window and an idle poll rate."""
+    main.committed_colors_cache.clear()
+    main.device_poll_times.clear()
+
+def test_poll_wait_stays_within_interval():
+    """Waits never exceed the interval, so the committed hours stay in hand"""
+    print("1. Testing poll waits...")
+    reset_polling_state()
+    waits = []
+    for device in range(500):
+        main.device_poll_times.clear()
+        waits.append(main.schedule_next_poll(f"{device:012x}", committed_hours=8))
+
+    assert min(waits) >= main.DEVICE_POLL_MIN_SECONDS
+    assert max(waits) <= main.DEVICE_POLL_MAX_SECONDS
+    assert len(set(waits)) > 100  # devices are spread over the interval
+    print(f"   ✅ Waits between {min(waits)}s and {max(waits)}s")
+
+def test_poll_interval_stretches_under_load():
+    """Polls faster than the target rate stretch the interval, up to the maximum"""
+    print("2. Testing poll stretching under load...")
+    reset_polling_state()
+    main.device_poll_times.extend([main.time.time()] * int(main.DEVICE_POLL_TARGET_RATE * 60 * 4))
+    wait = main.schedule_next_poll(DEVICE_ID)
+    main.device_poll_times.clear()
+    assert main.DEVICE_POLL_MIN_SECONDS <= wait <= main.DEVICE_POLL_INTERVAL_SECONDS * 4
+    print(f"   ✅ Next poll in {wait}s at four times the target rate")
+
+def test_device_sync_polls_hourly_during_rollout():
+    """While a release is rolling out, devices on its channel sync at least hourly"""
+    print("3. Testing sync interval during a rollout...")
+    product = "test_sync"
+    with sqlite3.connect(main.DB_PATH) as conn:
+        conn.execute("DELETE FROM firmware_rollouts WHERE version = 'v80.0.0'")
+        conn.execute("DELETE FROM firmware_versions WHERE version = 'v80.0.0'")
+        conn.execute('''
+            INSERT INTO firmware_versions (version, version_key, filename, checksum, file_size, product, variant, channel)
+            VALUES ('v80.0.0', ?, 'test_sync_v80.0.0.bin', ?, 1024, ?, 'release', 'stable')
+        ''', (main.version_sort_key('v80.0.0'), '0' * 64, product))
+        conn.execute("INSERT INTO firmware_rollouts (version, percentage) VALUES ('v80.0.0', 5)")
+    main.load_firmware_catalog()
+
+    try:
+        headers = {"X-Current-Version": "v1.0.0", "X-Device-Product": product}
+        intervals = []
+        for device in range(50):
+            reset_polling_state()
+            sync = client.get("/api/device/sync", headers={**headers, "X-Device-ID": f"{device:012x}"}).json()
+            intervals.append(sync["poll_interval"])
+        assert max(intervals) <= main.DEVICE_POLL_ROLLOUT_MAX_SECONDS, max(intervals)
+        print(f"   ✅ Longest sync interval {max(intervals)}s")
+    finally:
+        with sqlite3.connect(main.DB_PATH) as conn:
+            conn.execute("DELETE FROM firmware_rollouts WHERE version = 'v80.0.0'")
+            conn.execute("DELETE FROM firmware_versions WHERE version = 'v80.0.0'")
+        main.load_firmware_catalog()
+
+def test_only_devices_are_scheduled():
+    """Color requests from devices are scheduled and counted, browser requests are not"""
+    print("4. Testing color requests with and without a device ID...")
+    reset_polling_state()
+    response = client.get("/api/color-code")
+    assert response.status_code == 200, response.text
+    assert "poll_interval" not in response.json() and "Retry-After" not in response.headers
+    assert len(main.device_poll_times) == 0
+
+    response = client.get("/api/color-code", headers={"X-Device-ID": DEVICE_ID})
+    assert response.headers["Retry-After"] == str(response.json()["poll_interval"])
+    assert len(main.device_poll_times) == 1
+    print("   ✅ Only the device request was scheduled")
+
+def main_tests():
+    return run_tests("⏱️ Testing Poll Scheduling", [
+        test_poll_wait_stays_within_interval,
+        test_poll_interval_stretches_under_load,
+        test_device_sync_polls_hourly_during_rollout,
+        test_only_devices_are_scheduled,
+    ])
+
+if __name__ == "__main__":
+    sys.exit(0 if main_tests() else 1)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Test script for semantic version parsing and the indexed integer version keys.
+Runs the API in-process against a throwaway database (see isolated_api); test
+releases and devices are removed afterwards.
+"""
+
+import os
+import sqlite3
+import sys
+
+# Add the repository root to the path so the tests package imports when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.isolated_api import ADMIN_HEADERS, client, main, run_tests
+
+PRODUCT = "test_versions"
+
+def add_release(version):
+    with sqlite3.connect(main.DB_PATH) as conn:
+        conn.execute('''
+            INSERT INTO firmware_versions (version, version_key, filename, checksum, file_size, product, variant, channel)
+            VALUES (?, ?, ?, ?, 1024, ?, 'release', 'stable')
+        ''', (version, main.version_sort_key(version), f"{PRODUCT}_{version}.bin", '0' * 64, PRODUCT))
+
+def remove_releases():
+    with sqlite3.connect(main.DB_PATH) as conn:
+        conn.execute("DELETE FROM firmware_versions WHERE product = ?", (PRODUCT,))
+    main.load_firmware_catalog()
+
+def test_parse_version():
+    """Plain semantic versions parse, anything else doesn't"""
+    print("1. Testing version parsing...")
+    assert main.parse_version("v1.2.3") == main.SemanticVersion(1, 2, 3)
+    assert main.parse_version("1.2") == main.SemanticVersion(1, 2, 0)
+    assert str(main.parse_version("V2")) == "v2.0.0"
+    for invalid in (None, "", "v1.2.3-beta", "v1.2.3.4", "latest", "v1.1000000.0"):
+        assert main.parse_version(invalid) is None, invalid
+    print("   ✅ Parsed and rejected as expected")
+
+def test_sort_keys_order_numerically():
+    """Keys order like the versions, so v1.10.0 is newer than v1.9.0"""
+    print("2. Testing version sort keys...")
+    versions = ["v1.9.0", "v1.10.0", "v0.99.99", "v1.9.10", "v2.0.0"]
+    assert sorted(versions, key=main.version_sort_key) == ["v0.99.99", "v1.9.0", "v1.9.10", "v1.10.0", "v2.0.0"]
+    assert main.compare_versions("v1.10.0", "v1.9.0") == 1
+    assert main.compare_versions("1.2", "v1.2.0") == 0
+    assert main.version_is_newer("v1.10.0", "v1.9.9")
+    print("   ✅ Numeric ordering")
+
+def test_latest_stable_uses_version_order():
+    """The latest release is the highest version, not the newest upload or the highest text"""
+    print("3. Testing latest release selection...")
+    try:
+        add_release("v1.10.0")
+        add_release("v1.9.0")
+        main.load_firmware_catalog()
+        response = client.get("/api/firmware/latest-stable", params={"product": PRODUCT})
+        assert response.status_code == 200 and response.json()["version"] == "v1.10.0", response.text
+        answer = main.get_latest_firmware_for_device("dd1000000001", "v1.9.0", product=PRODUCT)
+        assert answer and answer["version"] == "v1.10.0", answer
+        print("   ✅ v1.10.0 chosen over v1.9.0")
+    finally:
+        remove_releases()
+
+def test_older_than_version_filter():
+    """Admin filtering by firmware version compares the stored keys"""
+    print("4. Testing the older_than_version filter...")
+    devices = {"ab1000000001": "v1.9.0", "ab1000000002": "v1.10.0", "ab1000000003": "v1.10.1"}
+    with sqlite3.connect(main.DB_PATH) as conn:
+        for index, (device_id, version) in enumerate(devices.items()):
+            conn.execute('''
+                INSERT INTO devices (device_id, client_ip, device_fingerprint, current_firmware_version, current_firmware_version_key)
+                VALUES (?, '192.0.2.1', ?, ?, ?)
+            ''', (device_id, f"versiontest-fp{index}", version, main.version_sort_key(version)))
+    try:
+        response = client.get("/api/admin/devices", params={"search": "ab10000000", "older_than_version": "v1.10.1"},
+                              headers=ADMIN_HEADERS)
+        assert response.status_code == 200, response.text
+        assert sorted(device["device_id"] for device in response.json()["devices"]) == ["ab1000000001", "ab1000000002"]
+        bad = client.get("/api/admin/devices", params={"older_than_version": "latest"}, headers=ADMIN_HEADERS)
+        assert bad.status_code == 400
+        print("   ✅ Devices below v1.10.1 listed, invalid versions rejected")
+    finally:
+        with sqlite3.connect(main.DB_PATH) as conn:
+            conn.execute("DELETE FROM devices WHERE device_id IN (?, ?, ?)", tuple(devices))
+        main.device_count_cache.clear()
+
+def main_tests():
+    return run_tests("🔢 Testing Version Keys", [
+        test_parse_version,
+        test_sort_keys_order_numerically,
+        test_latest_stable_uses_version_order,
+        test_older_than_version_filter,
+    ])
+
+if __name__ == "__main__":
+    sys.exit(0 if main_tests() else 1)